@@ -1,12 +1,65 @@
 # app.py
+import numpy as np
 import pandas as pd
 import streamlit as st
-from datetime import timedelta
-import plotly.graph_objects as go
+from functools import partial
 from io import BytesIO
-from collections import Counter
+import threading
+import time
+
+from planificador import (
+    DIAS_FESTIVOS_DEFAULT,
+    FAMILIAS_PRODUCTO_DEFAULT,
+    ORDEN_CRONOLOGICO,
+    ORDENES_ASIGNACION,
+    DiarioPlan,
+    RESOLUCIONES,
+    SITIO_CONSOLIDADO,
+    TIPOS_REGLA_FAMILIA,
+    LibroCargas,
+    LineaHolgura,
+    LineaHolguraSitios,
+    PlanificacionCancelada,
+    REGLAS_CONFLICTO,
+    analizar_ampliacion_capacidad,
+    calcular_estabilizacion_diaria,
+    compactar_plan,
+    comparar_planes,
+    compilar_familias,
+    cubo_a_bytes,
+    cubo_cargas,
+    cubo_cargas_por_sitio,
+    estabilizacion_por_sitio,
+    fusionar_lotes,
+    leer_lotes_concurrente,
+    mejorar_plan,
+    no_encaja_a_bool,
+    ocupacion_por_sitio,
+    parametros_de_sitio,
+    planificar_por_sitio,
+    piramide_ocupacion,
+    preparar_para_mostrar,
+    resolucion_automatica,
+    sitio_de_filas,
+    sitios_plan,
+)
 
 st.set_page_config(page_title="Planificador Lotes Naturiber", layout="wide")
+
+# -------------------------------
+# Tiempos por sección del rerun (diagnóstico y benchmarks/bench_reruns.py)
+# -------------------------------
+_marca_seccion = [time.perf_counter()]
+st.session_state["tiempos_secciones_previo"] = st.session_state.get("tiempos_secciones", {})
+st.session_state["tiempos_secciones"] = {}
+
+def marcar_seccion(nombre: str):
+    """Atribuye a 'nombre' el tiempo transcurrido desde la marca anterior de este rerun."""
+    ahora = time.perf_counter()
+    tiempos = st.session_state.setdefault("tiempos_secciones", {})
+    tiempos[nombre] = tiempos.get(nombre, 0.0) + ahora - _marca_seccion[0]
+    _marca_seccion[0] = ahora
+
 st.title("🧠 Planificador de Lotes Salazón Naturiber1")
 
 # -------------------------------
@@ -35,128 +88,192 @@ estab_cap = st.sidebar.number_input(
     value=4700, step=100, min_value=0
 )
 
-dias_festivos_default = [
-    "2025-01-01", "2025-04-18", "2025-05-01", "2025-08-15",
-    "2025-10-12", "2025-10-13", "2025-11-01", "2025-12-25","2025-12-24","2025-12-31","2026-01-01"
-]
 dias_festivos_list = st.sidebar.multiselect(
     "Selecciona los días festivos",
-    options=dias_festivos_default,
-    default=dias_festivos_default
+    options=DIAS_FESTIVOS_DEFAULT,
+    default=DIAS_FESTIVOS_DEFAULT
 )
-dias_festivos = pd.to_datetime(dias_festivos_list)
 
 ajuste_finde = st.sidebar.checkbox("Ajustar fines de semana (SALIDA)", value=True)
 ajuste_festivos = st.sidebar.checkbox("Ajustar festivos (SALIDA)", value=True)
 
+# Capacidades globales y calendario que recibe el planificador
+params_planificador = dict(
+    cap_ent=(cap_ent_1, cap_ent_2),
+    cap_sal=(cap_sal_1, cap_sal_2),
+    dias_festivos=dias_festivos_list,
+    ajuste_finde=ajuste_finde,
+    ajuste_festivos=ajuste_festivos,
+)
+
 # Botón opcional para limpiar estado
 if st.sidebar.button("🔄 Reiniciar sesión"):
     st.session_state.clear()
     st.rerun()
 
 # -------------------------------
-# Subir archivo Excel
+# Subir archivos Excel (uno o varios; se fusionan por LOTE)
 # -------------------------------
-uploaded_file = st.file_uploader("📂 Sube tu Excel con los lotes", type=["xlsx"])
+uploaded_files = st.file_uploader(
+    "📂 Sube tus Excel con los lotes (uno o varios)", type=["xlsx"], accept_multiple_files=True
+)
+regla_conflicto = REGLAS_CONFLICTO[st.sidebar.radio(
+    "LOTE repetido en varios Excel",
+    options=list(REGLAS_CONFLICTO),
+    help="«Más reciente»: el Excel subido después (y, dentro de él, la última fila). "
+         "«Fila planificada»: la que ya trae ENTRADA_SAL; si hay varias o ninguna, la más reciente."
+)]
+
+@st.cache_data(show_spinner="Leyendo y fusionando los Excel…", max_entries=4)
+def leer_y_fusionar(archivos: tuple, regla: str):
+    """
+    archivos: ((nombre, bytes), ...) en orden de subida. Lee los Excel en paralelo, aparta las filas
+    inválidas, normaliza el resto y lo fusiona por LOTE. Cacheado por contenido y regla: los reruns
+    no vuelven a leer los ficheros. Devuelve (df, df_duplicados, df_rechazados).
+    """
+    nombres = [nombre for nombre, _ in archivos]
+    lecturas = leer_lotes_concurrente([contenido for _, contenido in archivos])
+    df, duplicados = fusionar_lotes([validos for validos, _ in lecturas], nombres, regla)
+    rechazados = pd.concat(
+        [r.assign(ARCHIVO=nombre)[["ARCHIVO"] + list(r.columns)] for nombre, (_, r) in zip(nombres, lecturas)],
+        ignore_index=True
+    )
+    return df, duplicados, rechazados
+marcar_seccion("Barra lateral")
 
 # -------------------------------
-# Funciones auxiliares
+# Editor por ventanas (filtro + paginación + fusión por LOTE)
 # -------------------------------
-def es_habil(fecha):
-    # Hábil si es lunes-viernes y no es festivo (comparando por fecha normalizada)
-    return fecha.weekday() < 5 and fecha.normalize() not in dias_festivos
-
-def siguiente_habil(fecha):
-    f = fecha + timedelta(days=1)
-    while not es_habil(f):
-        f += timedelta(days=1)
-    return f
-
-def anterior_habil(fecha):
-    f = fecha - timedelta(days=1)
-    while not es_habil(f):
-        f -= timedelta(days=1)
-    return f
-
-def _sumar_en_rango(dic, fecha_ini, fecha_fin_inclusive, unds):
-    """Suma 'unds' en dic[fecha] para todas las fechas entre ini y fin (ambas incluidas)."""
-    if pd.isna(fecha_ini) or pd.isna(fecha_fin_inclusive):
-        return
-    for d in pd.date_range(fecha_ini, fecha_fin_inclusive, freq="D"):
-        d0 = d.normalize()
-        dic[d0] = dic.get(d0, 0) + unds
-
-def calcular_estabilizacion_diaria(df_plan: pd.DataFrame, cap: int, estab_cap_overrides: dict | None = None) -> pd.DataFrame:
+def clave_lote(df: pd.DataFrame) -> pd.Index:
+    """Clave de fusión: LOTE como texto (o la etiqueta de fila si no hay LOTE o está duplicado)."""
+    if "LOTE" in df.columns:
+        clave = pd.Index(df["LOTE"].astype(str))
+        if clave.is_unique:
+            return clave
+    return pd.Index(df.index.astype(str))
+
+def filtrar_ventana(df: pd.DataFrame, fecha_ini=None, fecha_fin=None, productos=None, solo_no_encaja=False) -> pd.Series:
     """
-    Calcula la ocupación diaria de la cámara de estabilización.
-    Desglosa por tipo de producto:
-      - Paleta: PRODUCTO empieza por 'P'
-      - Jamón : PRODUCTO empieza por 'J'
-    Un lote ocupa estabilización en los días naturales [DIA, ENTRADA_SAL - 1].
-    Permite overrides de capacidad por fecha.
+    Máscara vectorizada de la ventana del editor:
+      - DIA dentro de [fecha_ini, fecha_fin] (las filas sin DIA se muestran siempre)
+      - PRODUCTO en 'productos' (si se indica alguno)
+      - solo lotes con LOTE_NO_ENCAJA (si 'solo_no_encaja')
     """
-    carga_total  = {}
-    carga_paleta = {}
-    carga_jamon  = {}
-
-    for _, r in df_plan.iterrows():
-        dia     = r.get("DIA")
-        entrada = r.get("ENTRADA_SAL")
-        unds    = int(r.get("UNDS", 0) or 0)
-        prod    = str(r.get("PRODUCTO", ""))
+    mask = pd.Series(True, index=df.index)
+    if "DIA" in df.columns and (fecha_ini is not None or fecha_fin is not None):
+        en_rango = pd.Series(True, index=df.index)
+        if fecha_ini is not None:
+            en_rango &= df["DIA"] >= pd.Timestamp(fecha_ini)
+        if fecha_fin is not None:
+            en_rango &= df["DIA"] < pd.Timestamp(fecha_fin) + pd.Timedelta(days=1)
+        mask &= en_rango | df["DIA"].isna()
+    if productos and "PRODUCTO" in df.columns:
+        mask &= df["PRODUCTO"].astype(str).isin([str(p) for p in productos])
+    if solo_no_encaja and "LOTE_NO_ENCAJA" in df.columns:
+        mask &= no_encaja_a_bool(df["LOTE_NO_ENCAJA"]).fillna(False)
+    return mask
+
+def _mismas_filas(a: pd.DataFrame, b: pd.DataFrame) -> bool:
+    if len(a) != len(b) or list(a.columns) != list(b.columns):
+        return False
+    for col in a.columns:
+        na_a, na_b = a[col].isna().to_numpy(), b[col].isna().to_numpy()
+        if not (na_a == na_b).all():
+            return False
+        val_a = a[col].to_numpy()[~na_a].astype(str)
+        val_b = b[col].to_numpy()[~na_b].astype(str)
+        if not (val_a == val_b).all():
+            return False
+    return True
 
-        if pd.isna(dia) or pd.isna(entrada) or unds <= 0:
+def fusionar_ediciones(df_master: pd.DataFrame, pos_ventana: np.ndarray, df_editada: pd.DataFrame):
+    """
+    Fusiona en el plan maestro las ediciones hechas sobre una ventana. El editor recibe como etiqueta
+    de fila la posición en el plan (pos_ventana), así que cada fila editada vuelve a su sitio aunque
+    se le cambie el LOTE:
+      - filas de la ventana que ya no están en el editor → se eliminan del plan
+      - filas existentes → se sobrescriben en su posición con los valores editados
+      - filas añadidas → se añaden al final
+    Se rechazan (y se devuelven para avisar) las filas añadidas o renombradas cuyo LOTE ya existe en
+    el plan: la fila existente se conserva tal cual.
+    El coste de detectar cambios es proporcional a la ventana; el plan solo se reconstruye si hay cambios.
+    Devuelve (plan_fusionado, hubo_cambios, lotes_rechazados).
+    """
+    editada = df_editada.drop(columns=["🚨", COL_HOLGURA], errors="ignore")
+    if "LOTE" in editada.columns:
+        lote_txt = editada["LOTE"].astype("string").str.strip()
+        editada = editada[lote_txt.notna() & (lote_txt != "")]
+    master = df_master.reset_index(drop=True)
+    if _mismas_filas(preparar_para_mostrar(master.iloc[pos_ventana]), editada):
+        return df_master, False, []
+
+    editada = compactar_plan(editada)
+    # Etiqueta de las filas que ya existían (las añadidas traen otra etiqueta o ninguna)
+    etiquetas = pd.to_numeric(pd.Series(editada.index), errors="coerce").to_numpy()
+    existe = np.isin(etiquetas, pos_ventana)
+    pos = np.where(existe, etiquetas, -1).astype(np.int64)
+    borrar = np.setdiff1d(pos_ventana, pos[existe])
+
+    rechazadas = np.zeros(len(editada), dtype=bool)
+    if "LOTE" in editada.columns and "LOTE" in master.columns:
+        lote_ed = editada["LOTE"].astype(str).to_numpy()
+        lote_master = master["LOTE"].astype(str).to_numpy()
+        cambia = ~existe | (lote_ed != lote_master[np.where(existe, pos, 0)])
+        fuera = np.ones(len(master), dtype=bool)
+        fuera[pos_ventana] = False
+        ocupados = np.concatenate([lote_master[fuera], lote_ed[~cambia]])
+        rechazadas = cambia & (np.isin(lote_ed, ocupados) | pd.Series(lote_ed).duplicated().to_numpy())
+    lotes_rechazados = editada.loc[rechazadas, "LOTE"].astype(str).tolist() if rechazadas.any() else []
+
+    aceptada = ~rechazadas
+    editada, pos, existe = editada[aceptada], pos[aceptada], existe[aceptada]
+    if rechazadas.any() and _mismas_filas(preparar_para_mostrar(master.iloc[pos_ventana]), preparar_para_mostrar(editada)):
+        return df_master, False, lotes_rechazados
+    # Las filas añadidas llegan con huecos: fechas y números vuelven al tipo del plan
+    for col in editada.columns.intersection(master.columns):
+        if pd.api.types.is_datetime64_any_dtype(master[col]):
+            editada[col] = pd.to_datetime(editada[col], errors="coerce")
+        elif pd.api.types.is_numeric_dtype(master[col]) and not pd.api.types.is_bool_dtype(master[col]):
+            editada[col] = pd.to_numeric(editada[col], errors="coerce")
+    conservar = np.ones(len(master), dtype=bool)
+    conservar[borrar] = False
+    conservar[pos[existe]] = False
+    # Las existentes vuelven a su posición; las nuevas van al final, en su orden
+    pos[~existe] = len(master) + np.arange(int((~existe).sum()))
+    editada = editada.set_axis(pos, axis=0)
+    fusion = pd.concat([master[conservar], editada]).sort_index(kind="stable").reset_index(drop=True)
+    return compactar_plan(fusion), True, lotes_rechazados
+
+def aplicar_overrides_propuestos(propuesta: dict):
+    """
+    Callback del botón de ampliación: fusiona por FECHA las capacidades propuestas en las tablas
+    de overrides de la barra lateral (la propuesta sustituye a la fila existente de esa fecha y,
+    si la propuesta es de un sitio, de ese SITIO) y reinicia los editores para que partan de las
+    tablas fusionadas.
+    """
+    for clave_df, clave_prop, clave_editor in (
+        ("cap_overrides_ent_df", "overrides_ent", "cap_overrides_ent_editor"),
+        ("cap_overrides_sal_df", "overrides_sal", "cap_overrides_sal_editor"),
+        ("cap_overrides_estab_df", "overrides_estab", "cap_overrides_estab_editor"),
+    ):
+        nuevo = propuesta[clave_prop]
+        if nuevo.empty:
             continue
-
-        fin = entrada - pd.Timedelta(days=1)
-        if fin.date() < dia.date():
-            continue  # entra el mismo día, no pisa estabilización
-
-        for d in pd.date_range(dia.normalize(), fin.normalize(), freq="D"):
-            d0 = d.normalize()
-            carga_total[d0] = carga_total.get(d0, 0) + unds
-            if prod.startswith("P"):
-                carga_paleta[d0] = carga_paleta.get(d0, 0) + unds
-            elif prod.startswith("J"):
-                carga_jamon[d0] = carga_jamon.get(d0, 0) + unds
-
-    if not carga_total:
-        return pd.DataFrame(columns=[
-            "FECHA", "ESTAB_UNDS", "ESTAB_PALETA", "ESTAB_JAMON",
-            "CAPACIDAD", "UTIL_%", "EXCESO"
-        ])
-
-    df_estab = (
-        pd.Series(carga_total, name="ESTAB_UNDS")
-        .sort_index()
-        .to_frame()
-        .reset_index()
-        .rename(columns={"index": "FECHA"})
-    )
-    df_estab["ESTAB_PALETA"] = df_estab["FECHA"].map(lambda d: int(carga_paleta.get(d.normalize(), 0)))
-    df_estab["ESTAB_JAMON"]  = df_estab["FECHA"].map(lambda d: int(carga_jamon.get(d.normalize(), 0)))
-
-    # Capacidad efectiva por fecha (override si existe)
-    if estab_cap_overrides is None:
-        estab_cap_overrides = {}
-
-    def _cap_for_date(d):
-        if pd.isna(d):
-            return int(cap)
-        key = pd.to_datetime(d).normalize()
-        if key in estab_cap_overrides:
-            return int(estab_cap_overrides[key])
-        return int(cap)
-
-    df_estab["CAPACIDAD"] = df_estab["FECHA"].apply(_cap_for_date)
-    df_estab["UTIL_%"] = (df_estab["ESTAB_UNDS"] / df_estab["CAPACIDAD"] * 100).round(1)
-    df_estab["EXCESO"] = (df_estab["ESTAB_UNDS"] - df_estab["CAPACIDAD"]).clip(lower=0).astype(int)
-
-    df_estab = df_estab[
-        ["FECHA", "ESTAB_UNDS", "ESTAB_PALETA", "ESTAB_JAMON",
-         "CAPACIDAD", "UTIL_%", "EXCESO"]
-    ]
-    return df_estab
+        actual = st.session_state[clave_df].dropna(subset=["FECHA"])
+        misma = pd.to_datetime(actual["FECHA"]).dt.normalize().isin(nuevo["FECHA"])
+        if "SITIO" in nuevo.columns and "SITIO" in actual.columns:
+            misma &= actual["SITIO"].astype("string").eq(nuevo["SITIO"].iloc[0]).fillna(False)
+        actual = actual[~misma]
+        fusion = pd.concat([actual, nuevo], ignore_index=True).sort_values("FECHA", kind="stable")
+        st.session_state[clave_df] = fusion.reset_index(drop=True)
+        st.session_state.pop(clave_editor, None)
+
+def destino_override(fila, clave: str, comunes: dict, parametros_sitio: dict, por_sitio: bool) -> dict:
+    """Dict de overrides al que va una fila del editor: el común o, si trae SITIO (y hay varios), el de ese sitio."""
+    sitio = fila.get("SITIO") if por_sitio else None
+    if pd.isna(sitio) or str(sitio).strip() == "":
+        return comunes
+    return parametros_sitio.setdefault(str(sitio).strip(), {}).setdefault(clave, {})
 
 def generar_excel(df_out, filename="archivo.xlsx"):
     output = BytesIO()
@@ -164,528 +281,238 @@ def generar_excel(df_out, filename="archivo.xlsx"):
     output.seek(0)
     return output
 
+def generar_excel_plan(df_plan: pd.DataFrame):
+    """Excel del plan tal como se muestra (categóricas a texto, LOTE_NO_ENCAJA 'Sí'/'No')."""
+    return generar_excel(preparar_para_mostrar(df_plan), "planificacion_lotes.xlsx")
+
+def generar_cubo(df_plan: pd.DataFrame, familias, formato: str, parametros_sitio=None, **params_libro):
+    """
+    Cubo diario de cargas (día × recurso × familia × capacidad por intento) en parquet o CSV.
+    Con varios sitios, un cubo por sitio con sus capacidades y la columna SITIO.
+    """
+    sitios = sitios_plan(df_plan)
+    if len(sitios) > 1:
+        libros = {s: LibroCargas(**parametros_de_sitio(s, parametros_sitio, **params_libro)) for s in sitios}
+        return cubo_a_bytes(cubo_cargas_por_sitio(df_plan, libros, familias), formato)
+    return cubo_a_bytes(cubo_cargas(df_plan, LibroCargas(**params_libro), familias), formato)
+
+def generar_excel_hojas(hojas: dict):
+    """Excel con una hoja por DataFrame ({nombre_hoja: df})."""
+    output = BytesIO()
+    with pd.ExcelWriter(output) as writer:
+        for nombre, df_out in hojas.items():
+            df_out.to_excel(writer, sheet_name=nombre, index=False)
+    output.seek(0)
+    return output
+
 # -------------------------------
-# Planificador (GLOBAL, overrides por PRODUCTO y estabilización + overrides por FECHA entrada/salida/estab)
+# Diario de versiones del plan (deshacer/rehacer)
 # -------------------------------
-def planificar_filas_na(
-    df_plan,
-    dias_max_almacen_global,
-    dias_max_por_producto,
-    estab_cap,
-    cap_overrides_ent,
-    cap_overrides_sal,
-    estab_cap_overrides
-):
-    df_corr = df_plan.copy()
-
-    # Asegurar columnas auxiliares
-    for col in ["LOTE_NO_ENCAJA"]:
-        if col not in df_corr.columns:
-            df_corr[col] = pd.NA
-
-    # Cargas ya planificadas (se respetan)
-    carga_entrada = df_corr.dropna(subset=["ENTRADA_SAL"]).groupby("ENTRADA_SAL")["UNDS"].sum().to_dict()
-    carga_salida  = df_corr.dropna(subset=["SALIDA_SAL"]).groupby("SALIDA_SAL")["UNDS"].sum().to_dict()
-
-    # Ocupación diaria ya existente en estabilización (por filas ya planificadas)
-    estab_stock = {}
-    for _, r in df_corr.dropna(subset=["ENTRADA_SAL"]).iterrows():
-        dia_rec = r["DIA"]
-        ent     = r["ENTRADA_SAL"]
-        unds    = r["UNDS"]
-        if pd.notna(dia_rec) and pd.notna(ent) and ent.date() > dia_rec.date():
-            _sumar_en_rango(estab_stock, dia_rec, ent - pd.Timedelta(days=1), unds)
-
-    # Helpers: capacidad por día/intent separadas para ENTRADA y SALIDA
-    def get_cap_ent(date_dt, attempt):
-        dkey = pd.to_datetime(date_dt).normalize()
-        ov = cap_overrides_ent.get(dkey)
-        if ov is not None:
-            if attempt == 1 and pd.notna(ov.get("CAP1")):
-                return int(ov["CAP1"])
-            if attempt == 2 and pd.notna(ov.get("CAP2")):
-                return int(ov["CAP2"])
-        return cap_ent_1 if attempt == 1 else cap_ent_2
-
-    def get_cap_sal(date_dt, attempt):
-        dkey = pd.to_datetime(date_dt).normalize()
-        ov = cap_overrides_sal.get(dkey)
-        if ov is not None:
-            if attempt == 1 and pd.notna(ov.get("CAP1")):
-                return int(ov["CAP1"])
-            if attempt == 2 and pd.notna(ov.get("CAP2")):
-                return int(ov["CAP2"])
-        return cap_sal_1 if attempt == 1 else cap_sal_2
-
-    # Capacidad de estabilización por día (override si existe)
-    def get_estab_cap(date_dt):
-        dkey = pd.to_datetime(date_dt).normalize()
-        ov = estab_cap_overrides.get(dkey)
-        return ov if (ov is not None and pd.notna(ov)) else estab_cap
-
-    # Chequeo de capacidad de estabilización en rango [ini, fin]
-    def cabe_en_estab_rango(fecha_ini, fecha_fin_inclusive, unds):
-        if pd.isna(fecha_ini) or pd.isna(fecha_fin_inclusive):
-            return True
-        if fecha_fin_inclusive < fecha_ini:
-            return True
-        for d in pd.date_range(fecha_ini, fecha_fin_inclusive, freq="D"):
-            d0 = d.normalize()
-            if estab_stock.get(d0, 0) + unds > get_estab_cap(d0):
-                return False
-        return True
-
-    # Devuelve déficits de estabilización por día (dict fecha->faltan_unds) para un rango
-    def deficits_estab(fecha_ini, fecha_fin_inclusive, unds):
-        deficits = {}
-        if pd.isna(fecha_ini) or pd.isna(fecha_fin_inclusive):
-            return deficits
-        if fecha_fin_inclusive < fecha_ini:
-            return deficits
-        for d in pd.date_range(fecha_ini, fecha_fin_inclusive, freq="D"):
-            d0 = d.normalize()
-            falta = (estab_stock.get(d0, 0) + unds) - get_estab_cap(d0)
-            if falta > 0:
-                deficits[d0] = int(falta)
-        return deficits
-
-    # REGLAS ESPECIALES DE ENTRADA COMÚN
-    # - Grupos unitarios (mismo día por código):
-    #   ["JBSPRCLC-MEX"], ["JCIVRROD-MEX"], ["JBCPRCLC-MEX"]
-    # - Grupo conjunto (mismo día entre ambos, con fallback por separado):
-    #   ["JCIVRPORCISAN", "PCIVRPORCISAN"]
-    def _aplicar_entrada_comun_para_grupo(codigos, marcar_si_falla=False):
-        if "PRODUCTO" not in df_corr.columns:
-            return False
+def reiniciar_editor_plan():
+    """Descarta el estado del editor del plan (ediciones pendientes por posición de fila)."""
+    st.session_state["epoca_editor"] = st.session_state.get("epoca_editor", 0) + 1
 
-        mask_group = df_corr["PRODUCTO"].astype(str).isin(codigos) & df_corr["ENTRADA_SAL"].isna()
-        if not mask_group.any():
-            return False
-        pending = df_corr.loc[mask_group].copy()
+def registrar_version_plan(df_plan: pd.DataFrame, origen: str, reiniciar_editor=True, sugerencias=None):
+    """
+    Instala df_plan como plan actual y lo anota en el diario de versiones de la sesión.
+    'reiniciar_editor' = False solo para las ediciones hechas en el propio editor.
+    Las sugerencias se guardan con la versión (sin 'sugerencias', la versión hereda las vigentes),
+    así deshacer/rehacer las recupera sin replanificar.
+    """
+    if reiniciar_editor:
+        reiniciar_editor_plan()
+    diario = st.session_state.get("diario_plan")
+    if diario is None:
+        diario = st.session_state["diario_plan"] = DiarioPlan(df_plan, origen)
+        st.session_state["sugerencias_versiones"] = {}
+    else:
+        diario.registrar(df_plan, origen)
+    if sugerencias is None:
+        sugerencias = st.session_state.get("df_sugerencias")
+    if sugerencias is not None:
+        st.session_state["sugerencias_versiones"][diario.actual] = sugerencias
+        st.session_state["df_sugerencias"] = sugerencias
+    st.session_state["df_planificado"] = df_plan
+    st.session_state["plan_version"] = st.session_state.get("plan_version", 0) + 1
+
+def ir_a_version_plan(destino):
+    """Callback de deshacer/rehacer/ir a versión: reconstruye el plan desde el diario."""
+    diario = st.session_state["diario_plan"]
+    anterior = diario.plan
+    if destino == "deshacer":
+        plan = diario.deshacer()
+    elif destino == "rehacer":
+        plan = diario.rehacer()
+    else:
+        plan = diario.ir_a(int(st.session_state[destino]))
+    if plan is anterior:
+        return
+    st.session_state["df_plan_anterior"] = anterior
+    st.session_state["df_planificado"] = plan
+    st.session_state["plan_version"] = st.session_state.get("plan_version", 0) + 1
+    reiniciar_editor_plan()
+    # Sugerencias guardadas con la versión restaurada (si no las hay, se calculan al abrir su sección)
+    sugerencias = st.session_state["sugerencias_versiones"].get(diario.actual)
+    if sugerencias is None:
+        st.session_state.pop("df_sugerencias", None)
+    else:
+        st.session_state["df_sugerencias"] = sugerencias
 
-        fechas_existentes = sorted(
-            df_corr.loc[
-                df_corr["PRODUCTO"].astype(str).isin(codigos) & df_corr["ENTRADA_SAL"].notna(),
-                "ENTRADA_SAL"
-            ].dt.normalize().unique().tolist()
-        )
-        fecha_preferente = fechas_existentes[0] if len(fechas_existentes) > 0 else None
-
-        inicios, limites = [], []
-        for _, r in pending.iterrows():
-            dia_recepcion = r["DIA"]
-            prod = r["PRODUCTO"]
-            dias_max_almacen = dias_max_por_producto.get(prod, dias_max_almacen_global)
-            entrada_ini_i = dia_recepcion if es_habil(dia_recepcion) else siguiente_habil(dia_recepcion)
-            limite_i = dia_recepcion + pd.Timedelta(days=int(dias_max_almacen))
-            inicios.append(entrada_ini_i.normalize())
-            limites.append(limite_i.normalize())
-
-        if not inicios:
-            return False
+# -------------------------------
+# Línea de holgura del plan (pista inline en el editor)
+# -------------------------------
+COL_HOLGURA = "🧮 Máx. UNDS"
+ABREV_RECURSO = {"ENTRADA": "ENT", "SALIDA": "SAL", "ESTABILIZACIÓN": "ESTAB"}
 
-        inicio_comun = max(inicios)
-        limite_comun = min(limites)
-        if inicio_comun > limite_comun:
-            if marcar_si_falla:
-                for idxp, _ in pending.iterrows():
-                    df_corr.at[idxp, "LOTE_NO_ENCAJA"] = "Sí"
-            return False
+def linea_holgura_sesion(df_plan: pd.DataFrame, capacidades: dict, parametros_sitio=None) -> LineaHolgura:
+    """
+    Línea de holgura del plan actual guardada en la sesión: si no cambian las capacidades se
+    sincroniza por filas cambiadas (incremental); si cambian, se reconstruye.
+    Con varios sitios, una línea por sitio con sus capacidades (LineaHolguraSitios).
+    """
+    sitios = sitios_plan(df_plan)
+    firma = repr((capacidades, parametros_sitio, sitios))
+    linea = st.session_state.get("linea_holgura")
+    if linea is None or st.session_state.get("linea_holgura_firma") != firma:
+        if len(sitios) > 1:
+            libros = {s: LibroCargas(**parametros_de_sitio(s, parametros_sitio, **capacidades)) for s in sitios}
+            linea = LineaHolguraSitios(libros, df_plan)
+        else:
+            linea = LineaHolgura(LibroCargas(**capacidades), df_plan)
+        st.session_state["linea_holgura"] = linea
+        st.session_state["linea_holgura_firma"] = firma
+    else:
+        linea.sincronizar(df_plan)
+    return linea
+
+def texto_holgura(h: pd.DataFrame, unds: pd.Series) -> pd.Series:
+    """'máx. 1º intento / 2º intento · recurso que limita', con ⚠️ si el lote ya no cabe."""
+    texto = (
+        h["MAX_UNDS_1"].astype("string") + " / " + h["MAX_UNDS_2"].astype("string")
+        + " · " + h["LIMITE"].map(ABREV_RECURSO).astype("string")
+    )
+    excede = (unds.astype("Float64") > h["MAX_UNDS_2"].astype("Float64")).fillna(False)
+    return texto.where(~excede, "⚠️ " + texto).fillna("")
 
-        def _es_factible_entrada_comun(d, attempt):
-            if d is None:
-                return False
-            d = pd.to_datetime(d).normalize()
-
-            total_unds = int(pending["UNDS"].sum())
-            if carga_entrada.get(d, 0) + total_unds > get_cap_ent(d, attempt):
-                return False
-
-            sim_stock = dict(estab_stock)
-            for _, r in pending.iterrows():
-                dia_rec = r["DIA"]
-                unds_i = int(r["UNDS"])
-                if d.date() > dia_rec.date():
-                    for k in pd.date_range(dia_rec.normalize(), (d - pd.Timedelta(days=1)).normalize(), freq="D"):
-                        k0 = k.normalize()
-                        if sim_stock.get(k0, 0) + unds_i > get_estab_cap(k0):
-                            return False
-                        sim_stock[k0] = sim_stock.get(k0, 0) + unds_i
-
-            add_salida = {}
-            for _, r in pending.iterrows():
-                unds_i = int(r["UNDS"])
-                dias_sal_optimos = int(r["DIAS_SAL_OPTIMOS"])
-                salida = d + timedelta(days=dias_sal_optimos)
-                if ajuste_finde:
-                    if salida.weekday() == 5:
-                        salida = anterior_habil(salida)
-                    elif salida.weekday() == 6:
-                        salida = siguiente_habil(salida)
-                if ajuste_festivos and (salida.normalize() in dias_festivos):
-                    dia_semana = salida.weekday()
-                    if dia_semana == 0:
-                        salida = siguiente_habil(salida)
-                    elif dia_semana in [1, 2, 3]:
-                        anterior = anterior_habil(salida)
-                        siguiente = siguiente_habil(salida)
-                        carga_ant = carga_salida.get(anterior, 0) + add_salida.get(anterior, 0)
-                        carga_sig = carga_salida.get(siguiente, 0) + add_salida.get(siguiente, 0)
-                        salida = anterior if carga_ant <= carga_sig else siguiente
-                    elif dia_semana == 4:
-                        salida = anterior_habil(salida)
-                add_salida[salida] = add_salida.get(salida, 0) + unds_i
-
-            for sfecha, suma_unds in add_salida.items():
-                if carga_salida.get(sfecha, 0) + suma_unds > get_cap_sal(sfecha, attempt):
-                    return False
-
-            return True
-
-        entrada_elegida = None
-        for attempt in [1, 2]:
-            candidatos = []
-            if fecha_preferente is not None:
-                if (fecha_preferente >= inicio_comun) and (fecha_preferente <= limite_comun):
-                    candidatos.append(pd.to_datetime(fecha_preferente).normalize())
-
-            d = inicio_comun
-            if not es_habil(d):
-                d = siguiente_habil(d)
-            while d <= limite_comun:
-                if d not in candidatos:
-                    candidatos.append(d)
-                d = siguiente_habil(d)
-
-            for d in candidatos:
-                if _es_factible_entrada_comun(d, attempt):
-                    entrada_elegida = d
-                    break
-            if entrada_elegida is not None:
-                break
-
-        if entrada_elegida is not None:
-            for idxp, r in pending.iterrows():
-                dia_recepcion = r["DIA"]
-                unds_i = int(r["UNDS"])
-                dias_sal_optimos = int(r["DIAS_SAL_OPTIMOS"])
-
-                df_corr.at[idxp, "ENTRADA_SAL"] = entrada_elegida
-                salida = entrada_elegida + timedelta(days=dias_sal_optimos)
-                if ajuste_finde:
-                    if salida.weekday() == 5:
-                        salida = anterior_habil(salida)
-                    elif salida.weekday() == 6:
-                        salida = siguiente_habil(salida)
-                if ajuste_festivos and (salida.normalize() in dias_festivos):
-                    dia_semana = salida.weekday()
-                    if dia_semana == 0:
-                        salida = siguiente_habil(salida)
-                    elif dia_semana in [1, 2, 3]:
-                        anterior = anterior_habil(salida)
-                        siguiente = siguiente_habil(salida)
-                        carga_ant = carga_salida.get(anterior, 0)
-                        carga_sig = carga_salida.get(siguiente, 0)
-                        salida = anterior if carga_ant <= carga_sig else siguiente
-                    elif dia_semana == 4:
-                        salida = anterior_habil(salida)
-
-                df_corr.at[idxp, "SALIDA_SAL"] = salida
-                df_corr.at[idxp, "DIAS_SAL"] = (salida - entrada_elegida).days
-                df_corr.at[idxp, "DIAS_ALMACENADOS"] = (entrada_elegida - dia_recepcion).days
-                df_corr.at[idxp, "LOTE_NO_ENCAJA"] = "No"
-
-                carga_entrada[entrada_elegida] = carga_entrada.get(entrada_elegida, 0) + unds_i
-                carga_salida[salida] = carga_salida.get(salida, 0) + unds_i
-                if entrada_elegida.date() > dia_recepcion.date():
-                    _sumar_en_rango(estab_stock, dia_recepcion, entrada_elegida - pd.Timedelta(days=1), unds_i)
-
-            return True
-
-        if marcar_si_falla:
-            for idxp, _ in pending.iterrows():
-                df_corr.at[idxp, "LOTE_NO_ENCAJA"] = "Sí"
-        return False
+# -------------------------------
+# Planificación en segundo plano (hilo + progreso + cancelación)
+# -------------------------------
+def lanzar_planificacion(*args, n_lotes=0, mejora=None, orden=ORDEN_CRONOLOGICO, parametros_sitio=None, **kwargs):
+    """
+    Ejecuta planificar_por_sitio(*args, orden=orden, **kwargs) en un hilo (por sitio si los lotes traen
+    SITIO; si no, igual que planificar_filas_na) y devuelve el dict de estado del trabajo:
+    fase/hechos/total (progreso), resultado, error, cancelado, terminado.
+    Si se pasa 'mejora' (kwargs de mejorar_plan), a continuación se ejecuta la búsqueda local.
+    El plan anterior sigue en la sesión hasta que el trabajo termina.
+    """
+    trabajo = {
+        "cancelar": threading.Event(),
+        "fase": "En cola", "hechos": 0, "total": 0,
+        "resultado": None, "error": None,
+        "cancelado": False, "terminado": False,
+        "n_lotes": n_lotes,
+        "resumen_mejora": None,
+    }
 
-    # Ejecutar reglas especiales
-    # - Grupos unitarios (cada código: todas sus filas al MISMO día de ENTRADA)
-    _aplicar_entrada_comun_para_grupo(["JBSPRCLC-MEX"], marcar_si_falla=False)
-    _aplicar_entrada_comun_para_grupo(["JCIVRROD-MEX"], marcar_si_falla=False)
-    _aplicar_entrada_comun_para_grupo(["JBCPRCLC-MEX"], marcar_si_falla=False)
+    def _progreso(fase, hechos, total):
+        trabajo["fase"], trabajo["hechos"], trabajo["total"] = fase, hechos, total
 
-    # - Grupo conjunto (dos códigos al MISMO día entre sí). Si no cabe, fallback por separado.
-    exito_conjunto = _aplicar_entrada_comun_para_grupo(
-        ["JCIVRPORCISAN", "PCIVRPORCISAN"], marcar_si_falla=False
-    )
-    if not exito_conjunto:
-        _aplicar_entrada_comun_para_grupo(["JCIVRPORCISAN"], marcar_si_falla=False)
-        _aplicar_entrada_comun_para_grupo(["PCIVRPORCISAN"], marcar_si_falla=False)
-    # ===============================
-    # Asignación de pendientes minimizando cambios de TIPO/NITRIF por día
-    # ===============================
-    entrada_profile = {}
-    if "ENTRADA_SAL" in df_corr.columns:
-        ya = df_corr.dropna(subset=["ENTRADA_SAL"]).copy()
-        if not ya.empty:
-            def _norm_tipo(v):
-                s = str(v).strip().upper()
-                if "IBER" in s:
-                    return "IBÉRICO"
-                if "BLAN" in s:
-                    return "BLANCO"
-                return "OTRO"
-            def _norm_nitrif(v):
-                try:
-                    return int(v)
-                except Exception:
-                    return None
-            col_tipo = "TIPO NITRIF" if "TIPO NITRIF" in ya.columns else None
-            col_nitrif = "NITRIF" if "NITRIF" in ya.columns else None
-            for _, r in ya.iterrows():
-                d = pd.to_datetime(r["ENTRADA_SAL"]).normalize()
-                tipo = _norm_tipo(r[col_tipo]) if col_tipo else "OTRO"
-                nitr = _norm_nitrif(r[col_nitrif]) if col_nitrif else None
-                if d not in entrada_profile:
-                    entrada_profile[d] = {"tipo": Counter(), "nitrif": Counter()}
-                entrada_profile[d]["tipo"][tipo] += 1
-                if nitr is not None:
-                    entrada_profile[d]["nitrif"][nitr] += 1
-
-    def _norm_tipo(v):
-        s = str(v).strip().upper()
-        if "IBER" in s:
-            return "IBÉRICO"
-        if "BLAN" in s:
-            return "BLANCO"
-        return "OTRO"
-    def _norm_nitrif(v):
+    def _ejecutar():
         try:
-            return int(v)
-        except Exception:
-            return None
-
-    col_tipo = "TIPO NITRIF" if "TIPO NITRIF" in df_corr.columns else None
-    col_nitrif = "NITRIF" if "NITRIF" in df_corr.columns else None
-
-    # Sugerencias para lotes que no encajan
-    sugerencias_rows = []
-
-    pendientes = df_corr[df_corr["ENTRADA_SAL"].isna()].copy()
-    if "DIA" in pendientes.columns:
-        pendientes = pendientes.sort_values(["DIA", "PRODUCTO"], kind="stable")
-
-    for idx, row in pendientes.iterrows():
-        dia_recepcion    = row["DIA"]
-        unds             = int(row["UNDS"])
-        dias_sal_optimos = int(row["DIAS_SAL_OPTIMOS"])
-        prod             = row.get("PRODUCTO", None)
-        lote_id          = row.get("LOTE", idx)
-
-        dias_max_almacen = dias_max_por_producto.get(prod, dias_max_almacen_global)
-        tipo_lote = _norm_tipo(row[col_tipo]) if col_tipo else "OTRO"
-        nitr_lote = _norm_nitrif(row[col_nitrif]) if col_nitrif else None
-
-        entrada_ini = dia_recepcion if es_habil(dia_recepcion) else siguiente_habil(dia_recepcion)
-        asignado = False
-
-        for attempt in [1, 2]:
-            candidatos = []
-            entrada = entrada_ini
-            while (entrada - dia_recepcion).days <= dias_max_almacen:
-                cap_ent_dia = get_cap_ent(entrada, attempt)
-                if carga_entrada.get(entrada, 0) + unds <= cap_ent_dia:
-                    if cabe_en_estab_rango(dia_recepcion, entrada - pd.Timedelta(days=1), unds):
-                        salida = entrada + timedelta(days=dias_sal_optimos)
-                        if ajuste_finde:
-                            if salida.weekday() == 5:
-                                salida = anterior_habil(salida)
-                            elif salida.weekday() == 6:
-                                salida = siguiente_habil(salida)
-                        if ajuste_festivos and (salida.normalize() in dias_festivos):
-                            dia_semana = salida.weekday()
-                            if dia_semana == 0:
-                                salida = siguiente_habil(salida)
-                            elif dia_semana in [1, 2, 3]:
-                                anterior = anterior_habil(salida)
-                                siguiente = siguiente_habil(salida)
-                                carga_ant  = carga_salida.get(anterior, 0)
-                                carga_sig  = carga_salida.get(siguiente, 0)
-                                salida = anterior if carga_ant <= carga_sig else siguiente
-                            elif dia_semana == 4:
-                                salida = anterior_habil(salida)
-
-                        cap_sal_dia = get_cap_sal(salida, attempt)
-                        if carga_salida.get(salida, 0) + unds <= cap_sal_dia:
-                            # Candidato válido; calcular score por TIPO/NITRIF + fecha
-                            prof = entrada_profile.get(entrada, {"tipo": Counter(), "nitrif": Counter()})
-                            tipo_counts   = prof["tipo"]
-                            nitrif_counts = prof["nitrif"]
-
-                            if sum(tipo_counts.values()) == 0:
-                                cost_tipo = 0
-                            else:
-                                cost_tipo = 0 if tipo_counts.get(tipo_lote, 0) > 0 else 1
-
-                            if sum(nitrif_counts.values()) == 0:
-                                cost_nitr = 0
-                            else:
-                                cost_nitr = 0 if (nitr_lote is not None and nitrif_counts.get(nitr_lote, 0) > 0) else 1
-
-                            score = (cost_tipo, cost_nitr, entrada)
-                            candidatos.append((score, entrada, salida))
-
-                entrada = siguiente_habil(entrada)
-
-            if candidatos:
-                candidatos.sort(key=lambda t: t[0])
-                _, entrada_sel, salida_sel = candidatos[0]
-
-                df_corr.at[idx, "ENTRADA_SAL"]      = entrada_sel
-                df_corr.at[idx, "SALIDA_SAL"]       = salida_sel
-                df_corr.at[idx, "DIAS_SAL"]         = (salida_sel - entrada_sel).days
-                df_corr.at[idx, "DIAS_ALMACENADOS"] = (entrada_sel - dia_recepcion).days
-                df_corr.at[idx, "LOTE_NO_ENCAJA"]   = "No"
-
-                carga_entrada[entrada_sel] = carga_entrada.get(entrada_sel, 0) + unds
-                carga_salida[salida_sel]   = carga_salida.get(salida_sel, 0) + unds
-
-                if entrada_sel.date() > dia_recepcion.date():
-                    _sumar_en_rango(estab_stock, dia_recepcion, entrada_sel - pd.Timedelta(days=1), unds)
-
-                if entrada_sel not in entrada_profile:
-                    entrada_profile[entrada_sel] = {"tipo": Counter(), "nitrif": Counter()}
-                entrada_profile[entrada_sel]["tipo"][tipo_lote] += 1
-                if nitr_lote is not None:
-                    entrada_profile[entrada_sel]["nitrif"][nitr_lote] += 1
-
-                asignado = True
-                break
-
-        # Si no se pudo asignar → generar sugerencias (tabla detallada por combinación + texto rápido)
-        if not asignado:
-            df_corr.at[idx, "LOTE_NO_ENCAJA"] = "Sí"
-
-            sugerencias_rows_lote = []
-            entrada = entrada_ini
-
-            while (entrada - dia_recepcion).days <= dias_max_almacen:
-                if not es_habil(entrada):
-                    entrada = siguiente_habil(entrada)
-                    continue
-
-                for attempt in [1, 2]:
-                    cap_ent_dia = get_cap_ent(entrada, attempt)
-                    deficit_ent = max(0, (carga_entrada.get(entrada, 0) + unds) - cap_ent_dia)
-
-                    def_est = deficits_estab(dia_recepcion, entrada - pd.Timedelta(days=1), unds)
-                    deficit_estab_max = max(def_est.values()) if def_est else 0
-
-                    salida = entrada + timedelta(days=dias_sal_optimos)
-                    if ajuste_finde:
-                        if salida.weekday() == 5:
-                            salida = anterior_habil(salida)
-                        elif salida.weekday() == 6:
-                            salida = siguiente_habil(salida)
-                    if ajuste_festivos and (salida.normalize() in dias_festivos):
-                        dia_semana = salida.weekday()
-                        if dia_semana == 0:
-                            salida = siguiente_habil(salida)
-                        elif dia_semana in [1, 2, 3]:
-                            anterior = anterior_habil(salida)
-                            siguiente = siguiente_habil(salida)
-                            carga_ant = carga_salida.get(anterior, 0)
-                            carga_sig = carga_salida.get(siguiente, 0)
-                            salida = anterior if carga_ant <= carga_sig else siguiente
-                        elif dia_semana == 4:
-                            salida = anterior_habil(salida)
-
-                    cap_sal_dia = get_cap_sal(salida, attempt)
-                    deficit_sal = max(0, (carga_salida.get(salida, 0) + unds) - cap_sal_dia)
-
-                    # Generar texto de recomendación rápida
-                    recomendaciones = []
-                    if deficit_ent > 0:
-                        recomendaciones.append(
-                            f"Subir ENTRADA el {entrada.normalize().date()} en +{int(deficit_ent)} unds (INTENTO {attempt})."
-                        )
-                    if deficit_sal > 0:
-                        recomendaciones.append(
-                            f"Subir SALIDA el {salida.normalize().date()} en +{int(deficit_sal)} unds (INTENTO {attempt})."
-                        )
-                    if deficit_estab_max > 0:
-                        # listar solo días con déficit > 0 (máx. 3 para no saturar)
-                        dias_estab = [f"{k.date()}(+{v})" for k, v in list(def_est.items())[:3] if v > 0]
-                        if dias_estab:
-                            recomendaciones.append("Subir ESTABILIZACIÓN en: " + ", ".join(dias_estab))
-
-                    sugerencias_rows_lote.append({
-                        "LOTE": lote_id,
-                        "PRODUCTO": prod,
-                        "UNDS": unds,
-                        "DIA_RECEPCION": pd.to_datetime(dia_recepcion).normalize(),
-                        "ENTRADA_PROPUESTA": pd.to_datetime(entrada).normalize(),
-                        "SALIDA_PROPUESTA": pd.to_datetime(salida).normalize(),
-                        "INTENTO": attempt,
-                        "DEFICIT_ENTRADA": int(deficit_ent),
-                        "DEFICIT_ESTAB_MAX": int(deficit_estab_max),
-                        "DEFICIT_SALIDA": int(deficit_sal),
-                        "MAX_DEFICIT": int(max(deficit_ent, deficit_estab_max, deficit_sal)),
-                        "TOTAL_DEFICIT": int(deficit_ent + deficit_estab_max + deficit_sal),
-                        "RECOMENDACION": " | ".join(recomendaciones) if recomendaciones else "Sin ajustes necesarios"
-                    })
-
-                entrada = siguiente_habil(entrada)
-
-            if sugerencias_rows_lote:
-                sugerencias_rows_lote.sort(
-                    key=lambda r: (r["MAX_DEFICIT"], r["TOTAL_DEFICIT"], r["ENTRADA_PROPUESTA"])
+            df_plan, df_sug = planificar_por_sitio(
+                *args, progreso=_progreso, cancelar=trabajo["cancelar"], orden=orden,
+                parametros_sitio=parametros_sitio, **kwargs
+            )
+            if mejora:
+                df_plan, trabajo["resumen_mejora"] = mejorar_plan(
+                    df_plan, *args[1:7], progreso=_progreso, cancelar=trabajo["cancelar"],
+                    **mejora, **kwargs
                 )
-                sugerencias_rows.extend(sugerencias_rows_lote[:20])
-
-    # Métrica final
-    if "DIAS_SAL" in df_corr.columns and "DIAS_SAL_OPTIMOS" in df_corr.columns:
-        df_corr["DIFERENCIA_DIAS_SAL"] = df_corr["DIAS_SAL"] - df_corr["DIAS_SAL_OPTIMOS"]
-
-    cols_sug = [
-        "LOTE", "PRODUCTO", "UNDS", "DIA_RECEPCION",
-        "ENTRADA_PROPUESTA", "SALIDA_PROPUESTA", "INTENTO",
-        "DEFICIT_ENTRADA", "DEFICIT_ESTAB_MAX", "DEFICIT_SALIDA",
-        "MAX_DEFICIT", "TOTAL_DEFICIT","RECOMENDACION"
-    ]
-    df_sugerencias = pd.DataFrame(sugerencias_rows, columns=cols_sug) if sugerencias_rows else pd.DataFrame(columns=cols_sug)
-
-    if not df_sugerencias.empty:
-        df_sugerencias = df_sugerencias.sort_values(
-            by=["MAX_DEFICIT", "TOTAL_DEFICIT", "ENTRADA_PROPUESTA", "SALIDA_PROPUESTA", "LOTE"],
-            ascending=[True, True, True, True, True]
-        ).reset_index(drop=True)
-
-    return df_corr, df_sugerencias
+                # Solo quedan sugerencias para los lotes que siguen sin encajar
+                if not df_sug.empty and "LOTE" in df_plan.columns:
+                    siguen = df_plan.loc[no_encaja_a_bool(df_plan["LOTE_NO_ENCAJA"]).fillna(False), "LOTE"]
+                    df_sug = df_sug[df_sug["LOTE"].astype(str).isin(siguen.astype(str))].reset_index(drop=True)
+            trabajo["resultado"] = (df_plan, df_sug)
+        except PlanificacionCancelada:
+            trabajo["cancelado"] = True
+        except Exception as e:
+            trabajo["error"] = e
+        finally:
+            trabajo["terminado"] = True
+
+    hilo = threading.Thread(target=_ejecutar, name="planificador", daemon=True)
+    trabajo["hilo"] = hilo
+    hilo.start()
+    return trabajo
+
+@st.fragment(run_every=0.5)
+def panel_trabajo_planificacion():
+    """Barra de progreso + botón de cancelar; al terminar fuerza un rerun completo para instalar el plan."""
+    trabajo = st.session_state.get("trabajo_plan")
+    if trabajo is None:
+        return
+    if trabajo["terminado"]:
+        st.rerun()
+    total = trabajo["total"] or 1
+    st.progress(
+        min(trabajo["hechos"] / total, 1.0),
+        text=f"⏳ {trabajo['fase']}: {trabajo['hechos']}/{trabajo['total']}"
+    )
+    if trabajo["cancelar"].is_set():
+        st.caption("Cancelando…")
+    elif st.button("⛔ Cancelar planificación", key="cancelar_planificacion"):
+        trabajo["cancelar"].set()
 
 # -------------------------------
 # Ejecución de la app
 # -------------------------------
-if uploaded_file is not None:
-    # Lee el Excel
-    df = pd.read_excel(uploaded_file, engine="openpyxl")
-
-    # Alias básicos por si vienen con espacios/guiones bajos
-    alias_map = {
-        "DIAS SAL OPTIMOS": "DIAS_SAL_OPTIMOS",
-        "DIAS_SAL_OPTIMOS": "DIAS_SAL_OPTIMOS",
-        "ENTRADA SAL": "ENTRADA_SAL",
-        "SALIDA SAL": "SALIDA_SAL"
-    }
-    for a, target in alias_map.items():
-        if a in df.columns and target not in df.columns:
-            df.rename(columns={a: target}, inplace=True)
-
-    # Normaliza tipos
-    for col in ["DIA", "ENTRADA_SAL", "SALIDA_SAL"]:
-        if col in df.columns:
-            df[col] = pd.to_datetime(df[col], errors="coerce")
-    if "UNDS" in df.columns:
-        df["UNDS"] = pd.to_numeric(df["UNDS"], errors="coerce").fillna(0).astype(int)
+if uploaded_files:
+    # Lee, valida, normaliza (alias, tipos, esquema compacto) y fusiona por LOTE los Excel subidos
+    try:
+        df, df_duplicados, df_rechazados = leer_y_fusionar(
+            tuple((f.name, f.getvalue()) for f in uploaded_files), regla_conflicto
+        )
+    except ValueError as e:
+        st.error(f"❌ No se puede leer el Excel: {e}")
+        st.stop()
+    marcar_seccion("Lectura Excel")
+
+    if not df_rechazados.empty:
+        st.warning(
+            f"⛔ {len(df_rechazados)} filas no superan la validación y no se planificarán "
+            "(ver detalle y descarga abajo)."
+        )
+        with st.expander(
+            f"⛔ Filas rechazadas ({len(df_rechazados)})", expanded=False,
+            key="exp_rechazados", on_change="rerun"
+        ) as exp_rech:
+            if exp_rech.open:
+                st.dataframe(df_rechazados.astype("string"), use_container_width=True, hide_index=True)
+                st.download_button(
+                    "💾 Descargar filas rechazadas (Excel)",
+                    data=partial(generar_excel, df_rechazados, "lotes_rechazados.xlsx"),
+                    file_name="lotes_rechazados.xlsx",
+                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+                )
+    if df.empty:
+        st.info("No hay lotes válidos que planificar.")
+        st.stop()
+
+    if not df_duplicados.empty:
+        n_rep = df_duplicados["LOTE"].nunique()
+        with st.expander(
+            f"♻️ LOTEs repetidos entre ficheros ({n_rep}; "
+            f"{int(df_duplicados['DIFERENTE'].sum())} filas descartadas con datos distintos)",
+            expanded=False, key="exp_duplicados", on_change="rerun"
+        ) as exp_dup:
+            if exp_dup.open:
+                st.dataframe(df_duplicados, use_container_width=True, hide_index=True)
+                st.download_button(
+                    "💾 Descargar duplicados (Excel)",
+                    data=partial(generar_excel, df_duplicados, "lotes_duplicados.xlsx"),
+                    file_name="lotes_duplicados.xlsx",
+                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+                )
 
     # ---- Overrides por PRODUCTO (sidebar) ----
     dias_max_por_producto = {}
@@ -716,6 +543,75 @@ if uploaded_file is not None:
     else:
         st.sidebar.info("No se encontró columna PRODUCTO. Se aplicará solo el límite GLOBAL.")
 
+    # ---- Familias de producto (desglose de la ocupación de estabilización) ----
+    st.sidebar.markdown("### 🏷️ Familias de producto")
+    if "familias_df" not in st.session_state:
+        st.session_state.familias_df = pd.DataFrame(FAMILIAS_PRODUCTO_DEFAULT)
+    familias_df = st.sidebar.data_editor(
+        st.session_state.familias_df,
+        use_container_width=True,
+        num_rows="dynamic",
+        column_config={
+            "FAMILIA": st.column_config.TextColumn("Familia"),
+            "TIPO": st.column_config.SelectboxColumn("Tipo", options=list(TIPOS_REGLA_FAMILIA), required=True),
+            "PATRON": st.column_config.TextColumn(
+                "Patrón", help="Prefijo, expresión regular o lista de códigos separados por comas. "
+                               "Gana la primera regla que casa."
+            ),
+        },
+        key="familias_editor"
+    )
+    try:
+        compilar_familias(df["PRODUCTO"] if "PRODUCTO" in df.columns else pd.Series([], dtype=object), familias_df)
+    except ValueError as e:
+        st.sidebar.error(f"{e}. Se usan las familias por defecto.")
+        familias_df = pd.DataFrame(FAMILIAS_PRODUCTO_DEFAULT)
+
+    # ---- Capacidades por SITIO (solo si los lotes traen varios sitios) ----
+    sitios = sitios_plan(df)
+    varios_sitios = len(sitios) > 1
+    parametros_sitio = {}
+    config_sitio = {}
+    if varios_sitios:
+        st.sidebar.markdown("### 🏭 Capacidades por SITIO")
+        st.sidebar.caption("Vacío = valor global. Los overrides por fecha admiten un SITIO (vacío = todos los sitios).")
+        globales = {
+            "CAP_ENT_1": cap_ent_1, "CAP_ENT_2": cap_ent_2,
+            "CAP_SAL_1": cap_sal_1, "CAP_SAL_2": cap_sal_2,
+            "ESTAB_CAP": estab_cap,
+        }
+        if "sitios_df" not in st.session_state or st.session_state.get("sitios_cache") != sitios:
+            st.session_state.sitios_df = pd.DataFrame({
+                "SITIO": sitios,
+                **{c: pd.Series([pd.NA] * len(sitios), dtype="Int64") for c in globales},
+            })
+            st.session_state.sitios_cache = sitios
+        sitios_df = st.sidebar.data_editor(
+            st.session_state.sitios_df,
+            use_container_width=True,
+            disabled=["SITIO"],
+            column_config={
+                "SITIO": st.column_config.TextColumn("Sitio"),
+                "CAP_ENT_1": st.column_config.NumberColumn("Entrada 1º", step=100, min_value=0),
+                "CAP_ENT_2": st.column_config.NumberColumn("Entrada 2º", step=100, min_value=0),
+                "CAP_SAL_1": st.column_config.NumberColumn("Salida 1º", step=100, min_value=0),
+                "CAP_SAL_2": st.column_config.NumberColumn("Salida 2º", step=100, min_value=0),
+                "ESTAB_CAP": st.column_config.NumberColumn("Cámara estab.", step=100, min_value=0),
+            },
+            key="sitios_editor"
+        )
+        for _, r in sitios_df.iterrows():
+            v = {c: (int(r[c]) if pd.notna(r[c]) else g) for c, g in globales.items()}
+            parametros_sitio[r["SITIO"]] = dict(
+                cap_ent=(v["CAP_ENT_1"], v["CAP_ENT_2"]),
+                cap_sal=(v["CAP_SAL_1"], v["CAP_SAL_2"]),
+                estab_cap=v["ESTAB_CAP"],
+            )
+        config_sitio = {"SITIO": st.column_config.SelectboxColumn("Sitio", options=sitios, help="Vacío = todos los sitios")}
+        for clave_df in ("cap_overrides_ent_df", "cap_overrides_sal_df", "cap_overrides_estab_df"):
+            if clave_df in st.session_state and "SITIO" not in st.session_state[clave_df].columns:
+                st.session_state[clave_df]["SITIO"] = pd.Series(pd.NA, index=st.session_state[clave_df].index, dtype="string")
+
     # ---- Overrides de capacidad por FECHA: ENTRADA ----
     st.sidebar.markdown("### 📅 Overrides capacidad ENTRADA (opcional)")
 
@@ -724,6 +620,7 @@ if uploaded_file is not None:
             "FECHA": pd.to_datetime(pd.Series([], dtype="datetime64[ns]")),
             "CAP1":  pd.Series([], dtype="Int64"),
             "CAP2":  pd.Series([], dtype="Int64"),
+            **({"SITIO": pd.Series([], dtype="string")} if varios_sitios else {}),
         })
     st.session_state.cap_overrides_ent_df["FECHA"] = pd.to_datetime(
         st.session_state.cap_overrides_ent_df["FECHA"], errors="coerce"
@@ -741,6 +638,7 @@ if uploaded_file is not None:
             "FECHA": st.column_config.DateColumn("Fecha (entrada)", format="YYYY-MM-DD"),
             "CAP1": st.column_config.NumberColumn("Capacidad 1º intento", step=50, min_value=0),
             "CAP2": st.column_config.NumberColumn("Capacidad 2º intento", step=50, min_value=0),
+            **config_sitio,
         },
         key="cap_overrides_ent_editor"
     )
@@ -753,6 +651,7 @@ if uploaded_file is not None:
             "FECHA": pd.to_datetime(pd.Series([], dtype="datetime64[ns]")),
             "CAP1":  pd.Series([], dtype="Int64"),
             "CAP2":  pd.Series([], dtype="Int64"),
+            **({"SITIO": pd.Series([], dtype="string")} if varios_sitios else {}),
         })
     st.session_state.cap_overrides_sal_df["FECHA"] = pd.to_datetime(
         st.session_state.cap_overrides_sal_df["FECHA"], errors="coerce"
@@ -770,6 +669,7 @@ if uploaded_file is not None:
                 "FECHA": st.column_config.DateColumn("Fecha (salida)", format="YYYY-MM-DD"),
                 "CAP1": st.column_config.NumberColumn("Capacidad 1º intento", step=50, min_value=0),
                 "CAP2": st.column_config.NumberColumn("Capacidad 2º intento", step=50, min_value=0),
+                **config_sitio,
         },
         key="cap_overrides_sal_editor"
     )
@@ -781,6 +681,7 @@ if uploaded_file is not None:
         st.session_state.cap_overrides_estab_df = pd.DataFrame({
             "FECHA": pd.to_datetime(pd.Series([], dtype="datetime64[ns]")),
             "CAP":   pd.Series([], dtype="Int64"),
+            **({"SITIO": pd.Series([], dtype="string")} if varios_sitios else {}),
         })
     st.session_state.cap_overrides_estab_df["FECHA"] = pd.to_datetime(
         st.session_state.cap_overrides_estab_df["FECHA"], errors="coerce"
@@ -796,17 +697,18 @@ if uploaded_file is not None:
         column_config={
             "FECHA": st.column_config.DateColumn("Fecha (estabilización)", format="YYYY-MM-DD"),
             "CAP":   st.column_config.NumberColumn("Capacidad estabilización (unds)", step=50, min_value=0),
+            **config_sitio,
         },
         key="cap_overrides_estab_editor"
     )
 
-    # Normaliza a dicts con clave fecha-normalizada
+    # Normaliza a dicts con clave fecha-normalizada (las filas con SITIO van a los parámetros de ese sitio)
     cap_overrides_ent = {}
     if not cap_overrides_ent_df.empty:
         tmp = cap_overrides_ent_df.dropna(subset=["FECHA"]).copy()
         tmp["FECHA"] = pd.to_datetime(tmp["FECHA"]).dt.normalize()
         for _, r in tmp.iterrows():
-            cap_overrides_ent[r["FECHA"]] = {
+            destino_override(r, "cap_overrides_ent", cap_overrides_ent, parametros_sitio, varios_sitios)[r["FECHA"]] = {
                 "CAP1": (int(r["CAP1"]) if pd.notna(r["CAP1"]) else None),
                 "CAP2": (int(r["CAP2"]) if pd.notna(r["CAP2"]) else None),
             }
@@ -817,7 +719,7 @@ if uploaded_file is not None:
         tmp2 = cap_overrides_sal_df.dropna(subset=["FECHA"]).copy()
         tmp2["FECHA"] = pd.to_datetime(tmp2["FECHA"]).dt.normalize()
         for _, r in tmp2.iterrows():
-            cap_overrides_sal[r["FECHA"]] = {
+            destino_override(r, "cap_overrides_sal", cap_overrides_sal, parametros_sitio, varios_sitios)[r["FECHA"]] = {
                 "CAP1": (int(r["CAP1"]) if pd.notna(r["CAP1"]) else None),
                 "CAP2": (int(r["CAP2"]) if pd.notna(r["CAP2"]) else None),
             }
@@ -829,8 +731,9 @@ if uploaded_file is not None:
         tmp3["FECHA"] = pd.to_datetime(tmp3["FECHA"]).dt.normalize()
         for _, r in tmp3.iterrows():
             if pd.notna(r["CAP"]):
-                estab_cap_overrides[r["FECHA"]] = int(r["CAP"])
+                destino_override(r, "estab_cap_overrides", estab_cap_overrides, parametros_sitio, varios_sitios)[r["FECHA"]] = int(r["CAP"])
     st.session_state.cap_overrides_estab_df = cap_overrides_estab_df
+    marcar_seccion("Overrides")
 
     # ===============================
     # 🔧 Planificación incremental
@@ -843,15 +746,15 @@ if uploaded_file is not None:
     )
 
     if usar_plan_actual and ("df_planificado" in st.session_state):
-        df_base = st.session_state["df_planificado"].copy()
+        df_base = st.session_state["df_planificado"]
     else:
-        df_base = df.copy()
+        df_base = df
 
     candidatos_mask = df_base["ENTRADA_SAL"].isna()
     if "LOTE_NO_ENCAJA" in df_base.columns:
-        candidatos_mask = candidatos_mask | (df_base["LOTE_NO_ENCAJA"].astype(str).str.upper() == "SÍ")
+        candidatos_mask = candidatos_mask | no_encaja_a_bool(df_base["LOTE_NO_ENCAJA"]).fillna(False)
 
-    candidatos_df = df_base[candidatos_mask].copy()
+    candidatos_df = df_base[candidatos_mask]
 
     lotes_candidatos = candidatos_df["LOTE"].astype(str).tolist() if "LOTE" in candidatos_df.columns else candidatos_df.index.astype(str).tolist()
     lotes_select = st.multiselect(
@@ -866,7 +769,8 @@ if uploaded_file is not None:
     else:
         idx_a_replan = df_base.index[df_base.index.astype(str).isin(lotes_select)]
 
-    df_trabajo = df_base.copy()
+    # Copia superficial: con copy-on-write solo se duplican las columnas que se liberan
+    df_trabajo = df_base.copy(deep=False)
 
     # Liberar SOLO las filas seleccionadas preservando tipos (evita errores en data_editor)
     datetime_cols = [c for c in ["ENTRADA_SAL", "SALIDA_SAL"] if c in df_trabajo.columns]
@@ -878,22 +782,80 @@ if uploaded_file is not None:
     for c in numeric_cols:
         df_trabajo.loc[idx_a_replan, c] = pd.NA
     for c in text_cols:
+        df_trabajo[c] = no_encaja_a_bool(df_trabajo[c])
         df_trabajo.loc[idx_a_replan, c] = pd.NA
 
     for c in datetime_cols:
         df_trabajo[c] = pd.to_datetime(df_trabajo[c], errors="coerce")
     for c in numeric_cols:
-        df_trabajo[c] = pd.to_numeric(df_trabajo[c], errors="coerce").astype("Int64")
+        df_trabajo[c] = pd.to_numeric(df_trabajo[c], errors="coerce").astype("Int32")
+
+    # Instalar el resultado de un trabajo en segundo plano ya terminado
+    trabajo = st.session_state.get("trabajo_plan")
+    if trabajo is not None and trabajo["terminado"]:
+        del st.session_state["trabajo_plan"]
+        if trabajo["resultado"] is not None:
+            df_planificado, df_sugerencias = trabajo["resultado"]
+            # Se guarda la versión anterior para el panel de cambios
+            st.session_state["df_plan_anterior"] = st.session_state.get("df_planificado")
+            origen = f"Planificación ({trabajo['n_lotes']} lotes)"
+            if trabajo["resumen_mejora"] is not None:
+                origen += " + búsqueda local"
+            registrar_version_plan(compactar_plan(df_planificado), origen, sugerencias=df_sugerencias)
+            st.success(f"✅ Replanificación aplicada a {trabajo['n_lotes']} lote(s). El resto no se ha modificado.")
+            resumen = trabajo["resumen_mejora"]
+            if resumen is not None:
+                (ne0, mz0, dv0), (ne1, mz1, dv1) = resumen["objetivo_inicial"], resumen["objetivo_final"]
+                st.caption(
+                    f"🔁 Búsqueda local ({resumen['segundos']} s, {resumen['lotes_cambiados']} lote(s) movidos): "
+                    f"no encajan {ne0}→{ne1} · mezcla TIPO/NITRIF {mz0}→{mz1} · desviación días sal {dv0}→{dv1}"
+                )
+        elif trabajo["cancelado"]:
+            st.info("Planificación cancelada. Se mantiene el plan anterior.")
+        else:
+            st.error(f"❌ Error durante la planificación: {trabajo['error']}")
+
+    # Orden en que el planificador asigna los lotes pendientes
+    orden_asignacion = st.radio(
+        "Orden de asignación de lotes",
+        options=list(ORDENES_ASIGNACION),
+        horizontal=True,
+        key="orden_asignacion",
+        help="'Menos flexibles primero' asigna antes los lotes con menos días de entrada posibles "
+             "(se recalcula a medida que se consume capacidad); suele dejar menos lotes sin encajar."
+    )
+
+    # Mejora opcional por búsqueda local (solo sobre los lotes seleccionados)
+    bl1, bl2 = st.columns([3, 1])
+    usar_busqueda_local = bl1.checkbox(
+        "🔁 Mejorar con búsqueda local tras planificar",
+        value=False,
+        disabled=varios_sitios,
+        help="Mueve, intercambia y recoloca lotes seleccionados para reducir, por este orden: lotes que no encajan, mezcla de TIPO/NITRIF por día y desviación de días de sal."
+             + (" No disponible con varios sitios." if varios_sitios else "")
+    ) and not varios_sitios
+    presupuesto_bl = bl2.number_input(
+        "Tiempo máx. (s)", min_value=1, max_value=600, value=10, step=1,
+        disabled=not usar_busqueda_local
+    )
 
-    # Botón de planificación incremental
-    if st.button("🚀 Aplicar planificación (solo lotes seleccionados)"):
-        df_planificado, df_sugerencias = planificar_filas_na(
+    # Botón de planificación incremental (deshabilitado mientras hay un trabajo en curso)
+    if st.button(
+        "🚀 Aplicar planificación (solo lotes seleccionados)",
+        disabled="trabajo_plan" in st.session_state
+    ):
+        st.session_state["trabajo_plan"] = lanzar_planificacion(
             df_trabajo, dias_max_almacen_global, dias_max_por_producto,
-            estab_cap, cap_overrides_ent, cap_overrides_sal, estab_cap_overrides
+            estab_cap, cap_overrides_ent, cap_overrides_sal, estab_cap_overrides,
+            n_lotes=len(idx_a_replan),
+            mejora=(dict(modificables=idx_a_replan, presupuesto_s=presupuesto_bl) if usar_busqueda_local else None),
+            orden=ORDENES_ASIGNACION[orden_asignacion],
+            parametros_sitio=parametros_sitio,
+            **params_planificador
         )
-        st.session_state["df_planificado"] = df_planificado
-        st.session_state["df_sugerencias"] = df_sugerencias
-        st.success(f"✅ Replanificación aplicada a {len(idx_a_replan)} lote(s). El resto no se ha modificado.")
+    if "trabajo_plan" in st.session_state:
+        panel_trabajo_planificacion()
+    marcar_seccion("Planificación")
 
     # ===============================
     # Mostrar tabla editable, gráfico y estabilización (fuera del botón)
@@ -902,8 +864,16 @@ if uploaded_file is not None:
         df_show = st.session_state["df_planificado"]
 
         # Diagnóstico opcional
-        with st.expander("🧪 Diagnóstico dtypes", expanded=False):
-            st.write(df_show.dtypes.astype(str))
+        with st.expander("🧪 Diagnóstico dtypes", expanded=False, key="exp_diagnostico", on_change="rerun") as exp_diag:
+            if exp_diag.open:
+                st.write(df_show.dtypes.astype(str))
+                tiempos_previo = st.session_state["tiempos_secciones_previo"]
+                if tiempos_previo:
+                    st.caption(f"⏱️ Rerun anterior: {sum(tiempos_previo.values()):.2f} s por sección")
+                    st.dataframe(
+                        pd.DataFrame({"SECCION": list(tiempos_previo), "SEGUNDOS": [round(t, 3) for t in tiempos_previo.values()]}),
+                        hide_index=True
+                    )
 
         # Config de columnas robusta (según dtype real)
         column_config = {}
@@ -919,20 +889,85 @@ if uploaded_file is not None:
             except Exception:
                 column_config[col] = st.column_config.TextColumn(col)
 
-        # 🔴 Preparar DF para el editor con indicador 🚨
-        df_for_editor = df_show.copy()
+        # Mientras un trabajo en segundo plano planifica sobre una foto del plan, el plan no se puede
+        # tocar: al terminar, su resultado sustituye al plan actual
+        plan_bloqueado = "trabajo_plan" in st.session_state
+
+        # ↩️ Deshacer / rehacer / ir a una versión (el diario guarda deltas por lote, no copias del plan)
+        diario = st.session_state.get("diario_plan")
+        if diario is not None:
+            h1, h2, h3 = st.columns([1, 1, 4])
+            h1.button("↩️ Deshacer", on_click=ir_a_version_plan, args=("deshacer",),
+                      disabled=plan_bloqueado or not diario.puede_deshacer, use_container_width=True)
+            h2.button("↪️ Rehacer", on_click=ir_a_version_plan, args=("rehacer",),
+                      disabled=plan_bloqueado or not diario.puede_rehacer, use_container_width=True)
+            with h3.expander(f"🕘 Historial de versiones (actual: v{diario.actual})", expanded=False):
+                historial = diario.historial()
+                st.dataframe(historial, use_container_width=True, hide_index=True)
+                st.selectbox(
+                    "Versión", options=historial["VERSION"].tolist(), index=diario.actual,
+                    format_func=lambda v: f"v{v} · {historial.at[v, 'ORIGEN']}", key="diario_version_destino"
+                )
+                st.button("Ir a la versión", on_click=ir_a_version_plan, args=("diario_version_destino",),
+                          disabled=plan_bloqueado)
+
+        # 🔎 Ventana del editor: filtro en servidor + paginación (solo se envía la ventana visible)
+        st.markdown("#### 🖊️ Editor de planificación")
+        f1, f2, f3 = st.columns([2, 3, 1])
+        rango_dia = None
+        if "DIA" in df_show.columns and df_show["DIA"].notna().any():
+            dia_min = df_show["DIA"].min().date()
+            dia_max = df_show["DIA"].max().date()
+            rango_dia = f1.date_input(
+                "Rango DIA (recepción)", value=(dia_min, dia_max),
+                min_value=dia_min, max_value=dia_max, key="ventana_rango_dia"
+            )
+        productos_ventana = []
+        if "PRODUCTO" in df_show.columns:
+            productos_ventana = f2.multiselect(
+                "PRODUCTO", options=sorted(df_show["PRODUCTO"].dropna().astype(str).unique().tolist()),
+                key="ventana_productos"
+            )
+        solo_no_encaja = f3.checkbox("Solo 🚨 no encajan", value=False, key="ventana_solo_no_encaja")
+
+        fecha_ini, fecha_fin = None, None
+        if isinstance(rango_dia, (tuple, list)) and len(rango_dia) == 2:
+            fecha_ini, fecha_fin = rango_dia
+        mask_ventana = filtrar_ventana(df_show, fecha_ini, fecha_fin, productos_ventana, solo_no_encaja)
+        n_filtradas = int(mask_ventana.sum())
+
+        p1, p2, p3 = st.columns([1, 1, 3])
+        tam_pagina = p1.selectbox("Filas por página", [50, 100, 250, 500, 1000], index=1, key="ventana_tam_pagina")
+        n_paginas = max(1, -(-n_filtradas // tam_pagina))
+        pagina = int(p2.number_input("Página", min_value=1, max_value=n_paginas, value=1, step=1))
+        p3.caption(f"{n_filtradas} de {len(df_show)} lotes filtrados · página {pagina}/{n_paginas}")
+
+        pos_ventana = np.flatnonzero(mask_ventana.to_numpy())[(pagina - 1) * tam_pagina: pagina * tam_pagina]
+        df_ventana = df_show.iloc[pos_ventana]
+
+        # 🔴 Preparar DF para el editor con indicador 🚨 (categóricas a texto, booleano a "Sí"/"No");
+        # la etiqueta de cada fila es su posición en el plan (fusionar_ediciones la usa para devolverla a su sitio)
+        df_for_editor = preparar_para_mostrar(df_ventana).set_axis(pos_ventana, axis=0)
         column_config2 = dict(column_config)
 
-        if "LOTE_NO_ENCAJA" in df_for_editor.columns:
-            # Normaliza "Sí"/"Si"/"SÍ"/"SI" → SI (sin problemas con acentos)
-            valnorm = (
-                df_for_editor["LOTE_NO_ENCAJA"]
-                .astype(str)
-                .str.strip()
-                .str.upper()
-                .str.replace("Í", "I", regex=False)
+        # 🧮 Pista de holgura por fila: unidades máximas que admite el lote con sus fechas actuales
+        capacidades = dict(
+            estab_cap=estab_cap, cap_overrides_ent=cap_overrides_ent, cap_overrides_sal=cap_overrides_sal,
+            estab_cap_overrides=estab_cap_overrides, **params_planificador
+        )
+        linea = None
+        if {"DIA", "ENTRADA_SAL", "SALIDA_SAL", "UNDS"}.issubset(df_show.columns):
+            linea = linea_holgura_sesion(df_show, capacidades, parametros_sitio)
+            df_for_editor[COL_HOLGURA] = texto_holgura(linea.holgura_filas(df_ventana), df_ventana["UNDS"]).to_numpy()
+            column_config2[COL_HOLGURA] = st.column_config.TextColumn(
+                COL_HOLGURA, disabled=True,
+                help="Unidades máximas que caben con la ENTRADA/SALIDA actuales (1º / 2º intento) "
+                     "y recurso que limita (ENT, SAL, ESTAB). ⚠️: el lote supera la capacidad."
             )
-            df_for_editor["🚨"] = valnorm.isin(["SI"]).map({True: "❌", False: ""})
+
+        if "LOTE_NO_ENCAJA" in df_for_editor.columns:
+            no_encaja = no_encaja_a_bool(df_ventana["LOTE_NO_ENCAJA"]).fillna(False)
+            df_for_editor["🚨"] = no_encaja.map({True: "❌", False: ""})
 
             # Coloca 🚨 como primera columna
             cols = ["🚨"] + [c for c in df_for_editor.columns if c != "🚨"]
@@ -941,238 +976,510 @@ if uploaded_file is not None:
             # Configura la columna 🚨 para que ocupe poco
             column_config2["🚨"] = st.column_config.TextColumn("🚨", width="small", help="No encaja")
 
-        # 🖊️ Render del editor usando el DF preparado
+        # 🖊️ Render del editor usando el DF preparado.
+        # La clave depende de la ventana (filtros y filas que contiene) y de la época del editor, que
+        # solo avanza cuando una replanificación o un deshacer/rehacer cambian las filas: editar una
+        # celda no remonta el editor, y su estado (ediciones por posición) nunca se reaplica sobre
+        # otras filas.
+        firma_ventana = (
+            str(fecha_ini), str(fecha_fin), tuple(productos_ventana), solo_no_encaja, tam_pagina, pagina,
+            tuple(pos_ventana.tolist()), tuple(clave_lote(df_ventana))
+        )
+        epoca_editor = st.session_state.get("epoca_editor", 0)
+        if plan_bloqueado:
+            st.caption("🔒 Edición bloqueada mientras se planifica.")
         df_editable = st.data_editor(
             df_for_editor,
             column_config=column_config2,
-            num_rows="dynamic",
+            num_rows="fixed" if plan_bloqueado else "dynamic",
+            disabled=plan_bloqueado,
             use_container_width=True,
-            key="plan_editor"  # clave para que Streamlit rerenderice correctamente
+            key=f"plan_editor_{epoca_editor}_{abs(hash(firma_ventana))}"
         )
 
+        # Fusionar ediciones de la ventana en el plan maestro (cada fila en su posición)
+        df_fusionado, hubo_cambios, lotes_rechazados = df_show, False, []
+        if not plan_bloqueado:
+            df_fusionado, hubo_cambios, lotes_rechazados = fusionar_ediciones(df_show, pos_ventana, df_editable)
+        if lotes_rechazados:
+            st.warning(
+                f"LOTE ya existente en el plan: no se aplican las filas añadidas o renombradas "
+                f"{', '.join(lotes_rechazados[:10])}. Cambia el LOTE o edita la fila existente."
+            )
+        if hubo_cambios:
+            # Filas añadidas, borradas o renombradas: el estado del editor ya está en el plan y no debe reaplicarse
+            mismas_filas = clave_lote(df_fusionado).equals(clave_lote(df_show))
+            df_show = df_fusionado
+            registrar_version_plan(df_show, "Edición manual", reiniciar_editor=not mismas_filas)
+            if linea is not None:
+                # Aviso inmediato: lotes editados que ya no caben con sus fechas nuevas
+                editadas = linea.sincronizar(df_show)
+                h = linea.holgura_filas(editadas)
+                excede = (editadas["UNDS"].astype("Float64") > h["MAX_UNDS_2"].astype("Float64")).fillna(False)
+                for _, fila in editadas[excede.to_numpy()].head(10).iterrows():
+                    hf = h.loc[fila.name]
+                    st.warning(
+                        f"🧮 {fila['LOTE']}: con ENTRADA {fila['ENTRADA_SAL']:%Y-%m-%d} caben como máximo "
+                        f"{hf['MAX_UNDS_2']} unds en 2º intento ({fila['UNDS']} planificadas; limita {hf['LIMITE']})."
+                    )
+        marcar_seccion("Editor")
+
         # -------------------------------
         # Gráfico: Entradas vs Salidas por lote/fecha
         # -------------------------------
-        st.subheader("📊 Entradas y salidas por fecha con detalle por lote")
-
-        fig = go.Figure()
-
-        df_e = df_editable.dropna(subset=["ENTRADA_SAL", "UNDS"]) if "ENTRADA_SAL" in df_editable.columns else pd.DataFrame()
-        df_s = df_editable.dropna(subset=["SALIDA_SAL", "UNDS"]) if "SALIDA_SAL" in df_editable.columns else pd.DataFrame()
-
-        pivot_e = (
-            df_e.groupby(["ENTRADA_SAL", "LOTE"])["UNDS"]
-                .sum()
-                .unstack(fill_value=0)
-                .sort_index()
-            if not df_e.empty and {"ENTRADA_SAL", "LOTE", "UNDS"}.issubset(df_e.columns)
-            else pd.DataFrame()
-        )
-        pivot_s = (
-            df_s.groupby(["SALIDA_SAL", "LOTE"])["UNDS"]
-                .sum()
-                .unstack(fill_value=0)
-                .sort_index()
-            if not df_s.empty and {"SALIDA_SAL", "LOTE", "UNDS"}.issubset(df_s.columns)
-            else pd.DataFrame()
-        )
+        with st.expander(
+            "📊 Entradas y salidas por fecha con detalle por lote", expanded=False,
+            key="exp_grafico_lotes", on_change="rerun"
+        ) as exp_grafico:
+            # Perezoso: el gráfico por lote es lo más caro del rerun; solo se construye abierto
+            if exp_grafico.open:
+                import plotly.graph_objects as go
+
+                fig = go.Figure()
+
+                df_e = df_show.dropna(subset=["ENTRADA_SAL", "UNDS"]) if "ENTRADA_SAL" in df_show.columns else pd.DataFrame()
+                df_s = df_show.dropna(subset=["SALIDA_SAL", "UNDS"]) if "SALIDA_SAL" in df_show.columns else pd.DataFrame()
+
+                pivot_e = (
+                    df_e.groupby(["ENTRADA_SAL", "LOTE"], observed=True)["UNDS"]
+                        .sum()
+                        .unstack(fill_value=0)
+                        .sort_index()
+                    if not df_e.empty and {"ENTRADA_SAL", "LOTE", "UNDS"}.issubset(df_e.columns)
+                    else pd.DataFrame()
+                )
+                pivot_s = (
+                    df_s.groupby(["SALIDA_SAL", "LOTE"], observed=True)["UNDS"]
+                        .sum()
+                        .unstack(fill_value=0)
+                        .sort_index()
+                    if not df_s.empty and {"SALIDA_SAL", "LOTE", "UNDS"}.issubset(df_s.columns)
+                    else pd.DataFrame()
+                )
 
-        if not pivot_e.empty:
-            for lote in pivot_e.columns:
-                y_vals = pivot_e[lote]
-                if (y_vals > 0).any():
-                    fig.add_trace(go.Bar(
-                        x=pivot_e.index,
-                        y=y_vals,
-                        name=f"Lote {lote}",
-                        offsetgroup="entrada",
-                        legendgroup=f"lote-{lote}",
-                        marker_color="blue",
-                        marker_line_color="white",
-                        marker_line_width=1.2,
-                        hovertemplate="Fecha: %{x|%Y-%m-%d}<br>Lote: " + str(lote) + "<br>UNDS: %{y}<extra></extra>",
-                        showlegend=True
+                if not pivot_e.empty:
+                    for lote in pivot_e.columns:
+                        y_vals = pivot_e[lote]
+                        if (y_vals > 0).any():
+                            fig.add_trace(go.Bar(
+                                x=pivot_e.index,
+                                y=y_vals,
+                                name=f"Lote {lote}",
+                                offsetgroup="entrada",
+                                legendgroup=f"lote-{lote}",
+                                marker_color="blue",
+                                marker_line_color="white",
+                                marker_line_width=1.2,
+                                hovertemplate="Fecha: %{x|%Y-%m-%d}<br>Lote: " + str(lote) + "<br>UNDS: %{y}<extra></extra>",
+                                showlegend=True
+                            ))
+
+                if not pivot_s.empty:
+                    for lote in pivot_s.columns:
+                        y_vals = pivot_s[lote]
+                        if (y_vals > 0).any():
+                            fig.add_trace(go.Bar(
+                                x=pivot_s.index,
+                                y=y_vals,
+                                name=f"Lote {lote} (Salida)",
+                                offsetgroup="salida",
+                                legendgroup=f"lote-{lote}",
+                                marker_color="orange",
+                                marker_line_color="white",
+                                marker_line_width=1.2,
+                                hovertemplate="Fecha: %{x|%Y-%m-%d}<br>Lote: " + str(lote) + "<br>UNDS: %{y}<extra></extra>",
+                                showlegend=False
+                            ))
+
+                label_shift = pd.Timedelta(hours=8)
+                annotations = []
+
+                tot_e = pd.DataFrame()
+                tot_s = pd.DataFrame()
+                if not df_e.empty:
+                    if "LOTE" in df_e.columns:
+                        tot_e = df_e.groupby("ENTRADA_SAL").agg(UNDS=("UNDS","sum"), LOTES=("LOTE","nunique")).reset_index()
+                    else:
+                        tot_e = df_e.groupby("ENTRADA_SAL").agg(UNDS=("UNDS","sum"), LOTES=("UNDS","size")).reset_index()
+                if not df_s.empty:
+                    if "LOTE" in df_s.columns:
+                        tot_s = df_s.groupby("SALIDA_SAL").agg(UNDS=("UNDS","sum"), LOTES=("LOTE","nunique")).reset_index()
+                    else:
+                        tot_s = df_s.groupby("SALIDA_SAL").agg(UNDS=("UNDS","sum"), LOTES=("UNDS","size")).reset_index()
+
+                max_e = int(tot_e["UNDS"].max()) if not tot_e.empty else 0
+                max_s = int(tot_s["UNDS"].max()) if not tot_s.empty else 0
+                max_y = max(max_e, max_s) or 1
+
+                def add_two_labels(x_dt, y_val, lots_count, is_entry=True):
+                    x_pos = x_dt - label_shift if is_entry else x_dt + label_shift
+                    y_base = max(y_val, max_y * 0.02)
+                    annotations.append(dict(
+                        x=x_pos, y=y_base, xref="x", yref="y",
+                        text=f"<b>{int(y_val)}</b>",
+                        showarrow=False, yshift=28,
+                        align="center", font=dict(size=13, color="black")
                     ))
-
-        if not pivot_s.empty:
-            for lote in pivot_s.columns:
-                y_vals = pivot_s[lote]
-                if (y_vals > 0).any():
-                    fig.add_trace(go.Bar(
-                        x=pivot_s.index,
-                        y=y_vals,
-                        name=f"Lote {lote} (Salida)",
-                        offsetgroup="salida",
-                        legendgroup=f"lote-{lote}",
-                        marker_color="orange",
-                        marker_line_color="white",
-                        marker_line_width=1.2,
-                        hovertemplate="Fecha: %{x|%Y-%m-%d}<br>Lote: " + str(lote) + "<br>UNDS: %{y}<extra></extra>",
-                        showlegend=False
+                    annotations.append(dict(
+                        x=x_pos, y=y_base, xref="x", yref="y",
+                        text=f"{int(lots_count)} lotes",
+                        showarrow=False, yshift=12,
+                        align="center", font=dict(size=11, color="gray")
                     ))
 
-        label_shift = pd.Timedelta(hours=8)
-        annotations = []
-
-        tot_e = pd.DataFrame()
-        tot_s = pd.DataFrame()
-        if not df_e.empty:
-            if "LOTE" in df_e.columns:
-                tot_e = df_e.groupby("ENTRADA_SAL").agg(UNDS=("UNDS","sum"), LOTES=("LOTE","nunique")).reset_index()
-            else:
-                tot_e = df_e.groupby("ENTRADA_SAL").agg(UNDS=("UNDS","sum"), LOTES=("UNDS","size")).reset_index()
-        if not df_s.empty:
-            if "LOTE" in df_s.columns:
-                tot_s = df_s.groupby("SALIDA_SAL").agg(UNDS=("UNDS","sum"), LOTES=("LOTE","nunique")).reset_index()
-            else:
-                tot_s = df_s.groupby("SALIDA_SAL").agg(UNDS=("UNDS","sum"), LOTES=("UNDS","size")).reset_index()
-
-        max_e = int(tot_e["UNDS"].max()) if not tot_e.empty else 0
-        max_s = int(tot_s["UNDS"].max()) if not tot_s.empty else 0
-        max_y = max(max_e, max_s) or 1
-
-        def add_two_labels(x_dt, y_val, lots_count, is_entry=True):
-            x_pos = x_dt - label_shift if is_entry else x_dt + label_shift
-            y_base = max(y_val, max_y * 0.02)
-            annotations.append(dict(
-                x=x_pos, y=y_base, xref="x", yref="y",
-                text=f"<b>{int(y_val)}</b>",
-                showarrow=False, yshift=28,
-                align="center", font=dict(size=13, color="black")
-            ))
-            annotations.append(dict(
-                x=x_pos, y=y_base, xref="x", yref="y",
-                text=f"{int(lots_count)} lotes",
-                showarrow=False, yshift=12,
-                align="center", font=dict(size=11, color="gray")
-            ))
-
-        if not tot_e.empty:
-            for _, r in tot_e.iterrows():
-                add_two_labels(r["ENTRADA_SAL"], r["UNDS"], r["LOTES"], is_entry=True)
-        if not tot_s.empty:
-            for _, r in tot_s.iterrows():
-                add_two_labels(r["SALIDA_SAL"], r["UNDS"], r["LOTES"], is_entry=False)
-
-        ticks = pd.Index(sorted(set(
-            (pivot_e.index.tolist() if not pivot_e.empty else []) +
-            (pivot_s.index.tolist() if not pivot_s.empty else [])
-        )))
-        fig.update_layout(
-            barmode="relative",
-            xaxis_title="Fecha",
-            yaxis_title="Unidades",
-            xaxis=dict(
-                tickmode="array",
-                tickvals=ticks,
-                tickformat="%d %b (%a)"
-            ),
-            bargap=0.25,
-            bargroupgap=0.12,
-            annotations=annotations,
-            legend=dict(
-                itemclick="toggleothers",
-                itemdoubleclick="toggle",
-                groupclick="togglegroup"
-            )
-        )
-        fig.update_yaxes(range=[0, max_y * 1.25])
+                if not tot_e.empty:
+                    for _, r in tot_e.iterrows():
+                        add_two_labels(r["ENTRADA_SAL"], r["UNDS"], r["LOTES"], is_entry=True)
+                if not tot_s.empty:
+                    for _, r in tot_s.iterrows():
+                        add_two_labels(r["SALIDA_SAL"], r["UNDS"], r["LOTES"], is_entry=False)
+
+                ticks = pd.Index(sorted(set(
+                    (pivot_e.index.tolist() if not pivot_e.empty else []) +
+                    (pivot_s.index.tolist() if not pivot_s.empty else [])
+                )))
+                fig.update_layout(
+                    barmode="relative",
+                    xaxis_title="Fecha",
+                    yaxis_title="Unidades",
+                    xaxis=dict(
+                        tickmode="array",
+                        tickvals=ticks,
+                        tickformat="%d %b (%a)"
+                    ),
+                    bargap=0.25,
+                    bargroupgap=0.12,
+                    annotations=annotations,
+                    legend=dict(
+                        itemclick="toggleothers",
+                        itemdoubleclick="toggle",
+                        groupclick="togglegroup"
+                    )
+                )
+                fig.update_yaxes(range=[0, max_y * 1.25])
 
-        st.plotly_chart(fig, use_container_width=True)
+                st.plotly_chart(fig, use_container_width=True)
+        marcar_seccion("Gráfico entradas/salidas")
 
         # ===============================
         # 📦 Estabilización: tabla + gráfico + descarga
         # ===============================
-        df_estab = calcular_estabilizacion_diaria(df_editable, estab_cap, estab_cap_overrides)
-
-        with st.expander("📦 Ocupación diaria de cámara de estabilización", expanded=True):
-            if df_estab.empty:
-                st.info("No hay días con stock en estabilización.")
-            else:
-                st.dataframe(df_estab, use_container_width=True, hide_index=True)
+        with st.expander(
+            "📦 Ocupación diaria de cámara de estabilización", expanded=True,
+            key="exp_estabilizacion", on_change="rerun"
+        ) as exp_estab:
+            # Perezoso: con el expander cerrado no se calcula la ocupación ni se pinta el gráfico
+            if exp_estab.open:
+                # Con varios sitios: cámara de un sitio o vista consolidada (suma de todas)
+                sitios_vista = sitios_plan(df_show)
+                sitio_vista = None
+                cap_linea = estab_cap
+                if len(sitios_vista) > 1:
+                    sitio_vista = st.selectbox("Sitio", [SITIO_CONSOLIDADO] + sitios_vista, key="estab_sitio")
+                    df_estab = estabilizacion_por_sitio(
+                        df_show, estab_cap, estab_cap_overrides, parametros_sitio, familias_df
+                    )[sitio_vista]
+                    caps_sitio = {
+                        s: parametros_de_sitio(s, parametros_sitio, estab_cap=estab_cap)["estab_cap"] for s in sitios_vista
+                    }
+                    cap_linea = sum(caps_sitio.values()) if sitio_vista == SITIO_CONSOLIDADO else caps_sitio[sitio_vista]
+                else:
+                    df_estab = calcular_estabilizacion_diaria(df_show, estab_cap, estab_cap_overrides, familias_df)
 
-                colores = df_estab.apply(
-                    lambda r: "crimson" if r["ESTAB_UNDS"] > r["CAPACIDAD"] else "teal",
-                    axis=1
+                # Pirámide de ocupación día → semana → mes (se recalcula solo si cambian plan, capacidades o sitio)
+                firma_piramide = (
+                    st.session_state.get("plan_version", 0), estab_cap,
+                    repr(cap_overrides_ent), repr(cap_overrides_sal), repr(estab_cap_overrides),
+                    repr(params_planificador), repr(parametros_sitio), sitio_vista
                 )
+                if st.session_state.get("piramide_firma") != firma_piramide:
+                    fechas_plan = pd.concat([df_show[c] for c in ("DIA", "ENTRADA_SAL", "SALIDA_SAL") if c in df_show.columns]).dropna()
+                    piramide = None
+                    if not fechas_plan.empty and sitio_vista is not None:
+                        piramide = piramide_ocupacion(ocupacion_por_sitio(
+                            df_show, fechas_plan.min(), fechas_plan.max(), parametros_sitio, **capacidades
+                        )[sitio_vista])
+                    elif not fechas_plan.empty:
+                        libro_vista = LibroCargas(
+                            estab_cap=estab_cap,
+                            cap_overrides_ent=cap_overrides_ent,
+                            cap_overrides_sal=cap_overrides_sal,
+                            estab_cap_overrides=estab_cap_overrides,
+                            **params_planificador
+                        ).cargar_plan(df_show)
+                        piramide = piramide_ocupacion(libro_vista.ocupacion(fechas_plan.min(), fechas_plan.max()))
+                    st.session_state["piramide"] = piramide
+                    st.session_state["piramide_firma"] = firma_piramide
+                piramide = st.session_state["piramide"]
+
+                if df_estab.empty or piramide is None:
+                    st.info("No hay días con stock en estabilización.")
+                else:
+                    # Resolución y zoom: horizontes largos se pintan como semanas/meses
+                    r1, r2 = st.columns([2, 3])
+                    resolucion_txt = r1.radio(
+                        "Resolución", ["Automática"] + list(RESOLUCIONES),
+                        horizontal=True, key="estab_resolucion"
+                    )
+                    fmin = piramide["D"]["FECHA"].min().date()
+                    fmax = piramide["D"]["FECHA"].max().date()
+                    zoom = (fmin, fmax)
+                    if fmin < fmax:
+                        zoom = r2.slider("Zoom (fechas)", min_value=fmin, max_value=fmax, value=(fmin, fmax), format="YYYY-MM-DD")
+                    z0, z1 = pd.Timestamp(zoom[0]), pd.Timestamp(zoom[1])
+                    n_dias_zoom = (z1 - z0).days + 1
+                    resolucion = (
+                        resolucion_automatica(n_dias_zoom) if resolucion_txt == "Automática"
+                        else RESOLUCIONES[resolucion_txt]
+                    )
 
-                fig_est = go.Figure()
-                fig_est.add_trace(go.Bar(
-                    x=df_estab["FECHA"],
-                    y=df_estab["ESTAB_UNDS"],
-                    marker_color=colores,
-                    hovertemplate="Fecha: %{x|%Y-%m-%d}<br>Unds: %{y}<extra></extra>",
-                    showlegend=False
-                ))
-                fig_est.add_trace(go.Scatter(
-                    x=df_estab["FECHA"],
-                    y=df_estab["ESTAB_UNDS"],
-                    mode="text",
-                    text=[str(int(v)) for v in df_estab["ESTAB_UNDS"]],
-                    textposition="top center",
-                    showlegend=False
-                ))
-                fig_est.add_hline(
-                    y=estab_cap, line_dash="dash", line_color="orange",
-                    annotation_text=f"Capacidad: {estab_cap}",
-                    annotation_position="top left"
-                )
-                fig_est.update_layout(
-                    xaxis_title="Fecha",
-                    yaxis_title="Unidades en estabilización",
-                    bargap=0.25,
-                    showlegend=False,
-                    xaxis=dict(
-                        tickmode="array",
-                        tickvals=df_estab["FECHA"],
-                        tickformat="%d %b (%a)"
+                    if resolucion == "D":
+                        df_vista = df_estab[(df_estab["FECHA"] >= z0) & (df_estab["FECHA"] <= z1)]
+                        st.dataframe(df_vista, use_container_width=True, hide_index=True)
+                        x_vals = df_vista["FECHA"]
+                        y_vals = df_vista["ESTAB_UNDS"]
+                        colores = ["crimson" if u > c else "teal" for u, c in zip(df_vista["ESTAB_UNDS"], df_vista["CAPACIDAD"])]
+                        hover = "Fecha: %{x|%Y-%m-%d}<br>Unds: %{y}<extra></extra>"
+                        media = None
+                    else:
+                        nivel = piramide[resolucion]
+                        # Periodos que se solapan con el zoom
+                        fin_periodo = nivel["FECHA"] + pd.to_timedelta(nivel["DIAS"] - 1, unit="D")
+                        df_vista = nivel[(fin_periodo >= z0) & (nivel["FECHA"] <= z1)]
+                        st.dataframe(df_vista, use_container_width=True, hide_index=True)
+                        x_vals = df_vista["FECHA"]
+                        y_vals = df_vista["ESTAB_PICO"]
+                        colores = ["crimson" if n > 0 else "teal" for n in df_vista["ESTAB_DIAS_EXCESO"]]
+                        hover = (
+                            "Desde: %{x|%Y-%m-%d}<br>Pico: %{y}<br>Días sobre capacidad: %{customdata}<extra></extra>"
+                        )
+                        media = df_vista["ESTAB_MEDIA"]
+
+                    import plotly.graph_objects as go
+                    fig_est = go.Figure()
+                    fig_est.add_trace(go.Bar(
+                        x=x_vals,
+                        y=y_vals,
+                        marker_color=colores,
+                        customdata=(df_vista["ESTAB_DIAS_EXCESO"] if media is not None else None),
+                        hovertemplate=hover,
+                        showlegend=False
+                    ))
+                    if media is not None:
+                        fig_est.add_trace(go.Scatter(
+                            x=x_vals, y=media, mode="lines+markers", name="Media",
+                            line=dict(color="gray"), showlegend=False,
+                            hovertemplate="Media: %{y}<extra></extra>"
+                        ))
+                    if len(df_vista) <= 60:
+                        # Etiquetas de texto solo con pocas barras
+                        fig_est.add_trace(go.Scatter(
+                            x=x_vals,
+                            y=y_vals,
+                            mode="text",
+                            text=[str(int(v)) for v in y_vals],
+                            textposition="top center",
+                            showlegend=False
+                        ))
+                    fig_est.add_hline(
+                        y=cap_linea, line_dash="dash", line_color="orange",
+                        annotation_text=f"Capacidad: {cap_linea}",
+                        annotation_position="top left"
                     )
-                )
-                st.plotly_chart(fig_est, use_container_width=True)
+                    xaxis = dict(tickformat="%d %b (%a)" if resolucion == "D" else ("%d %b %Y" if resolucion == "W" else "%b %Y"))
+                    if len(df_vista) <= 31:
+                        xaxis.update(tickmode="array", tickvals=x_vals)
+                    fig_est.update_layout(
+                        xaxis_title="Fecha",
+                        yaxis_title="Unidades en estabilización" + ("" if resolucion == "D" else " (pico del periodo)"),
+                        bargap=0.25,
+                        showlegend=False,
+                        xaxis=xaxis
+                    )
+                    st.plotly_chart(fig_est, use_container_width=True)
 
-                estab_xlsx = generar_excel(df_estab, "estabilizacion_diaria.xlsx")
-                st.download_button(
-                    "💾 Descargar estabilización (Excel)",
-                    data=estab_xlsx,
-                    file_name="estabilizacion_diaria.xlsx",
-                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-                )
+                    st.download_button(
+                        "💾 Descargar estabilización (Excel)",
+                        data=partial(generar_excel, df_estab, "estabilizacion_diaria.xlsx"),
+                        file_name="estabilizacion_diaria.xlsx",
+                        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+                    )
+        marcar_seccion("Estabilización")
 
         # ===============================
         # 📌 Sugerencias para lotes que no encajan
         # ===============================
-        if "df_sugerencias" in st.session_state:
-            df_sug = st.session_state["df_sugerencias"]
-        else:
-            # Si no existe, intenta regenerarlas para el plan actual
-            _, df_sug = planificar_filas_na(
-                df_show, dias_max_almacen_global, dias_max_por_producto,
-                estab_cap, cap_overrides_ent, cap_overrides_sal, estab_cap_overrides
-            )
-            st.session_state["df_sugerencias"] = df_sug
+        # Vienen guardadas con cada versión del plan; si faltan, se calculan solo al abrir la sección
+        df_sug = st.session_state.get("df_sugerencias")
+        with st.expander(
+            "🧩 Lotes que no encajan: sugerencias" + (" (sin calcular)" if df_sug is None else ""),
+            expanded=df_sug is not None and not df_sug.empty,
+            key="exp_sugerencias", on_change="rerun"
+        ) as exp_sug:
+            if exp_sug.open and df_sug is None:
+                with st.spinner("Calculando sugerencias..."):
+                    _, df_sug = planificar_por_sitio(
+                        df_show, dias_max_almacen_global, dias_max_por_producto,
+                        estab_cap, cap_overrides_ent, cap_overrides_sal, estab_cap_overrides,
+                        parametros_sitio=parametros_sitio, **params_planificador
+                    )
+                st.session_state["df_sugerencias"] = df_sug
+                st.session_state["sugerencias_versiones"][st.session_state["diario_plan"].actual] = df_sug
+            if exp_sug.open:
+                if df_sug.empty:
+                    st.success("Todos los lotes encajan con las restricciones actuales. 🎉")
+                else:
+                    st.dataframe(df_sug, use_container_width=True, hide_index=True)
+                    st.download_button(
+                        "💾 Descargar sugerencias (Excel)",
+                        data=partial(generar_excel, df_sug, "sugerencias_lotes_no_encajan.xlsx"),
+                        file_name="sugerencias_lotes_no_encajan.xlsx",
+                        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+                    )
+        marcar_seccion("Sugerencias")
 
-        with st.expander("🧩 Lotes que no encajan: sugerencias", expanded=not df_sug.empty):
-            if df_sug.empty:
-                st.success("Todos los lotes encajan con las restricciones actuales. 🎉")
+        # ===============================
+        # 🔀 Cambios respecto a la planificación anterior
+        # ===============================
+        df_anterior = st.session_state.get("df_plan_anterior")
+        if df_anterior is not None:
+            firma_diff = st.session_state.get("plan_version", 0)
+            if st.session_state.get("diff_firma") != firma_diff:
+                st.session_state["diff_plan"] = comparar_planes(df_anterior, df_show)
+                st.session_state["diff_firma"] = firma_diff
+            diff = st.session_state["diff_plan"]
+            n_cambios = sum(diff["resumen"].values())
+            with st.expander(
+                f"🔀 Cambios respecto a la planificación anterior ({n_cambios} lotes)", expanded=False,
+                key="exp_cambios", on_change="rerun"
+            ) as exp_cambios:
+                if exp_cambios.open:
+                    cols_res = st.columns(len(diff["resumen"]))
+                    for col, (tipo, n) in zip(cols_res, diff["resumen"].items()):
+                        col.metric(tipo, n)
+                    if n_cambios == 0:
+                        st.info("La planificación actual es igual a la anterior.")
+                    else:
+                        tipos = st.multiselect(
+                            "Tipo de cambio", options=[t for t, n in diff["resumen"].items() if n > 0],
+                            key="diff_tipos"
+                        )
+                        df_lotes_diff = diff["lotes"]
+                        if tipos:
+                            df_lotes_diff = df_lotes_diff[df_lotes_diff["CAMBIO"].isin(tipos)]
+                        st.dataframe(df_lotes_diff, use_container_width=True, hide_index=True)
+                        st.markdown("**Variación de carga por día**")
+                        st.dataframe(diff["cargas"], use_container_width=True, hide_index=True)
+                        st.download_button(
+                            "💾 Descargar cambios (Excel)",
+                            data=partial(generar_excel_hojas, {"LOTES": diff["lotes"], "CARGAS_DIA": diff["cargas"]}),
+                            file_name="cambios_planificacion.xlsx",
+                            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+                        )
+        marcar_seccion("Cambios")
+
+        # ===============================
+        # 📈 Ampliación mínima de capacidad para que encajen todos los pendientes
+        # ===============================
+        with st.expander("📈 Ampliación mínima de capacidad (todos los lotes pendientes)", expanded=False):
+            # Con varios sitios la ampliación es de las capacidades de un sitio (overrides con su SITIO)
+            df_amp_base, sitio_amp, params_amp = df_show, None, capacidades
+            sitios_amp = sitios_plan(df_show)
+            if len(sitios_amp) > 1:
+                sitio_amp = st.selectbox("Sitio", sitios_amp, key="ampliacion_sitio")
+                df_amp_base = df_show[(sitio_de_filas(df_show) == sitio_amp).to_numpy()]
+                params_amp = parametros_de_sitio(sitio_amp, parametros_sitio, **capacidades)
+            n_pendientes = int(df_amp_base["ENTRADA_SAL"].isna().sum())
+            if n_pendientes == 0:
+                st.success("No hay lotes pendientes: no hace falta ampliar capacidad.")
             else:
-                st.dataframe(df_sug, use_container_width=True, hide_index=True)
-                sug_xlsx = generar_excel(df_sug, "sugerencias_lotes_no_encajan.xlsx")
-                st.download_button(
-                    "💾 Descargar sugerencias (Excel)",
-                    data=sug_xlsx,
-                    file_name="sugerencias_lotes_no_encajan.xlsx",
-                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+                st.caption(
+                    f"{n_pendientes} lotes sin ENTRADA_SAL. Se calcula, sobre las cargas ya planificadas, "
+                    "el menor conjunto de ampliaciones por fecha (2º intento) con el que caben todos a la vez."
+                )
+                firma_amp = (
+                    st.session_state.get("plan_version", 0), repr(params_amp),
+                    repr(dias_max_por_producto), dias_max_almacen_global, sitio_amp
                 )
+                if st.button("🔍 Calcular ampliación mínima", key="btn_ampliacion"):
+                    with st.spinner("Buscando la ampliación mínima..."):
+                        p = dict(params_amp)
+                        amp = analizar_ampliacion_capacidad(
+                            df_amp_base, dias_max_almacen_global, dias_max_por_producto,
+                            p.pop("estab_cap"), p.pop("cap_overrides_ent"), p.pop("cap_overrides_sal"),
+                            p.pop("estab_cap_overrides"), **p
+                        )
+                        if sitio_amp is not None:
+                            for clave in ("overrides_ent", "overrides_sal", "overrides_estab"):
+                                amp[clave] = amp[clave].assign(SITIO=sitio_amp)
+                        st.session_state["ampliacion"] = amp
+                    st.session_state["ampliacion_firma"] = firma_amp
+
+                amp = st.session_state.get("ampliacion")
+                if amp is not None and st.session_state.get("ampliacion_firma") == firma_amp:
+                    df_amp = amp["ampliaciones"]
+                    c1, c2, c3 = st.columns(3)
+                    for col, recurso in zip((c1, c2, c3), ("ENTRADA", "SALIDA", "ESTABILIZACION")):
+                        sub = df_amp[df_amp["RECURSO"] == recurso]
+                        col.metric(
+                            f"{recurso} (+unds)", int(sub["AMPLIACION"].sum()),
+                            help=f"{len(sub)} fechas; máximo por fecha: {int(sub['AMPLIACION'].max()) if len(sub) else 0}"
+                        )
+                    if not amp["imposibles"].empty:
+                        st.warning(
+                            f"{len(amp['imposibles'])} lotes no tienen ningún día de entrada posible "
+                            "(calendario/días máx. de almacén): no se resuelven ampliando capacidad."
+                        )
+                        st.dataframe(amp["imposibles"], use_container_width=True, hide_index=True)
+                    if df_amp.empty:
+                        st.success("Los pendientes caben con las capacidades actuales (replanifica para asignarlos).")
+                    else:
+                        st.dataframe(df_amp, use_container_width=True, hide_index=True)
+                        st.button(
+                            "➕ Añadir a los overrides de capacidad",
+                            key="btn_aplicar_ampliacion",
+                            on_click=aplicar_overrides_propuestos,
+                            args=(amp,),
+                            help="Escribe estas capacidades en las tablas de overrides de la barra lateral. "
+                                 "Después, replanifica para asignar los lotes."
+                        )
+                        st.download_button(
+                            "💾 Descargar ampliaciones (Excel)",
+                            data=partial(generar_excel, df_amp, "ampliacion_capacidad.xlsx"),
+                            file_name="ampliacion_capacidad.xlsx",
+                            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+                        )
+        marcar_seccion("Ampliación")
 
         # -------------------------------
-        # Botón para descargar Excel (resultado visible)
+        # Botón para descargar Excel (resultado visible; se genera al pulsar)
         # -------------------------------
-        excel_bytes = generar_excel(df_editable, "planificacion_lotes.xlsx")
         st.download_button(
             label="💾 Descargar Excel con planificación",
-            data=excel_bytes,
+            data=partial(generar_excel_plan, df_show),
             file_name="planificacion_lotes.xlsx",
             mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
         )
+        # Cubo de cargas diario para BI (sale de las matrices de carga, no del Excel del plan)
+        params_cubo = dict(
+            estab_cap=estab_cap, cap_overrides_ent=cap_overrides_ent, cap_overrides_sal=cap_overrides_sal,
+            estab_cap_overrides=estab_cap_overrides, **params_planificador
+        )
+        c1, c2 = st.columns(2)
+        c1.download_button(
+            "🧊 Cubo de cargas diario (Parquet)",
+            data=partial(generar_cubo, df_show, familias_df, "parquet", parametros_sitio, **params_cubo),
+            file_name="cubo_cargas.parquet",
+            mime="application/vnd.apache.parquet",
+            help="Día × ENTRADA/SALIDA/ESTAB × familia (y SITIO si hay varios), con capacidad, "
+                 "utilización y exceso por intento."
+        )
+        c2.download_button(
+            "🧊 Cubo de cargas diario (CSV)",
+            data=partial(generar_cubo, df_show, familias_df, "csv", parametros_sitio, **params_cubo),
+            file_name="cubo_cargas.csv",
+            mime="text/csv"
+        )
+        marcar_seccion("Exportación plan")
 
 
@@ -0,0 +1,80 @@
+# benchmarks/bench_arranque.py
+# Informe de arranque en frío: en un proceso nuevo (como tras un despliegue) ejecuta app.py con
+# streamlit.testing.AppTest bajo `python -X importtime` y resume:
+#   - tiempo hasta el primer pintado (sin Excel y con un Excel sintético subido)
+#   - tiempo de importación por paquete raíz (suma de 'self' de todos sus submódulos)
+#   - qué módulos pesados (plotly, numba, matplotlib, openpyxl) se llegan a cargar
+#
+#   python benchmarks/bench_arranque.py [--lotes 500] [--top 12]
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+from collections import defaultdict
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from sintetico import lotes_sinteticos
+
+APP = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app.py")
+PESADOS = ("plotly", "numba", "matplotlib", "openpyxl", "pyarrow")
+
+CODIGO = """
+import sys, time, warnings
+warnings.filterwarnings("ignore")
+t0 = time.perf_counter()
+from streamlit.testing.v1 import AppTest
+at = AppTest.from_file({app!r}, default_timeout=300)
+at.run()
+if {excel!r}:
+    with open({excel!r}, "rb") as f:
+        at.file_uploader[0].set_value(("lotes.xlsx", f.read(), "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"))
+    at.run()
+assert not at.exception, [e.value for e in at.exception]
+print("__TIEMPO__", time.perf_counter() - t0)
+print("__PESADOS__", ",".join(m for m in {pesados!r} if m in sys.modules))
+"""
+
+
+def _ejecutar(excel):
+    """Proceso nuevo con -X importtime: (segundos hasta el primer pintado, pesados cargados, {paquete: s})."""
+    codigo = CODIGO.format(app=os.path.abspath(APP), excel=excel, pesados=PESADOS)
+    r = subprocess.run([sys.executable, "-X", "importtime", "-c", codigo], capture_output=True, text=True)
+    if r.returncode != 0:
+        raise RuntimeError(r.stderr[-2000:])
+    por_paquete = defaultdict(float)
+    for linea in r.stderr.splitlines():
+        if not linea.startswith("import time:") or "self [us]" in linea:
+            continue
+        propio, _, nombre = linea[len("import time:"):].split("|")
+        por_paquete[nombre.strip().split(".")[0]] += int(propio) / 1e6
+    tiempo = pesados = None
+    for linea in r.stdout.splitlines():
+        if linea.startswith("__TIEMPO__"):
+            tiempo = float(linea.split()[1])
+        elif linea.startswith("__PESADOS__"):
+            pesados = linea.split(" ", 1)[1] if " " in linea else ""
+    return tiempo, pesados, por_paquete
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--lotes", type=int, default=500, help="Lotes del Excel sintético del segundo escenario")
+    parser.add_argument("--top", type=int, default=12, help="Paquetes a listar por tiempo de importación")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        excel = os.path.join(tmp, "lotes.xlsx")
+        lotes_sinteticos(args.lotes).to_excel(excel, index=False)
+        for escenario, ruta in (("Sin Excel", ""), (f"Excel de {args.lotes} lotes", excel)):
+            tiempo, pesados, por_paquete = _ejecutar(ruta)
+            total_imp = sum(por_paquete.values())
+            print(f"\n== {escenario}: primer pintado {tiempo:.2f} s · importaciones {total_imp:.2f} s ==")
+            print(f"   módulos pesados cargados: {pesados or 'ninguno'}")
+            for paquete, s in sorted(por_paquete.items(), key=lambda kv: -kv[1])[: args.top]:
+                print(f"   {paquete:<24} {s:7.3f} s")
+
+
+if __name__ == "__main__":
+    main()
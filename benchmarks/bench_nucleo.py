@@ -0,0 +1,77 @@
+# benchmarks/bench_nucleo.py
+# Compara el bucle voraz por lotes (MOTOR_PYTHON) con el núcleo numérico (MOTOR_NUCLEO), que se
+# compila con Numba si está instalado. Comprueba además que ambos dan el mismo plan.
+#
+#   python benchmarks/bench_nucleo.py [--lotes 500 2000 5000] [--carga 0.6] [--repeticiones 3]
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import pandas as pd
+
+import planificador as P
+from sintetico import lotes_sinteticos
+
+
+def _mejor_tiempo(fn, repeticiones):
+    mejor, resultado = float("inf"), None
+    for _ in range(repeticiones):
+        t0 = time.perf_counter()
+        resultado = fn()
+        mejor = min(mejor, time.perf_counter() - t0)
+    return mejor, resultado
+
+
+def _cronometrar_nucleo():
+    """Envuelve el núcleo (compilado o Python) para medir solo su tiempo dentro de la planificación."""
+    acumulado = [0.0]
+    original = P._nucleo_compilado() or P._nucleo_asignacion
+
+    def _medido(*args):
+        t0 = time.perf_counter()
+        try:
+            return original(*args)
+        finally:
+            acumulado[0] += time.perf_counter() - t0
+    if P._nucleo_compilado() is not None:
+        P._NUCLEO_COMPILADO["nucleo"] = _medido
+    else:
+        P._nucleo_asignacion = _medido
+    return acumulado
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark del núcleo de asignación")
+    ap.add_argument("--lotes", type=int, nargs="+", default=[500, 2000, 5000])
+    ap.add_argument("--carga", type=float, default=0.6, help="escala de unidades (1.0 = temporada saturada)")
+    ap.add_argument("--repeticiones", type=int, default=3)
+    args = ap.parse_args()
+
+    compilado = P._nucleo_compilado() is not None
+    print(f"Numba: {'sí (núcleo compilado)' if compilado else 'no (núcleo en Python puro)'}")
+    if compilado:
+        # Primera llamada = compilación; no se cuenta
+        P.planificar_filas_na(P.normalizar_lotes(lotes_sinteticos(50)), 5, {}, P.ESTAB_CAP_DEFAULT, {}, {}, {})
+
+    t_kernel = _cronometrar_nucleo()
+    print(f"{'lotes':>7} {'no encajan':>10} {'python (s)':>11} {'núcleo (s)':>11} {'aceleración':>11} {'solo núcleo (s)':>16}")
+    for n in args.lotes:
+        df = P.normalizar_lotes(lotes_sinteticos(n, semilla=n, carga=args.carga))
+        comun = (df, P.DIAS_MAX_ALMACEN_DEFAULT, {}, P.ESTAB_CAP_DEFAULT, {}, {}, {})
+        t_py, (plan_py, sug_py) = _mejor_tiempo(
+            lambda: P.planificar_filas_na(*comun, procesos=1, motor=P.MOTOR_PYTHON), args.repeticiones)
+        t_kernel[0] = 0.0
+        t_nu, (plan_nu, sug_nu) = _mejor_tiempo(
+            lambda: P.planificar_filas_na(*comun, procesos=1, motor=P.MOTOR_NUCLEO), args.repeticiones)
+        t_solo = t_kernel[0] / args.repeticiones
+        pd.testing.assert_frame_equal(plan_py, plan_nu)
+        pd.testing.assert_frame_equal(sug_py, sug_nu)
+        no_encajan = int(plan_nu["LOTE_NO_ENCAJA"].sum())
+        print(f"{n:>7} {no_encajan:>10} {t_py:>11.2f} {t_nu:>11.2f} {t_py / t_nu:>10.1f}x {t_solo:>16.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+# benchmarks/bench_reruns.py
+# Latencia de interacción de la app: ejecuta app.py sin navegador (streamlit.testing.AppTest) con
+# subidas sintéticas de tamaño creciente y mide el rerun completo de las acciones típicas, con el
+# desglose por sección que anota la propia app (marcar_seccion → st.session_state["tiempos_secciones"]).
+#
+#   python benchmarks/bench_reruns.py [--lotes 200 1000 3000] [--repeticiones 3] [--csv salida.csv]
+import argparse
+import json
+import os
+import sys
+import time
+import warnings
+from io import BytesIO
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import pandas as pd
+from streamlit.proto.WidgetStates_pb2 import WidgetState
+from streamlit.testing.v1 import AppTest
+
+from sintetico import lotes_sinteticos
+
+APP = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app.py")
+MIME_XLSX = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+
+def _excel(df):
+    buf = BytesIO()
+    df.to_excel(buf, index=False)
+    return buf.getvalue()
+
+
+def _comprobar(at, accion):
+    if at.exception:
+        raise RuntimeError(f"{accion}: {[e.value for e in at.exception]}")
+
+
+def _rerun(at, accion, ejecutar):
+    """Lanza la acción, cronometra el rerun y devuelve {SECCION: s} con el TOTAL."""
+    t0 = time.perf_counter()
+    ejecutar()
+    total = time.perf_counter() - t0
+    _comprobar(at, accion)
+    fila = dict(at.session_state["tiempos_secciones"])
+    fila["TOTAL"] = total
+    return fila
+
+
+def _esperar_plan(at):
+    """Tras pulsar el botón, el plan corre en un hilo: reruns hasta que se instala el resultado."""
+    while "trabajo_plan" in at.session_state:
+        time.sleep(0.05)
+        at.run()
+        _comprobar(at, "planificar")
+
+
+def _editar_fila(at):
+    """
+    Edición de una celda del editor de planificación. AppTest no expone st.data_editor, así que se
+    envía el mismo estado de widget que manda el navegador ({"edited_rows": ...}) con el id del editor.
+    """
+    editor = next(e for e in at.dataframe if "plan_editor" in e.proto.id)
+    estados = at._tree.get_widget_states()
+    estados.widgets.append(WidgetState(
+        id=editor.proto.id,
+        string_value=json.dumps({"edited_rows": {"0": {"UNDS": 1}}, "added_rows": [], "deleted_rows": []}),
+    ))
+    at._run(estados)
+
+
+def medir(n_lotes, repeticiones):
+    """Una sesión por repetición: subida → planificar → rerun → capacidad → lote → edición."""
+    datos = _excel(lotes_sinteticos(n_lotes, carga=0.6))
+    filas = []
+    for rep in range(repeticiones):
+        at = AppTest.from_file(APP, default_timeout=600)
+        at.run()
+        _comprobar(at, "inicio")
+
+        at.file_uploader[0].set_value(("lotes.xlsx", datos, MIME_XLSX))
+        filas.append(("Subir Excel", _rerun(at, "subir", at.run)))
+
+        boton = next(b for b in at.button if "Aplicar planificación" in b.label)
+        def _planificar():
+            boton.click()
+            at.run()
+            _esperar_plan(at)
+        filas.append(("Planificar", _rerun(at, "planificar", _planificar)))
+
+        filas.append(("Rerun sin cambios", _rerun(at, "rerun", at.run)))
+
+        cap = next(w for w in at.number_input if w.label.startswith("Capacidad cámara"))
+        filas.append(("Cambiar capacidad", _rerun(at, "capacidad", lambda: cap.set_value(cap.value + 100).run())))
+
+        lotes = next(w for w in at.multiselect if w.label.startswith("Elige qué lotes"))
+        if lotes.value:
+            filas.append(("Quitar un lote", _rerun(at, "lote", lambda: lotes.unselect(lotes.value[0]).run())))
+
+        filas.append(("Editar fila", _rerun(at, "editar", lambda: _editar_fila(at))))
+
+    df = pd.DataFrame([dict(ACCION=accion, **tiempos) for accion, tiempos in filas]).fillna(0.0)
+    df = df.groupby("ACCION", sort=False).median()
+    df.insert(0, "LOTES", n_lotes)
+    return df
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--lotes", type=int, nargs="+", default=[200, 1000, 3000])
+    parser.add_argument("--repeticiones", type=int, default=3)
+    parser.add_argument("--csv", default=None, help="Guarda también la tabla (ACCION × SECCION) en CSV")
+    args = parser.parse_args()
+    warnings.filterwarnings("ignore")
+
+    tablas = []
+    for n in args.lotes:
+        tabla = medir(n, args.repeticiones)
+        tablas.append(tabla)
+        # Secciones ordenadas por tiempo total; el rerun completo (TOTAL) al final
+        secciones = tabla.drop(columns=["LOTES", "TOTAL"]).sum().sort_values(ascending=False).index.tolist()
+        print(f"\n== {n} lotes (mediana de {args.repeticiones}, segundos) ==")
+        with pd.option_context("display.width", 250, "display.max_columns", 30):
+            print(tabla[secciones + ["TOTAL"]].round(3).to_string())
+
+    if args.csv:
+        pd.concat(tablas).reset_index().to_csv(args.csv, index=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,321 @@
+# benchmarks/diferencial.py
+# Prueba diferencial: planificador de referencia (planificador_referencia.py, congelado) frente al
+# motor optimizado (planificador.planificar_filas_na) sobre casos aleatorios con semilla: festivos de
+# martes a jueves (desempate por carga de SALIDA), overrides por fecha con CAP1/CAP2 vacíos, grupos de
+# entrada común, lotes ya planificados y capacidades justas para forzar el 2º intento y los no encaja.
+# Cada fallo se reduce (ddmin sobre los lotes y después sobre los parámetros) y se guarda como Excel
+# de lotes (el mismo formato que sube la app) + JSON con los parámetros.
+#
+#   python benchmarks/diferencial.py [--casos 2000] [--semilla 0] [--max-lotes 80]
+#                                    [--motor nucleo|python] [--procesos N]
+#                                    [--salida fallos_diferencial] [--reproducir fallo_123.json]
+import argparse
+import json
+import math
+import os
+import sys
+import time
+import traceback
+import warnings
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import numpy as np
+import pandas as pd
+
+import planificador as P
+from planificador_referencia import DIAS_FESTIVOS_DEFAULT, planificar_referencia
+from sintetico import PRODUCTOS
+
+COLUMNAS_PLAN = ["ENTRADA_SAL", "SALIDA_SAL", "DIAS_SAL", "DIAS_ALMACENADOS", "LOTE_NO_ENCAJA", "DIFERENCIA_DIAS_SAL"]
+PARAMETROS = [
+    "dias_max_almacen_global", "dias_max_por_producto", "estab_cap",
+    "cap_overrides_ent", "cap_overrides_sal", "estab_cap_overrides",
+]
+GRUPOS = {c for g in P.GRUPOS_ENTRADA_COMUN_UNITARIOS for c in g} | set(P.GRUPO_ENTRADA_COMUN_CONJUNTO)
+CALENDARIO = ["cap_ent", "cap_sal", "dias_festivos", "ajuste_finde", "ajuste_festivos"]
+
+
+# -------------------------------
+# Casos aleatorios
+# -------------------------------
+def _laborables(rng, desde, n_dias, k):
+    """k fechas de lunes a viernes en [desde, desde + n_dias)."""
+    fechas = pd.Timestamp(desde) + pd.to_timedelta(rng.integers(0, max(1, n_dias), 4 * k + 4), unit="D")
+    return [f for f in fechas if f.weekday() < 5][:k]
+
+
+def caso_aleatorio(semilla, max_lotes=80):
+    """Caso reproducible: lotes (sin planificar o parcialmente planificados) + parámetros del planificador."""
+    rng = np.random.default_rng(semilla)
+    n = int(rng.integers(1, max_lotes + 1))
+    # Inicio cerca de un festivo la mitad de las veces (puentes, festivos encadenados)
+    if rng.random() < 0.5:
+        inicio = pd.Timestamp(str(rng.choice(DIAS_FESTIVOS_DEFAULT))) - pd.Timedelta(days=int(rng.integers(0, 20)))
+    else:
+        inicio = pd.Timestamp("2025-01-06") + pd.Timedelta(days=int(rng.integers(0, 330)))
+    n_dias = max(1, n // int(rng.integers(1, 10)))
+
+    # Pocos productos por caso para que coincidan los grupos de entrada común
+    productos = rng.choice(PRODUCTOS, size=int(rng.integers(1, len(PRODUCTOS) + 1)), replace=False)
+    lotes = pd.DataFrame({
+        "LOTE": [f"L{i:04d}" for i in range(n)],
+        "PRODUCTO": rng.choice(productos, n),
+        "UNDS": rng.integers(50, 1500, n),
+        "DIA": inicio + pd.to_timedelta(rng.integers(0, n_dias, n), unit="D"),
+        "DIAS_SAL_OPTIMOS": rng.integers(5, 21, n),
+        "TIPO NITRIF": rng.choice(["IBERICO", "BLANCO", "OTRO"], n),
+        "NITRIF": rng.choice([1, 2, 3], n),
+        "ENTRADA_SAL": pd.NaT,
+        "SALIDA_SAL": pd.NaT,
+    })
+
+    cap1 = int(rng.integers(8, 40)) * 100
+    cap_ent = (cap1, cap1 + int(rng.integers(0, 10)) * 100)
+    cap1 = int(rng.integers(8, 40)) * 100
+    cap_sal = (cap1, cap1 + int(rng.integers(0, 10)) * 100)
+    horizonte = n_dias + 30
+    caso = {
+        "lotes": lotes,
+        "dias_max_almacen_global": int(rng.integers(0, 8)),
+        # Override vacío (NaN) en algún producto fuera de los grupos de entrada común: sin días
+        # candidatos, el lote no encaja (en los grupos la referencia falla con int(NaN))
+        "dias_max_por_producto": {
+            str(p): np.nan if rng.random() < 0.2 and p not in GRUPOS else int(rng.integers(0, 8))
+            for p in productos if rng.random() < 0.3
+        },
+        "estab_cap": int(rng.integers(5, 60)) * 100,
+        "cap_overrides_ent": {
+            f.normalize(): {
+                "CAP1": None if rng.random() < 0.3 else int(rng.integers(0, 40)) * 100,
+                "CAP2": None if rng.random() < 0.3 else int(rng.integers(0, 45)) * 100,
+            }
+            for f in _laborables(rng, inicio, horizonte, int(rng.integers(0, 4)))
+        },
+        "cap_overrides_sal": {
+            f.normalize(): {
+                "CAP1": None if rng.random() < 0.3 else int(rng.integers(0, 40)) * 100,
+                "CAP2": None if rng.random() < 0.3 else int(rng.integers(0, 45)) * 100,
+            }
+            for f in _laborables(rng, inicio + pd.Timedelta(days=5), horizonte, int(rng.integers(0, 4)))
+        },
+        "estab_cap_overrides": {
+            f.normalize(): int(rng.integers(0, 60)) * 100
+            for f in _laborables(rng, inicio, horizonte, int(rng.integers(0, 3)))
+        },
+        "cap_ent": cap_ent,
+        "cap_sal": cap_sal,
+        # Festivos extra entre semana en el horizonte de SALIDA: ejercitan el desempate por carga
+        "dias_festivos": sorted(
+            set(DIAS_FESTIVOS_DEFAULT)
+            | {str(f.date()) for f in _laborables(rng, inicio, horizonte, int(rng.integers(0, 6)))}
+        ),
+        "ajuste_finde": bool(rng.random() < 0.8),
+        "ajuste_festivos": bool(rng.random() < 0.8),
+    }
+
+    # Parte del plan ya fijada (cargas existentes y fechas preferentes de los grupos)
+    if n > 1 and rng.random() < 0.3:
+        plan, _ = planificar_referencia(lotes.copy(), *_args(caso), **_kwargs(caso))
+        fijas = (rng.random(n) < 0.5) & plan["ENTRADA_SAL"].notna().to_numpy()
+        caso["lotes"] = lotes.assign(
+            ENTRADA_SAL=plan["ENTRADA_SAL"].where(fijas),
+            SALIDA_SAL=plan["SALIDA_SAL"].where(fijas),
+        )
+    return caso
+
+
+def _args(caso):
+    return [caso[p] for p in PARAMETROS]
+
+
+def _kwargs(caso):
+    return {p: caso[p] for p in CALENDARIO}
+
+
+# -------------------------------
+# Comparación
+# -------------------------------
+def _plan_comparable(plan):
+    p = plan.copy()
+    p["LOTE_NO_ENCAJA"] = P.no_encaja_a_texto(p["LOTE_NO_ENCAJA"]) if "LOTE_NO_ENCAJA" in p.columns else pd.NA
+    for c in ("DIAS_SAL", "DIAS_ALMACENADOS", "DIFERENCIA_DIAS_SAL"):
+        p[c] = pd.to_numeric(p[c], errors="coerce").astype(float) if c in p.columns else np.nan
+    for c in ("ENTRADA_SAL", "SALIDA_SAL"):
+        p[c] = pd.to_datetime(p[c])
+    # Texto con un único marcador de vacío (NaN, NaT, pd.NA y "nan" de versiones anteriores de pandas)
+    p = p[["LOTE"] + COLUMNAS_PLAN].astype(str).fillna("<NA>").replace({"nan": "<NA>", "NaT": "<NA>"})
+    return p.set_index("LOTE").sort_index()
+
+
+def _sugerencias_comparables(sug):
+    s = sug.copy()
+    for c in s.columns:
+        if "DEFICIT" in c or c in ("UNDS", "INTENTO"):
+            s[c] = pd.to_numeric(s[c]).astype(int)
+    return s.astype(str).fillna("<NA>").reset_index(drop=True)
+
+
+def diferencia(caso, opciones):
+    """None si referencia y motor coinciden; si no, texto con la primera discrepancia."""
+    ref_plan, ref_sug = planificar_referencia(caso["lotes"].copy(), *_args(caso), **_kwargs(caso))
+    try:
+        plan, sug = P.planificar_filas_na(
+            P.normalizar_lotes(caso["lotes"].copy()), *_args(caso), **_kwargs(caso), **opciones
+        )
+    except Exception as e:
+        return f"excepción en el motor: {type(e).__name__}: {e}"
+
+    a, b = _plan_comparable(ref_plan), _plan_comparable(plan)
+    if not a.index.equals(b.index):
+        return f"lotes distintos: referencia {len(a)}, motor {len(b)}"
+    distintas = a.ne(b)
+    if distintas.any(axis=None):
+        lote = distintas.any(axis=1).idxmax()
+        cols = distintas.columns[distintas.loc[lote]].tolist()
+        return f"plan: lote {lote} · " + ", ".join(f"{c} {a.at[lote, c]} → {b.at[lote, c]}" for c in cols)
+
+    sa, sb = _sugerencias_comparables(ref_sug), _sugerencias_comparables(sug)
+    if not (sa.columns.equals(sb.columns) and len(sa) == len(sb)):
+        return f"sugerencias: referencia {len(sa)} filas, motor {len(sb)}"
+    fila = sa.ne(sb).any(axis=1)
+    if fila.any():
+        i = int(fila.idxmax())
+        return f"sugerencias: fila {i} · referencia {sa.iloc[i].to_dict()} · motor {sb.iloc[i].to_dict()}"
+    return None
+
+
+# -------------------------------
+# Reducción de casos que fallan
+# -------------------------------
+def _con_filas(caso, filas):
+    return dict(caso, lotes=caso["lotes"].iloc[filas].reset_index(drop=True))
+
+
+def reducir(caso, falla):
+    """
+    Caso mínimo que sigue fallando: ddmin sobre las filas de lotes y después, una a una, las
+    entradas de overrides, días máx. por producto y festivos añadidos.
+    """
+    filas = list(range(len(caso["lotes"])))
+    trozos = 2
+    while len(filas) >= 2:
+        tam = math.ceil(len(filas) / trozos)
+        for i in range(0, len(filas), tam):
+            resto = filas[:i] + filas[i + tam:]
+            if resto and falla(_con_filas(caso, resto)):
+                filas, trozos = resto, max(trozos - 1, 2)
+                break
+        else:
+            if trozos >= len(filas):
+                break
+            trozos = min(2 * trozos, len(filas))
+    caso = _con_filas(caso, filas)
+
+    for clave in ("cap_overrides_ent", "cap_overrides_sal", "estab_cap_overrides", "dias_max_por_producto"):
+        for k in list(caso[clave]):
+            prueba = dict(caso, **{clave: {kk: v for kk, v in caso[clave].items() if kk != k}})
+            if falla(prueba):
+                caso = prueba
+    extra = [f for f in caso["dias_festivos"] if f not in DIAS_FESTIVOS_DEFAULT]
+    for f in extra:
+        prueba = dict(caso, dias_festivos=[x for x in caso["dias_festivos"] if x != f])
+        if falla(prueba):
+            caso = prueba
+    return caso
+
+
+# -------------------------------
+# Guardar / reproducir
+# -------------------------------
+def _overrides_a_json(ov):
+    return {str(pd.Timestamp(k).date()): v for k, v in ov.items()}
+
+
+def _overrides_de_json(ov):
+    return {pd.Timestamp(k): v for k, v in ov.items()}
+
+
+def guardar_fallo(caso, nombre, motivo, carpeta):
+    """Excel de lotes (se puede subir a la app) + JSON con parámetros y discrepancia."""
+    os.makedirs(carpeta, exist_ok=True)
+    ruta_xlsx = os.path.join(carpeta, f"{nombre}.xlsx")
+    caso["lotes"].to_excel(ruta_xlsx, index=False)
+    params = {p: caso[p] for p in PARAMETROS + CALENDARIO}
+    for clave in ("cap_overrides_ent", "cap_overrides_sal", "estab_cap_overrides"):
+        params[clave] = _overrides_a_json(params[clave])
+    params["cap_ent"], params["cap_sal"] = list(params["cap_ent"]), list(params["cap_sal"])
+    ruta_json = os.path.join(carpeta, f"{nombre}.json")
+    with open(ruta_json, "w", encoding="utf-8") as f:
+        json.dump({"lotes": os.path.basename(ruta_xlsx), "motivo": motivo, "parametros": params},
+                  f, ensure_ascii=False, indent=2)
+    return ruta_json
+
+
+def cargar_caso(ruta_json):
+    with open(ruta_json, encoding="utf-8") as f:
+        guardado = json.load(f)
+    caso = dict(guardado["parametros"])
+    for clave in ("cap_overrides_ent", "cap_overrides_sal", "estab_cap_overrides"):
+        caso[clave] = _overrides_de_json(caso[clave])
+    caso["cap_ent"], caso["cap_sal"] = tuple(caso["cap_ent"]), tuple(caso["cap_sal"])
+    lotes = pd.read_excel(os.path.join(os.path.dirname(ruta_json), guardado["lotes"]), engine="openpyxl")
+    for c in ("DIA", "ENTRADA_SAL", "SALIDA_SAL"):
+        lotes[c] = pd.to_datetime(lotes[c], errors="coerce")
+    caso["lotes"] = lotes
+    return caso
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--casos", type=int, default=2000)
+    parser.add_argument("--semilla", type=int, default=0, help="Semilla del primer caso (los siguientes, consecutivas)")
+    parser.add_argument("--max-lotes", type=int, default=80)
+    parser.add_argument("--motor", choices=[P.MOTOR_NUCLEO, P.MOTOR_PYTHON], default=P.MOTOR_NUCLEO)
+    parser.add_argument("--procesos", type=int, default=None, help="Procesos del planificador (por defecto, en serie)")
+    parser.add_argument("--salida", default="fallos_diferencial", help="Carpeta para los casos reducidos")
+    parser.add_argument("--max-fallos", type=int, default=5, help="Se detiene tras este número de fallos")
+    parser.add_argument("--reproducir", default=None, help="JSON guardado por un fallo anterior")
+    args = parser.parse_args()
+    warnings.filterwarnings("ignore")
+
+    # Solo el orden cronológico es comparable: 'holgura' cambia las asignaciones a propósito
+    opciones = dict(motor=args.motor, orden=P.ORDEN_CRONOLOGICO, procesos=args.procesos or 1)
+    if args.procesos:
+        # El reparto en procesos solo se activa a partir de este tamaño; aquí se fuerza siempre
+        P.UMBRAL_PARALELO = 0
+
+    if args.reproducir:
+        motivo = diferencia(cargar_caso(args.reproducir), opciones)
+        print(motivo or "El motor coincide con la referencia en este caso.")
+        sys.exit(1 if motivo else 0)
+
+    t0 = time.perf_counter()
+    fallos = 0
+    for k in range(args.casos):
+        semilla = args.semilla + k
+        try:
+            caso = caso_aleatorio(semilla, args.max_lotes)
+            motivo = diferencia(caso, opciones)
+        except Exception:
+            print(f"[{semilla}] caso no válido para la referencia:\n{traceback.format_exc()}")
+            continue
+        if motivo is not None:
+            fallos += 1
+            n0 = len(caso["lotes"])
+            minimo = reducir(caso, lambda c: diferencia(c, opciones) is not None)
+            motivo_min = diferencia(minimo, opciones)
+            ruta = guardar_fallo(minimo, f"fallo_{semilla}", motivo_min, args.salida)
+            print(f"[{semilla}] ❌ {motivo}\n    reducido de {n0} a {len(minimo['lotes'])} lotes → {ruta}\n    {motivo_min}")
+            if fallos >= args.max_fallos:
+                break
+        if (k + 1) % 100 == 0:
+            print(f"{k + 1} casos · {fallos} fallos · {time.perf_counter() - t0:.0f} s", flush=True)
+
+    print(f"Total: {k + 1} casos, {fallos} fallos ({time.perf_counter() - t0:.1f} s)")
+    sys.exit(1 if fallos else 0)
+
+
+if __name__ == "__main__":
+    main()
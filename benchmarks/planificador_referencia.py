@@ -0,0 +1,550 @@
+# benchmarks/planificador_referencia.py
+# Planificador de REFERENCIA (oráculo congelado) para benchmarks/diferencial.py.
+# Es el algoritmo original de planificar_filas_na tal como estaba en app.py antes del trabajo de
+# rendimiento (bucle por filas con iterrows, diccionarios de cargas y date_range por día), con las
+# globales de la barra lateral convertidas en parámetros. NO se optimiza ni se refactoriza: cualquier
+# cambio de reglas en planificador.py debe replicarse aquí a propósito, en un commit aparte.
+import pandas as pd
+from datetime import timedelta
+from collections import Counter
+
+CAP_ENT_DEFAULT = (3100, 3500)
+CAP_SAL_DEFAULT = (3100, 3500)
+DIAS_FESTIVOS_DEFAULT = [
+    "2025-01-01", "2025-04-18", "2025-05-01", "2025-08-15",
+    "2025-10-12", "2025-10-13", "2025-11-01", "2025-12-25","2025-12-24","2025-12-31","2026-01-01"
+]
+
+def _sumar_en_rango(dic, fecha_ini, fecha_fin_inclusive, unds):
+    """Suma 'unds' en dic[fecha] para todas las fechas entre ini y fin (ambas incluidas)."""
+    if pd.isna(fecha_ini) or pd.isna(fecha_fin_inclusive):
+        return
+    for d in pd.date_range(fecha_ini, fecha_fin_inclusive, freq="D"):
+        d0 = d.normalize()
+        dic[d0] = dic.get(d0, 0) + unds
+
+def planificar_referencia(
+    df_plan,
+    dias_max_almacen_global,
+    dias_max_por_producto,
+    estab_cap,
+    cap_overrides_ent,
+    cap_overrides_sal,
+    estab_cap_overrides,
+    *,
+    cap_ent=CAP_ENT_DEFAULT,
+    cap_sal=CAP_SAL_DEFAULT,
+    dias_festivos=DIAS_FESTIVOS_DEFAULT,
+    ajuste_finde=True,
+    ajuste_festivos=True,
+):
+    """
+    Misma firma y salida que planificador.planificar_filas_na (LOTE_NO_ENCAJA en texto 'Sí'/'No').
+    Espera DIA/ENTRADA_SAL/SALIDA_SAL como fechas y UNDS entero, como hacía la app al leer el Excel.
+    """
+    # Parámetros que en la app original eran globales de la barra lateral
+    cap_ent_1, cap_ent_2 = cap_ent
+    cap_sal_1, cap_sal_2 = cap_sal
+    dias_festivos = pd.to_datetime(list(dias_festivos))
+
+    def es_habil(fecha):
+        # Hábil si es lunes-viernes y no es festivo (comparando por fecha normalizada)
+        return fecha.weekday() < 5 and fecha.normalize() not in dias_festivos
+
+    def siguiente_habil(fecha):
+        f = fecha + timedelta(days=1)
+        while not es_habil(f):
+            f += timedelta(days=1)
+        return f
+
+    def anterior_habil(fecha):
+        f = fecha - timedelta(days=1)
+        while not es_habil(f):
+            f -= timedelta(days=1)
+        return f
+
+    df_corr = df_plan.copy()
+
+    # Asegurar columnas auxiliares
+    for col in ["LOTE_NO_ENCAJA"]:
+        if col not in df_corr.columns:
+            df_corr[col] = pd.NA
+
+    # Cargas ya planificadas (se respetan)
+    carga_entrada = df_corr.dropna(subset=["ENTRADA_SAL"]).groupby("ENTRADA_SAL")["UNDS"].sum().to_dict()
+    carga_salida  = df_corr.dropna(subset=["SALIDA_SAL"]).groupby("SALIDA_SAL")["UNDS"].sum().to_dict()
+
+    # Ocupación diaria ya existente en estabilización (por filas ya planificadas)
+    estab_stock = {}
+    for _, r in df_corr.dropna(subset=["ENTRADA_SAL"]).iterrows():
+        dia_rec = r["DIA"]
+        ent     = r["ENTRADA_SAL"]
+        unds    = r["UNDS"]
+        if pd.notna(dia_rec) and pd.notna(ent) and ent.date() > dia_rec.date():
+            _sumar_en_rango(estab_stock, dia_rec, ent - pd.Timedelta(days=1), unds)
+
+    # Helpers: capacidad por día/intent separadas para ENTRADA y SALIDA
+    def get_cap_ent(date_dt, attempt):
+        dkey = pd.to_datetime(date_dt).normalize()
+        ov = cap_overrides_ent.get(dkey)
+        if ov is not None:
+            if attempt == 1 and pd.notna(ov.get("CAP1")):
+                return int(ov["CAP1"])
+            if attempt == 2 and pd.notna(ov.get("CAP2")):
+                return int(ov["CAP2"])
+        return cap_ent_1 if attempt == 1 else cap_ent_2
+
+    def get_cap_sal(date_dt, attempt):
+        dkey = pd.to_datetime(date_dt).normalize()
+        ov = cap_overrides_sal.get(dkey)
+        if ov is not None:
+            if attempt == 1 and pd.notna(ov.get("CAP1")):
+                return int(ov["CAP1"])
+            if attempt == 2 and pd.notna(ov.get("CAP2")):
+                return int(ov["CAP2"])
+        return cap_sal_1 if attempt == 1 else cap_sal_2
+
+    # Capacidad de estabilización por día (override si existe)
+    def get_estab_cap(date_dt):
+        dkey = pd.to_datetime(date_dt).normalize()
+        ov = estab_cap_overrides.get(dkey)
+        return ov if (ov is not None and pd.notna(ov)) else estab_cap
+
+    # Chequeo de capacidad de estabilización en rango [ini, fin]
+    def cabe_en_estab_rango(fecha_ini, fecha_fin_inclusive, unds):
+        if pd.isna(fecha_ini) or pd.isna(fecha_fin_inclusive):
+            return True
+        if fecha_fin_inclusive < fecha_ini:
+            return True
+        for d in pd.date_range(fecha_ini, fecha_fin_inclusive, freq="D"):
+            d0 = d.normalize()
+            if estab_stock.get(d0, 0) + unds > get_estab_cap(d0):
+                return False
+        return True
+
+    # Devuelve déficits de estabilización por día (dict fecha->faltan_unds) para un rango
+    def deficits_estab(fecha_ini, fecha_fin_inclusive, unds):
+        deficits = {}
+        if pd.isna(fecha_ini) or pd.isna(fecha_fin_inclusive):
+            return deficits
+        if fecha_fin_inclusive < fecha_ini:
+            return deficits
+        for d in pd.date_range(fecha_ini, fecha_fin_inclusive, freq="D"):
+            d0 = d.normalize()
+            falta = (estab_stock.get(d0, 0) + unds) - get_estab_cap(d0)
+            if falta > 0:
+                deficits[d0] = int(falta)
+        return deficits
+
+    # REGLAS ESPECIALES DE ENTRADA COMÚN
+    # - Grupos unitarios (mismo día por código):
+    #   ["JBSPRCLC-MEX"], ["JCIVRROD-MEX"], ["JBCPRCLC-MEX"]
+    # - Grupo conjunto (mismo día entre ambos, con fallback por separado):
+    #   ["JCIVRPORCISAN", "PCIVRPORCISAN"]
+    def _aplicar_entrada_comun_para_grupo(codigos, marcar_si_falla=False):
+        if "PRODUCTO" not in df_corr.columns:
+            return False
+
+        mask_group = df_corr["PRODUCTO"].astype(str).isin(codigos) & df_corr["ENTRADA_SAL"].isna()
+        if not mask_group.any():
+            return False
+        pending = df_corr.loc[mask_group].copy()
+
+        fechas_existentes = sorted(
+            df_corr.loc[
+                df_corr["PRODUCTO"].astype(str).isin(codigos) & df_corr["ENTRADA_SAL"].notna(),
+                "ENTRADA_SAL"
+            ].dt.normalize().unique().tolist()
+        )
+        fecha_preferente = fechas_existentes[0] if len(fechas_existentes) > 0 else None
+
+        inicios, limites = [], []
+        for _, r in pending.iterrows():
+            dia_recepcion = r["DIA"]
+            prod = r["PRODUCTO"]
+            dias_max_almacen = dias_max_por_producto.get(prod, dias_max_almacen_global)
+            entrada_ini_i = dia_recepcion if es_habil(dia_recepcion) else siguiente_habil(dia_recepcion)
+            limite_i = dia_recepcion + pd.Timedelta(days=int(dias_max_almacen))
+            inicios.append(entrada_ini_i.normalize())
+            limites.append(limite_i.normalize())
+
+        if not inicios:
+            return False
+
+        inicio_comun = max(inicios)
+        limite_comun = min(limites)
+        if inicio_comun > limite_comun:
+            if marcar_si_falla:
+                for idxp, _ in pending.iterrows():
+                    df_corr.at[idxp, "LOTE_NO_ENCAJA"] = "Sí"
+            return False
+
+        def _es_factible_entrada_comun(d, attempt):
+            if d is None:
+                return False
+            d = pd.to_datetime(d).normalize()
+
+            total_unds = int(pending["UNDS"].sum())
+            if carga_entrada.get(d, 0) + total_unds > get_cap_ent(d, attempt):
+                return False
+
+            sim_stock = dict(estab_stock)
+            for _, r in pending.iterrows():
+                dia_rec = r["DIA"]
+                unds_i = int(r["UNDS"])
+                if d.date() > dia_rec.date():
+                    for k in pd.date_range(dia_rec.normalize(), (d - pd.Timedelta(days=1)).normalize(), freq="D"):
+                        k0 = k.normalize()
+                        if sim_stock.get(k0, 0) + unds_i > get_estab_cap(k0):
+                            return False
+                        sim_stock[k0] = sim_stock.get(k0, 0) + unds_i
+
+            add_salida = {}
+            for _, r in pending.iterrows():
+                unds_i = int(r["UNDS"])
+                dias_sal_optimos = int(r["DIAS_SAL_OPTIMOS"])
+                salida = d + timedelta(days=dias_sal_optimos)
+                if ajuste_finde:
+                    if salida.weekday() == 5:
+                        salida = anterior_habil(salida)
+                    elif salida.weekday() == 6:
+                        salida = siguiente_habil(salida)
+                if ajuste_festivos and (salida.normalize() in dias_festivos):
+                    dia_semana = salida.weekday()
+                    if dia_semana == 0:
+                        salida = siguiente_habil(salida)
+                    elif dia_semana in [1, 2, 3]:
+                        anterior = anterior_habil(salida)
+                        siguiente = siguiente_habil(salida)
+                        carga_ant = carga_salida.get(anterior, 0) + add_salida.get(anterior, 0)
+                        carga_sig = carga_salida.get(siguiente, 0) + add_salida.get(siguiente, 0)
+                        salida = anterior if carga_ant <= carga_sig else siguiente
+                    elif dia_semana == 4:
+                        salida = anterior_habil(salida)
+                add_salida[salida] = add_salida.get(salida, 0) + unds_i
+
+            for sfecha, suma_unds in add_salida.items():
+                if carga_salida.get(sfecha, 0) + suma_unds > get_cap_sal(sfecha, attempt):
+                    return False
+
+            return True
+
+        entrada_elegida = None
+        for attempt in [1, 2]:
+            candidatos = []
+            if fecha_preferente is not None:
+                if (fecha_preferente >= inicio_comun) and (fecha_preferente <= limite_comun):
+                    candidatos.append(pd.to_datetime(fecha_preferente).normalize())
+
+            d = inicio_comun
+            if not es_habil(d):
+                d = siguiente_habil(d)
+            while d <= limite_comun:
+                if d not in candidatos:
+                    candidatos.append(d)
+                d = siguiente_habil(d)
+
+            for d in candidatos:
+                if _es_factible_entrada_comun(d, attempt):
+                    entrada_elegida = d
+                    break
+            if entrada_elegida is not None:
+                break
+
+        if entrada_elegida is not None:
+            for idxp, r in pending.iterrows():
+                dia_recepcion = r["DIA"]
+                unds_i = int(r["UNDS"])
+                dias_sal_optimos = int(r["DIAS_SAL_OPTIMOS"])
+
+                df_corr.at[idxp, "ENTRADA_SAL"] = entrada_elegida
+                salida = entrada_elegida + timedelta(days=dias_sal_optimos)
+                if ajuste_finde:
+                    if salida.weekday() == 5:
+                        salida = anterior_habil(salida)
+                    elif salida.weekday() == 6:
+                        salida = siguiente_habil(salida)
+                if ajuste_festivos and (salida.normalize() in dias_festivos):
+                    dia_semana = salida.weekday()
+                    if dia_semana == 0:
+                        salida = siguiente_habil(salida)
+                    elif dia_semana in [1, 2, 3]:
+                        anterior = anterior_habil(salida)
+                        siguiente = siguiente_habil(salida)
+                        carga_ant = carga_salida.get(anterior, 0)
+                        carga_sig = carga_salida.get(siguiente, 0)
+                        salida = anterior if carga_ant <= carga_sig else siguiente
+                    elif dia_semana == 4:
+                        salida = anterior_habil(salida)
+
+                df_corr.at[idxp, "SALIDA_SAL"] = salida
+                df_corr.at[idxp, "DIAS_SAL"] = (salida - entrada_elegida).days
+                df_corr.at[idxp, "DIAS_ALMACENADOS"] = (entrada_elegida - dia_recepcion).days
+                df_corr.at[idxp, "LOTE_NO_ENCAJA"] = "No"
+
+                carga_entrada[entrada_elegida] = carga_entrada.get(entrada_elegida, 0) + unds_i
+                carga_salida[salida] = carga_salida.get(salida, 0) + unds_i
+                if entrada_elegida.date() > dia_recepcion.date():
+                    _sumar_en_rango(estab_stock, dia_recepcion, entrada_elegida - pd.Timedelta(days=1), unds_i)
+
+            return True
+
+        if marcar_si_falla:
+            for idxp, _ in pending.iterrows():
+                df_corr.at[idxp, "LOTE_NO_ENCAJA"] = "Sí"
+        return False
+
+    # Ejecutar reglas especiales
+    # - Grupos unitarios (cada código: todas sus filas al MISMO día de ENTRADA)
+    _aplicar_entrada_comun_para_grupo(["JBSPRCLC-MEX"], marcar_si_falla=False)
+    _aplicar_entrada_comun_para_grupo(["JCIVRROD-MEX"], marcar_si_falla=False)
+    _aplicar_entrada_comun_para_grupo(["JBCPRCLC-MEX"], marcar_si_falla=False)
+
+    # - Grupo conjunto (dos códigos al MISMO día entre sí). Si no cabe, fallback por separado.
+    exito_conjunto = _aplicar_entrada_comun_para_grupo(
+        ["JCIVRPORCISAN", "PCIVRPORCISAN"], marcar_si_falla=False
+    )
+    if not exito_conjunto:
+        _aplicar_entrada_comun_para_grupo(["JCIVRPORCISAN"], marcar_si_falla=False)
+        _aplicar_entrada_comun_para_grupo(["PCIVRPORCISAN"], marcar_si_falla=False)
+    # ===============================
+    # Asignación de pendientes minimizando cambios de TIPO/NITRIF por día
+    # ===============================
+    entrada_profile = {}
+    if "ENTRADA_SAL" in df_corr.columns:
+        ya = df_corr.dropna(subset=["ENTRADA_SAL"]).copy()
+        if not ya.empty:
+            def _norm_tipo(v):
+                s = str(v).strip().upper()
+                if "IBER" in s:
+                    return "IBÉRICO"
+                if "BLAN" in s:
+                    return "BLANCO"
+                return "OTRO"
+            def _norm_nitrif(v):
+                try:
+                    return int(v)
+                except Exception:
+                    return None
+            col_tipo = "TIPO NITRIF" if "TIPO NITRIF" in ya.columns else None
+            col_nitrif = "NITRIF" if "NITRIF" in ya.columns else None
+            for _, r in ya.iterrows():
+                d = pd.to_datetime(r["ENTRADA_SAL"]).normalize()
+                tipo = _norm_tipo(r[col_tipo]) if col_tipo else "OTRO"
+                nitr = _norm_nitrif(r[col_nitrif]) if col_nitrif else None
+                if d not in entrada_profile:
+                    entrada_profile[d] = {"tipo": Counter(), "nitrif": Counter()}
+                entrada_profile[d]["tipo"][tipo] += 1
+                if nitr is not None:
+                    entrada_profile[d]["nitrif"][nitr] += 1
+
+    def _norm_tipo(v):
+        s = str(v).strip().upper()
+        if "IBER" in s:
+            return "IBÉRICO"
+        if "BLAN" in s:
+            return "BLANCO"
+        return "OTRO"
+    def _norm_nitrif(v):
+        try:
+            return int(v)
+        except Exception:
+            return None
+
+    col_tipo = "TIPO NITRIF" if "TIPO NITRIF" in df_corr.columns else None
+    col_nitrif = "NITRIF" if "NITRIF" in df_corr.columns else None
+
+    # Sugerencias para lotes que no encajan
+    sugerencias_rows = []
+
+    pendientes = df_corr[df_corr["ENTRADA_SAL"].isna()].copy()
+    if "DIA" in pendientes.columns:
+        pendientes = pendientes.sort_values(["DIA", "PRODUCTO"], kind="stable")
+
+    for idx, row in pendientes.iterrows():
+        dia_recepcion    = row["DIA"]
+        unds             = int(row["UNDS"])
+        dias_sal_optimos = int(row["DIAS_SAL_OPTIMOS"])
+        prod             = row.get("PRODUCTO", None)
+        lote_id          = row.get("LOTE", idx)
+
+        dias_max_almacen = dias_max_por_producto.get(prod, dias_max_almacen_global)
+        tipo_lote = _norm_tipo(row[col_tipo]) if col_tipo else "OTRO"
+        nitr_lote = _norm_nitrif(row[col_nitrif]) if col_nitrif else None
+
+        entrada_ini = dia_recepcion if es_habil(dia_recepcion) else siguiente_habil(dia_recepcion)
+        asignado = False
+
+        for attempt in [1, 2]:
+            candidatos = []
+            entrada = entrada_ini
+            while (entrada - dia_recepcion).days <= dias_max_almacen:
+                cap_ent_dia = get_cap_ent(entrada, attempt)
+                if carga_entrada.get(entrada, 0) + unds <= cap_ent_dia:
+                    if cabe_en_estab_rango(dia_recepcion, entrada - pd.Timedelta(days=1), unds):
+                        salida = entrada + timedelta(days=dias_sal_optimos)
+                        if ajuste_finde:
+                            if salida.weekday() == 5:
+                                salida = anterior_habil(salida)
+                            elif salida.weekday() == 6:
+                                salida = siguiente_habil(salida)
+                        if ajuste_festivos and (salida.normalize() in dias_festivos):
+                            dia_semana = salida.weekday()
+                            if dia_semana == 0:
+                                salida = siguiente_habil(salida)
+                            elif dia_semana in [1, 2, 3]:
+                                anterior = anterior_habil(salida)
+                                siguiente = siguiente_habil(salida)
+                                carga_ant  = carga_salida.get(anterior, 0)
+                                carga_sig  = carga_salida.get(siguiente, 0)
+                                salida = anterior if carga_ant <= carga_sig else siguiente
+                            elif dia_semana == 4:
+                                salida = anterior_habil(salida)
+
+                        cap_sal_dia = get_cap_sal(salida, attempt)
+                        if carga_salida.get(salida, 0) + unds <= cap_sal_dia:
+                            # Candidato válido; calcular score por TIPO/NITRIF + fecha
+                            prof = entrada_profile.get(entrada, {"tipo": Counter(), "nitrif": Counter()})
+                            tipo_counts   = prof["tipo"]
+                            nitrif_counts = prof["nitrif"]
+
+                            if sum(tipo_counts.values()) == 0:
+                                cost_tipo = 0
+                            else:
+                                cost_tipo = 0 if tipo_counts.get(tipo_lote, 0) > 0 else 1
+
+                            if sum(nitrif_counts.values()) == 0:
+                                cost_nitr = 0
+                            else:
+                                cost_nitr = 0 if (nitr_lote is not None and nitrif_counts.get(nitr_lote, 0) > 0) else 1
+
+                            score = (cost_tipo, cost_nitr, entrada)
+                            candidatos.append((score, entrada, salida))
+
+                entrada = siguiente_habil(entrada)
+
+            if candidatos:
+                candidatos.sort(key=lambda t: t[0])
+                _, entrada_sel, salida_sel = candidatos[0]
+
+                df_corr.at[idx, "ENTRADA_SAL"]      = entrada_sel
+                df_corr.at[idx, "SALIDA_SAL"]       = salida_sel
+                df_corr.at[idx, "DIAS_SAL"]         = (salida_sel - entrada_sel).days
+                df_corr.at[idx, "DIAS_ALMACENADOS"] = (entrada_sel - dia_recepcion).days
+                df_corr.at[idx, "LOTE_NO_ENCAJA"]   = "No"
+
+                carga_entrada[entrada_sel] = carga_entrada.get(entrada_sel, 0) + unds
+                carga_salida[salida_sel]   = carga_salida.get(salida_sel, 0) + unds
+
+                if entrada_sel.date() > dia_recepcion.date():
+                    _sumar_en_rango(estab_stock, dia_recepcion, entrada_sel - pd.Timedelta(days=1), unds)
+
+                if entrada_sel not in entrada_profile:
+                    entrada_profile[entrada_sel] = {"tipo": Counter(), "nitrif": Counter()}
+                entrada_profile[entrada_sel]["tipo"][tipo_lote] += 1
+                if nitr_lote is not None:
+                    entrada_profile[entrada_sel]["nitrif"][nitr_lote] += 1
+
+                asignado = True
+                break
+
+        # Si no se pudo asignar → generar sugerencias (tabla detallada por combinación + texto rápido)
+        if not asignado:
+            df_corr.at[idx, "LOTE_NO_ENCAJA"] = "Sí"
+
+            sugerencias_rows_lote = []
+            entrada = entrada_ini
+
+            while (entrada - dia_recepcion).days <= dias_max_almacen:
+                if not es_habil(entrada):
+                    entrada = siguiente_habil(entrada)
+                    continue
+
+                for attempt in [1, 2]:
+                    cap_ent_dia = get_cap_ent(entrada, attempt)
+                    deficit_ent = max(0, (carga_entrada.get(entrada, 0) + unds) - cap_ent_dia)
+
+                    def_est = deficits_estab(dia_recepcion, entrada - pd.Timedelta(days=1), unds)
+                    deficit_estab_max = max(def_est.values()) if def_est else 0
+
+                    salida = entrada + timedelta(days=dias_sal_optimos)
+                    if ajuste_finde:
+                        if salida.weekday() == 5:
+                            salida = anterior_habil(salida)
+                        elif salida.weekday() == 6:
+                            salida = siguiente_habil(salida)
+                    if ajuste_festivos and (salida.normalize() in dias_festivos):
+                        dia_semana = salida.weekday()
+                        if dia_semana == 0:
+                            salida = siguiente_habil(salida)
+                        elif dia_semana in [1, 2, 3]:
+                            anterior = anterior_habil(salida)
+                            siguiente = siguiente_habil(salida)
+                            carga_ant = carga_salida.get(anterior, 0)
+                            carga_sig = carga_salida.get(siguiente, 0)
+                            salida = anterior if carga_ant <= carga_sig else siguiente
+                        elif dia_semana == 4:
+                            salida = anterior_habil(salida)
+
+                    cap_sal_dia = get_cap_sal(salida, attempt)
+                    deficit_sal = max(0, (carga_salida.get(salida, 0) + unds) - cap_sal_dia)
+
+                    # Generar texto de recomendación rápida
+                    recomendaciones = []
+                    if deficit_ent > 0:
+                        recomendaciones.append(
+                            f"Subir ENTRADA el {entrada.normalize().date()} en +{int(deficit_ent)} unds (INTENTO {attempt})."
+                        )
+                    if deficit_sal > 0:
+                        recomendaciones.append(
+                            f"Subir SALIDA el {salida.normalize().date()} en +{int(deficit_sal)} unds (INTENTO {attempt})."
+                        )
+                    if deficit_estab_max > 0:
+                        # listar solo días con déficit > 0 (máx. 3 para no saturar)
+                        dias_estab = [f"{k.date()}(+{v})" for k, v in list(def_est.items())[:3] if v > 0]
+                        if dias_estab:
+                            recomendaciones.append("Subir ESTABILIZACIÓN en: " + ", ".join(dias_estab))
+
+                    sugerencias_rows_lote.append({
+                        "LOTE": lote_id,
+                        "PRODUCTO": prod,
+                        "UNDS": unds,
+                        "DIA_RECEPCION": pd.to_datetime(dia_recepcion).normalize(),
+                        "ENTRADA_PROPUESTA": pd.to_datetime(entrada).normalize(),
+                        "SALIDA_PROPUESTA": pd.to_datetime(salida).normalize(),
+                        "INTENTO": attempt,
+                        "DEFICIT_ENTRADA": int(deficit_ent),
+                        "DEFICIT_ESTAB_MAX": int(deficit_estab_max),
+                        "DEFICIT_SALIDA": int(deficit_sal),
+                        "MAX_DEFICIT": int(max(deficit_ent, deficit_estab_max, deficit_sal)),
+                        "TOTAL_DEFICIT": int(deficit_ent + deficit_estab_max + deficit_sal),
+                        "RECOMENDACION": " | ".join(recomendaciones) if recomendaciones else "Sin ajustes necesarios"
+                    })
+
+                entrada = siguiente_habil(entrada)
+
+            if sugerencias_rows_lote:
+                sugerencias_rows_lote.sort(
+                    key=lambda r: (r["MAX_DEFICIT"], r["TOTAL_DEFICIT"], r["ENTRADA_PROPUESTA"])
+                )
+                sugerencias_rows.extend(sugerencias_rows_lote[:20])
+
+    # Métrica final
+    if "DIAS_SAL" in df_corr.columns and "DIAS_SAL_OPTIMOS" in df_corr.columns:
+        df_corr["DIFERENCIA_DIAS_SAL"] = df_corr["DIAS_SAL"] - df_corr["DIAS_SAL_OPTIMOS"]
+
+    cols_sug = [
+        "LOTE", "PRODUCTO", "UNDS", "DIA_RECEPCION",
+        "ENTRADA_PROPUESTA", "SALIDA_PROPUESTA", "INTENTO",
+        "DEFICIT_ENTRADA", "DEFICIT_ESTAB_MAX", "DEFICIT_SALIDA",
+        "MAX_DEFICIT", "TOTAL_DEFICIT","RECOMENDACION"
+    ]
+    df_sugerencias = pd.DataFrame(sugerencias_rows, columns=cols_sug) if sugerencias_rows else pd.DataFrame(columns=cols_sug)
+
+    if not df_sugerencias.empty:
+        df_sugerencias = df_sugerencias.sort_values(
+            by=["MAX_DEFICIT", "TOTAL_DEFICIT", "ENTRADA_PROPUESTA", "SALIDA_PROPUESTA", "LOTE"],
+            ascending=[True, True, True, True, True]
+        ).reset_index(drop=True)
+
+    return df_corr, df_sugerencias
@@ -0,0 +1,30 @@
+# benchmarks/sintetico.py
+# Generador de recepciones sintéticas con la forma de los Excel de Naturiber (para benchmarks).
+import numpy as np
+import pandas as pd
+
+PRODUCTOS = [
+    "JBSPRCLC-MEX", "JCIVRROD-MEX", "JBCPRCLC-MEX", "JCIVRPORCISAN", "PCIVRPORCISAN",
+    "JAMON-BLANCO", "PALETA-BLANCO", "JAMON-IBERICO", "PALETA-IBERICO",
+]
+
+def lotes_sinteticos(n, semilla=0, inicio="2025-03-03", lotes_por_dia=8, carga=1.0):
+    """
+    n lotes sin planificar repartidos desde 'inicio' a razón de ~lotes_por_dia recepciones diarias.
+    'carga' escala las unidades (1.0 ≈ temporada saturada: la mitad de los lotes no encaja).
+    """
+    rng = np.random.default_rng(semilla)
+    dia = pd.Timestamp(inicio) + pd.to_timedelta(rng.integers(0, max(1, n // lotes_por_dia), n), unit="D")
+    return pd.DataFrame({
+        "LOTE": [f"L{i:06d}" for i in range(n)],
+        "PRODUCTO": rng.choice(PRODUCTOS, n),
+        "UNDS": (rng.integers(100, 1200, n) * carga).astype(int),
+        "DIA": dia,
+        "DIAS_SAL_OPTIMOS": rng.integers(8, 20, n),
+        "TIPO NITRIF": rng.choice(["IBERICO", "BLANCO"], n),
+        "NITRIF": rng.choice([1, 2, 3], n),
+        "ENTRADA_SAL": pd.NaT,
+        "SALIDA_SAL": pd.NaT,
+        "DIAS_SAL": np.nan,
+        "DIAS_ALMACENADOS": np.nan,
+    })
@@ -0,0 +1,2990 @@
+# planificador.py
+# Motor de planificación de lotes de salazón (sin dependencias de Streamlit).
+# Lo usan la app (app.py) y el servicio HTTP (servicio.py).
+import heapq
+import os
+import re
+import multiprocessing
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import numpy as np
+import pandas as pd
+from datetime import timedelta
+from io import BytesIO
+from collections import Counter
+
+# Copy-on-write: las copias intermedias del plan comparten memoria hasta que se modifican
+# (en pandas >= 3 ya es el comportamiento por defecto).
+if int(pd.__version__.split(".")[0]) < 3:
+    pd.set_option("mode.copy_on_write", True)
+
+# -------------------------------
+# Valores por defecto (los mismos que muestra la barra lateral)
+# -------------------------------
+CAP_ENT_DEFAULT = (3100, 3500)   # (1º intento, 2º intento)
+CAP_SAL_DEFAULT = (3100, 3500)
+ESTAB_CAP_DEFAULT = 4700
+DIAS_MAX_ALMACEN_DEFAULT = 5
+DIAS_FESTIVOS_DEFAULT = [
+    "2025-01-01", "2025-04-18", "2025-05-01", "2025-08-15",
+    "2025-10-12", "2025-10-13", "2025-11-01", "2025-12-25","2025-12-24","2025-12-31","2026-01-01"
+]
+
+# -------------------------------
+# Calendario laboral
+# -------------------------------
+def festivos_set(dias_festivos) -> frozenset:
+    """Normaliza una lista de fechas festivas a un conjunto de Timestamps (búsqueda O(1))."""
+    return frozenset(pd.to_datetime(list(dias_festivos)).normalize())
+
+def es_habil(fecha, festivos):
+    # Hábil si es lunes-viernes y no es festivo (comparando por fecha normalizada)
+    return fecha.weekday() < 5 and fecha.normalize() not in festivos
+
+def siguiente_habil(fecha, festivos):
+    f = fecha + timedelta(days=1)
+    while not es_habil(f, festivos):
+        f += timedelta(days=1)
+    return f
+
+def anterior_habil(fecha, festivos):
+    f = fecha - timedelta(days=1)
+    while not es_habil(f, festivos):
+        f -= timedelta(days=1)
+    return f
+
+def _sumar_en_rango(dic, fecha_ini, fecha_fin_inclusive, unds):
+    """Suma 'unds' en dic[fecha] para todas las fechas entre ini y fin (ambas incluidas)."""
+    if pd.isna(fecha_ini) or pd.isna(fecha_fin_inclusive):
+        return
+    for d in pd.date_range(fecha_ini, fecha_fin_inclusive, freq="D"):
+        d0 = d.normalize()
+        dic[d0] = dic.get(d0, 0) + unds
+
+# -------------------------------
+# Familias de producto (tabla configurable → códigos enteros) y cargas día × familia
+# -------------------------------
+TIPOS_REGLA_FAMILIA = ("prefijo", "regex", "lista")
+FAMILIAS_PRODUCTO_DEFAULT = [
+    # Se evalúan en orden y gana la primera regla que casa; una FAMILIA puede tener varias reglas
+    {"FAMILIA": "PALETA", "TIPO": "prefijo", "PATRON": "P"},
+    {"FAMILIA": "JAMON",  "TIPO": "prefijo", "PATRON": "J"},
+]
+SIN_FAMILIA = "SIN_FAMILIA"
+METRICAS_FAMILIA = ("ENTRADA", "SALIDA", "ESTAB")
+
+def compilar_familias(productos: pd.Series, reglas=None):
+    """
+    Traduce PRODUCTO a un código entero de familia según la tabla de reglas (lista de dicts o
+    DataFrame con FAMILIA, TIPO y PATRON; TIPO "prefijo", "regex" o "lista" de códigos separados
+    por comas). Las reglas se evalúan una sola vez por producto distinto, no por lote, así que añadir
+    familias no encarece el cálculo por día.
+    Devuelve (códigos int16 por fila, -1 = sin familia; nombres de familia en orden de código).
+    """
+    if reglas is None:
+        reglas = FAMILIAS_PRODUCTO_DEFAULT
+    if isinstance(reglas, pd.DataFrame):
+        reglas = reglas.to_dict("records")
+
+    cat = pd.Categorical(productos)
+    valores = pd.Index(cat.categories.astype(str))
+    por_producto = np.full(len(valores) + 1, -1, dtype=np.int16)   # última posición: PRODUCTO vacío
+    nombres = []
+    for regla in reglas:
+        familia, tipo, patron = regla.get("FAMILIA"), regla.get("TIPO"), regla.get("PATRON")
+        if pd.isna(familia) or str(familia).strip() == "" or patron is None or (isinstance(patron, str) and not patron.strip()):
+            continue   # filas a medio rellenar del editor
+        familia = str(familia).strip()
+        if tipo == "prefijo":
+            casa = valores.str.startswith(str(patron))
+        elif tipo == "regex":
+            try:
+                casa = valores.str.contains(re.compile(str(patron)))
+            except re.error as e:
+                raise ValueError(f"Expresión regular no válida en la familia {familia}: {e}") from e
+        elif tipo == "lista":
+            codigos = patron.split(",") if isinstance(patron, str) else patron
+            casa = valores.isin([str(c).strip() for c in codigos])
+        else:
+            raise ValueError(f"Tipo de regla de familia desconocido: {tipo} (válidos: {TIPOS_REGLA_FAMILIA})")
+        if familia not in nombres:
+            nombres.append(familia)
+        libres = por_producto[:-1] < 0
+        por_producto[:-1][np.asarray(casa, dtype=bool) & libres] = nombres.index(familia)
+    return por_producto[cat.codes], nombres
+
+def _dias(serie: pd.Series) -> np.ndarray:
+    """Fechas → nº de día (int64); NaT → mínimo int64 (se filtra con isna)."""
+    return pd.to_datetime(serie, errors="coerce").to_numpy(dtype="datetime64[D]").astype(np.int64)
+
+def cargas_por_familia(df_plan: pd.DataFrame, reglas=None, metricas=METRICAS_FAMILIA) -> dict:
+    """
+    Matrices día × familia de unidades:
+      - ENTRADA: el día de ENTRADA_SAL
+      - SALIDA : el día de SALIDA_SAL
+      - ESTAB  : los días naturales [DIA, ENTRADA_SAL - 1] (entrar el mismo día no ocupa estabilización)
+    Vectorizado: cada lote suma en su celda con np.add.at y la ocupación de estabilización es la suma
+    acumulada de una matriz de diferencias, sin recorrer lotes ni días en Python.
+    Devuelve {métrica: df} con índice FECHA (todos los días del horizonte) y una columna por familia
+    más SIN_FAMILIA.
+    """
+    productos = df_plan["PRODUCTO"] if "PRODUCTO" in df_plan.columns else pd.Series(pd.NA, index=df_plan.index)
+    codigos, nombres = compilar_familias(productos, reglas)
+    columnas = nombres + [SIN_FAMILIA]
+    col = np.where(codigos < 0, len(nombres), codigos)
+    unds = pd.to_numeric(df_plan["UNDS"], errors="coerce").fillna(0).to_numpy(dtype=np.int64) if "UNDS" in df_plan.columns else np.zeros(len(df_plan), dtype=np.int64)
+
+    def _col_dias(nombre):
+        if nombre not in df_plan.columns:
+            return np.zeros(len(df_plan), dtype=np.int64), np.zeros(len(df_plan), dtype=bool)
+        return _dias(df_plan[nombre]), df_plan[nombre].notna().to_numpy()
+
+    dia, hay_dia = _col_dias("DIA")
+    ent, hay_ent = _col_dias("ENTRADA_SAL")
+    sal, hay_sal = _col_dias("SALIDA_SAL")
+    en_estab = hay_dia & hay_ent & (unds > 0) & (ent > dia)
+
+    extremos = [v for v in (dia[en_estab], ent[hay_ent], sal[hay_sal]) if len(v)]
+    if not extremos:
+        vacio = pd.DataFrame(columns=columnas, dtype=np.int64).rename_axis("FECHA")
+        return {m: vacio.copy() for m in metricas}
+    d0 = min(int(v.min()) for v in extremos)
+    n = max(int(v.max()) for v in extremos) - d0 + 1
+    fechas = pd.date_range(pd.Timestamp(np.datetime64(d0, "D")), periods=n, freq="D", name="FECHA")
+
+    out = {}
+    for m in metricas:
+        matriz = np.zeros((n + 1, len(columnas)), dtype=np.int64)
+        if m == "ESTAB":
+            np.add.at(matriz, (dia[en_estab] - d0, col[en_estab]), unds[en_estab])
+            np.add.at(matriz, (ent[en_estab] - d0, col[en_estab]), -unds[en_estab])
+            matriz = matriz.cumsum(axis=0)
+        elif m == "ENTRADA":
+            np.add.at(matriz, (ent[hay_ent] - d0, col[hay_ent]), unds[hay_ent])
+        elif m == "SALIDA":
+            np.add.at(matriz, (sal[hay_sal] - d0, col[hay_sal]), unds[hay_sal])
+        else:
+            raise ValueError(f"Métrica desconocida: {m} (válidas: {METRICAS_FAMILIA})")
+        out[m] = pd.DataFrame(matriz[:n], index=fechas, columns=columnas)
+    return out
+
+def _capacidad_estab(fechas: pd.Series, cap: int, estab_cap_overrides: dict | None = None) -> pd.Series:
+    """Capacidad efectiva de la cámara por fecha (override si existe)."""
+    caps = pd.Series(
+        {pd.Timestamp(d).normalize(): int(v) for d, v in (estab_cap_overrides or {}).items()}, dtype="float64"
+    )
+    return fechas.map(caps).fillna(int(cap)).astype(int)
+
+def calcular_estabilizacion_diaria(df_plan: pd.DataFrame, cap: int, estab_cap_overrides: dict | None = None, familias=None) -> pd.DataFrame:
+    """
+    Calcula la ocupación diaria de la cámara de estabilización.
+    Desglosa por familia de producto según 'familias' (tabla de reglas de compilar_familias;
+    por defecto Paleta = PRODUCTO empieza por 'P', Jamón = empieza por 'J'): una columna ESTAB_<FAMILIA>.
+    Un lote ocupa estabilización en los días naturales [DIA, ENTRADA_SAL - 1].
+    Permite overrides de capacidad por fecha.
+    """
+    estab = cargas_por_familia(df_plan, familias, metricas=("ESTAB",))["ESTAB"]
+    cols_familia = [f"ESTAB_{f}" for f in estab.columns if f != SIN_FAMILIA]
+    total = estab.sum(axis=1)
+    estab = estab[total > 0]
+    if estab.empty:
+        return pd.DataFrame(columns=["FECHA", "ESTAB_UNDS"] + cols_familia + ["CAPACIDAD", "UTIL_%", "EXCESO"])
+
+    df_estab = pd.DataFrame({"FECHA": estab.index, "ESTAB_UNDS": total[total > 0].to_numpy()})
+    for f, col in zip(estab.columns, cols_familia):
+        df_estab[col] = estab[f].to_numpy()
+
+    df_estab["CAPACIDAD"] = _capacidad_estab(df_estab["FECHA"], cap, estab_cap_overrides)
+    df_estab["UTIL_%"] = (df_estab["ESTAB_UNDS"] / df_estab["CAPACIDAD"] * 100).round(1)
+    df_estab["EXCESO"] = (df_estab["ESTAB_UNDS"] - df_estab["CAPACIDAD"]).clip(lower=0).astype(int)
+    return df_estab
+
+# -------------------------------
+# Esquema compacto del plan en memoria
+# -------------------------------
+COLS_CATEGORICAS = ["PRODUCTO", "TIPO NITRIF", "SITIO"]   # LOTE es casi único por fila: se queda como texto
+COLS_ENTERAS = ["UNDS", "DIAS_SAL_OPTIMOS", "DIAS_SAL", "DIAS_ALMACENADOS", "DIFERENCIA_DIAS_SAL"]
+
+def no_encaja_a_bool(s: pd.Series) -> pd.Series:
+    """Convierte LOTE_NO_ENCAJA ("Sí"/"Si"/"No", bool o vacío) a booleano nullable."""
+    if pd.api.types.is_bool_dtype(s):
+        return s.astype("boolean")
+    valnorm = (
+        s.astype("string")
+        .str.strip()
+        .str.upper()
+        .str.replace("Í", "I", regex=False)
+    )
+    out = pd.Series(pd.NA, index=s.index, dtype="boolean")
+    out[valnorm == "SI"] = True
+    out[valnorm == "NO"] = False
+    return out
+
+def no_encaja_a_texto(s: pd.Series) -> pd.Series:
+    """Booleano nullable → "Sí"/"No"/"" (solo para mostrar o exportar)."""
+    return no_encaja_a_bool(s).map({True: "Sí", False: "No"}).fillna("").astype(object)
+
+def compactar_plan(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Devuelve el plan con esquema compacto:
+      - PRODUCTO / TIPO NITRIF / SITIO como categóricas (LOTE se queda como texto)
+      - unidades y contadores de días como enteros de 32 bits (nullable si hay huecos)
+      - LOTE_NO_ENCAJA como booleano (se pasa a "Sí"/"No" solo al mostrar/exportar)
+    Con copy-on-write las columnas que ya estaban compactas no se copian.
+    """
+    out = df.copy(deep=False)
+    for col in COLS_CATEGORICAS:
+        if col in out.columns and not isinstance(out[col].dtype, pd.CategoricalDtype):
+            out[col] = out[col].astype("category")
+    for col in COLS_ENTERAS:
+        if col in out.columns and out[col].dtype not in ("int32", "Int32"):
+            num = pd.to_numeric(out[col], errors="coerce")
+            out[col] = num.astype("int32") if not num.isna().any() else num.astype("Int32")
+    if "LOTE_NO_ENCAJA" in out.columns:
+        out["LOTE_NO_ENCAJA"] = no_encaja_a_bool(out["LOTE_NO_ENCAJA"])
+    return out
+
+def preparar_para_mostrar(df: pd.DataFrame) -> pd.DataFrame:
+    """Vista para editor/exportación: categóricas a texto y LOTE_NO_ENCAJA como "Sí"/"No"."""
+    out = df.copy(deep=False)
+    for col in out.columns:
+        if isinstance(out[col].dtype, pd.CategoricalDtype):
+            out[col] = out[col].astype(object)
+    if "LOTE_NO_ENCAJA" in out.columns:
+        out["LOTE_NO_ENCAJA"] = no_encaja_a_texto(out["LOTE_NO_ENCAJA"])
+    return out
+
+# -------------------------------
+# Normalización de la entrada (Excel/CSV/JSON de lotes)
+# -------------------------------
+ALIAS_COLUMNAS = {
+    "DIAS SAL OPTIMOS": "DIAS_SAL_OPTIMOS",
+    "DIAS_SAL_OPTIMOS": "DIAS_SAL_OPTIMOS",
+    "ENTRADA SAL": "ENTRADA_SAL",
+    "SALIDA SAL": "SALIDA_SAL"
+}
+
+def _aplicar_alias(df: pd.DataFrame) -> pd.DataFrame:
+    """Alias básicos por si las columnas vienen con espacios/guiones bajos."""
+    for a, target in ALIAS_COLUMNAS.items():
+        if a in df.columns and target not in df.columns:
+            df = df.rename(columns={a: target})
+    return df
+
+def normalizar_lotes(df: pd.DataFrame) -> pd.DataFrame:
+    """Alias de columnas, fechas a datetime, UNDS a entero y esquema compacto."""
+    df = _aplicar_alias(df)
+
+    # Normaliza tipos
+    for col in ["DIA", "ENTRADA_SAL", "SALIDA_SAL"]:
+        if col in df.columns:
+            df[col] = pd.to_datetime(df[col], errors="coerce")
+        elif col != "DIA":
+            df[col] = pd.Series(pd.NaT, index=df.index, dtype="datetime64[ns]")
+    if "UNDS" in df.columns:
+        df["UNDS"] = pd.to_numeric(df["UNDS"], errors="coerce").fillna(0).astype("int32")
+    return compactar_plan(df)
+
+# -------------------------------
+# Validación de la entrada (cuarentena de filas inválidas)
+# -------------------------------
+COLUMNAS_OBLIGATORIAS = ["DIA", "UNDS", "DIAS_SAL_OPTIMOS"]
+MAX_DIAS_SAL_OPTIMOS = 365
+COLUMNAS_RECHAZO = ["FILA", "MOTIVO"]
+
+def _vacio(s: pd.Series) -> pd.Series:
+    """Celda vacía: NA o texto en blanco."""
+    if not (pd.api.types.is_object_dtype(s) or pd.api.types.is_string_dtype(s)):
+        return s.isna()
+    return s.isna() | s.astype("string").str.strip().eq("").fillna(False)
+
+def validar_lotes(df: pd.DataFrame, rechazar_duplicados: bool = True):
+    """
+    Validación vectorizada de lotes recibidos, antes de normalizar y planificar (una pasada por
+    columna, sin recorrer filas):
+      - columnas obligatorias (COLUMNAS_OBLIGATORIAS); si falta alguna se lanza ValueError
+      - DIA fecha válida; ENTRADA_SAL/SALIDA_SAL, si vienen, fechas válidas y en orden DIA ≤ ENTRADA ≤ SALIDA
+      - UNDS entero > 0; DIAS_SAL_OPTIMOS entero en [0, MAX_DIAS_SAL_OPTIMOS]
+      - LOTE repetido (si rechazar_duplicados): se queda la primera aparición válida
+    Devuelve (df_validos, df_rechazados): df_validos normalizado (normalizar_lotes) y con el índice
+    de la fila original; df_rechazados con FILA (fila de Excel), MOTIVO y los datos tal como llegaron.
+    """
+    df = _aplicar_alias(df).reset_index(drop=True)
+    faltan = [c for c in COLUMNAS_OBLIGATORIAS if c not in df.columns]
+    if faltan:
+        raise ValueError(f"Faltan columnas obligatorias: {', '.join(faltan)}")
+
+    motivos = []   # (máscara, texto)
+
+    def _fecha(col, obligatoria):
+        vacio = _vacio(df[col])
+        fecha = pd.to_datetime(df[col].where(~vacio), errors="coerce")
+        if obligatoria:
+            motivos.append((vacio, f"{col} vacío"))
+        motivos.append((~vacio & fecha.isna(), f"{col} no es una fecha"))
+        return fecha.dt.normalize()
+
+    def _entero(col, minimo, maximo=None):
+        vacio = _vacio(df[col])
+        num = pd.to_numeric(df[col].where(~vacio), errors="coerce")
+        motivos.append((vacio, f"{col} vacío"))
+        motivos.append((~vacio & num.isna(), f"{col} no es numérico"))
+        motivos.append((num.notna() & (num % 1 != 0), f"{col} no es entero"))
+        fuera = num < minimo if maximo is None else (num < minimo) | (num > maximo)
+        rango = f"≥ {minimo}" if maximo is None else f"entre {minimo} y {maximo}"
+        motivos.append((fuera.fillna(False), f"{col} debe ser {rango}"))
+
+    dia = _fecha("DIA", obligatoria=True)
+    _entero("UNDS", 1)
+    _entero("DIAS_SAL_OPTIMOS", 0, MAX_DIAS_SAL_OPTIMOS)
+    entrada = _fecha("ENTRADA_SAL", obligatoria=False) if "ENTRADA_SAL" in df.columns else None
+    salida = _fecha("SALIDA_SAL", obligatoria=False) if "SALIDA_SAL" in df.columns else None
+    if entrada is not None:
+        motivos.append(((entrada < dia).fillna(False), "ENTRADA_SAL anterior a DIA"))
+        if salida is not None:
+            motivos.append(((salida < entrada).fillna(False), "SALIDA_SAL anterior a ENTRADA_SAL"))
+
+    rechazada = np.zeros(len(df), dtype=bool)
+    for mascara, _ in motivos:
+        rechazada |= mascara.to_numpy(dtype=bool)
+    if rechazar_duplicados and "LOTE" in df.columns:
+        clave = df["LOTE"].astype("string").str.strip()
+        con_clave = (clave.notna() & (clave != "")).to_numpy(dtype=bool)
+        repetido = np.zeros(len(df), dtype=bool)
+        validas = con_clave & ~rechazada
+        repetido[validas] = clave[validas].duplicated(keep="first").to_numpy()
+        motivos.append((pd.Series(repetido), "LOTE repetido"))
+        rechazada |= repetido
+
+    texto = pd.Series("", index=df.index, dtype=object)
+    for mascara, motivo in motivos:
+        texto = texto + np.where(mascara.to_numpy(dtype=bool), motivo + "; ", "")
+    rechazados = df[rechazada].copy()
+    rechazados.insert(0, "MOTIVO", texto[rechazada].str.rstrip("; "))
+    rechazados.insert(0, "FILA", rechazados.index + 2)   # +2: cabecera y base 1 de Excel
+    return normalizar_lotes(df[~rechazada]), rechazados.reset_index(drop=True)
+
+# -------------------------------
+# Ingesta de varios ficheros de recepciones (fusión indexada por LOTE)
+# -------------------------------
+CONFLICTO_RECIENTE = "reciente"        # gana la fila del fichero posterior (y, dentro de él, la última)
+CONFLICTO_PLANIFICADA = "planificada"  # gana la fila que ya trae ENTRADA_SAL; entre iguales, la más reciente
+REGLAS_CONFLICTO = {
+    "Gana el más reciente": CONFLICTO_RECIENTE,
+    "Conservar la fila planificada": CONFLICTO_PLANIFICADA,
+}
+UMBRAL_LECTURA_PARALELA = 2_000_000   # bytes totales a partir de los que compensa arrancar procesos
+
+def leer_excel_lotes(contenido: bytes):
+    """
+    Lee un Excel de lotes a partir de sus bytes, lo valida y normaliza (se puede ejecutar en otro
+    proceso). Devuelve (df_validos, df_rechazados) como validar_lotes; los LOTE repetidos no se
+    rechazan aquí, los resuelve fusionar_lotes con la regla de conflicto.
+    """
+    return validar_lotes(pd.read_excel(BytesIO(contenido), engine="openpyxl"), rechazar_duplicados=False)
+
+def leer_lotes_concurrente(contenidos, procesos=None) -> list:
+    """
+    Lee varios Excel de lotes a la vez, un proceso por fichero (openpyxl no suelta el GIL, así que
+    los hilos no ayudan). Con un solo fichero, una sola CPU o poco volumen (arrancar un proceso
+    cuesta más que leer un Excel pequeño) se leen en línea.
+    Devuelve los pares (df_validos, df_rechazados) en el mismo orden que 'contenidos'.
+    """
+    contenidos = list(contenidos)
+    if procesos is None:
+        procesos = os.cpu_count() or 1
+    procesos = min(procesos, len(contenidos))
+    if procesos <= 1 or sum(len(c) for c in contenidos) < UMBRAL_LECTURA_PARALELA:
+        return [leer_excel_lotes(c) for c in contenidos]
+    with ProcessPoolExecutor(max_workers=procesos, mp_context=multiprocessing.get_context("spawn")) as ejecutor:
+        return list(ejecutor.map(leer_excel_lotes, contenidos))
+
+def fusionar_lotes(tablas, nombres=None, regla=CONFLICTO_RECIENTE):
+    """
+    Une las tablas de varios ficheros (en orden de subida) en un único plan de entrada, con una fila
+    por LOTE. La clave es LOTE como texto sin espacios y los duplicados se resuelven con un índice hash
+    (duplicated/drop_duplicates), sin comparar filas dos a dos:
+      - CONFLICTO_RECIENTE: gana la aparición más reciente (último fichero; dentro de él, última fila)
+      - CONFLICTO_PLANIFICADA: gana la fila con ENTRADA_SAL ya fijada; si hay varias o ninguna, la más reciente
+    Las filas sin LOTE no se fusionan: se conservan todas.
+    Devuelve (df_fusionado, df_duplicados); df_duplicados tiene una fila por aparición de cada LOTE
+    repetido: LOTE, ARCHIVO, FILA (fila de Excel), ACCION ("Conservada"/"Descartada") y
+    DIFERENTE (si sus datos difieren de la fila conservada).
+    """
+    if regla not in (CONFLICTO_RECIENTE, CONFLICTO_PLANIFICADA):
+        raise ValueError(f"Regla de conflicto desconocida: {regla}")
+    tablas = list(tablas)
+    nombres = list(nombres) if nombres is not None else [f"Fichero {i + 1}" for i in range(len(tablas))]
+    columnas_duplicados = ["LOTE", "ARCHIVO", "FILA", "ACCION", "DIFERENTE"]
+    if not tablas:
+        return pd.DataFrame(), pd.DataFrame(columns=columnas_duplicados)
+
+    partes = []
+    for i, t in enumerate(tablas):
+        # FILA de Excel a partir del índice original (validar_lotes lo conserva al apartar filas)
+        posiciones = t.index.to_numpy() if pd.api.types.is_integer_dtype(t.index) else np.arange(len(t))
+        filas_excel = posiciones + 2   # +2: cabecera y base 1 de Excel
+        t = preparar_para_mostrar(t).reset_index(drop=True)
+        partes.append(t.assign(_ARCHIVO=i, _FILA=filas_excel))
+    todo = pd.concat(partes, ignore_index=True)
+    datos = [c for c in todo.columns if c not in ("_ARCHIVO", "_FILA")]
+
+    if "LOTE" not in todo.columns:
+        return normalizar_lotes(todo[datos]), pd.DataFrame(columns=columnas_duplicados)
+
+    clave = todo["LOTE"].astype("string").str.strip()
+    con_clave = clave.notna() & (clave != "")
+    repetida = con_clave & clave.duplicated(keep=False)
+
+    # Prioridad de cada fila dentro de su clave: la posición en la concatenación es su antigüedad
+    prioridad = pd.DataFrame({"CLAVE": clave, "POS": np.arange(len(todo))})
+    if regla == CONFLICTO_PLANIFICADA and "ENTRADA_SAL" in todo.columns:
+        prioridad["PLANIFICADA"] = todo["ENTRADA_SAL"].notna()
+        prioridad = prioridad.sort_values(["PLANIFICADA", "POS"], kind="stable")
+    ganadoras = prioridad[con_clave.loc[prioridad.index]].drop_duplicates("CLAVE", keep="last")
+    conservar = ~con_clave
+    conservar.loc[ganadoras.index] = True
+
+    fusionado = todo.loc[conservar.to_numpy(), datos].reset_index(drop=True)
+    fusionado = normalizar_lotes(fusionado)
+
+    # Informe de duplicados: cada aparición frente a la fila conservada de su LOTE
+    rep = todo[repetida]
+    pos_ganadora = clave[repetida].map(pd.Series(ganadoras.index, index=ganadoras["CLAVE"]))
+    ganadora = todo.loc[pos_ganadora.to_numpy(), datos].reset_index(drop=True)
+    duplicados = pd.DataFrame({
+        "LOTE": clave[repetida].to_numpy(dtype=object),
+        "ARCHIVO": [nombres[i] for i in rep["_ARCHIVO"]],
+        "FILA": rep["_FILA"].to_numpy(),
+        "ACCION": np.where(conservar[repetida].to_numpy(), "Conservada", "Descartada"),
+        "DIFERENTE": ~_iguales_por_fila(rep[datos].reset_index(drop=True), ganadora),
+    }).sort_values("LOTE", kind="stable").reset_index(drop=True)
+    return fusionado, duplicados
+
+# -------------------------------
+# Libro de cargas (ledger) + capacidades por fecha + calendario
+# -------------------------------
+class LibroCargas:
+    """
+    Estado de capacidad que usa el planificador:
+      - cargas comprometidas por día: carga_entrada, carga_salida, estab_stock
+      - capacidades por día/intento (valor global + overrides por FECHA)
+      - calendario laboral (festivos y ajustes de fin de semana/festivo de la SALIDA)
+    Se construye una vez por planificación; el servicio HTTP lo mantiene vivo entre peticiones.
+    """
+
+    def __init__(
+        self,
+        cap_ent=CAP_ENT_DEFAULT,
+        cap_sal=CAP_SAL_DEFAULT,
+        estab_cap=ESTAB_CAP_DEFAULT,
+        cap_overrides_ent=None,
+        cap_overrides_sal=None,
+        estab_cap_overrides=None,
+        dias_festivos=DIAS_FESTIVOS_DEFAULT,
+        ajuste_finde=True,
+        ajuste_festivos=True,
+    ):
+        self.cap_ent = tuple(cap_ent)
+        self.cap_sal = tuple(cap_sal)
+        self.estab_cap = estab_cap
+        self.cap_overrides_ent = cap_overrides_ent or {}
+        self.cap_overrides_sal = cap_overrides_sal or {}
+        self.estab_cap_overrides = estab_cap_overrides or {}
+        self.festivos = festivos_set(dias_festivos)
+        self.ajuste_finde = ajuste_finde
+        self.ajuste_festivos = ajuste_festivos
+        self.carga_entrada = {}
+        self.carga_salida = {}
+        self.estab_stock = {}
+
+    def copia(self):
+        """Copia con cargas independientes (capacidades y calendario se comparten)."""
+        nuevo = object.__new__(LibroCargas)
+        nuevo.__dict__.update(self.__dict__)
+        nuevo.carga_entrada = dict(self.carga_entrada)
+        nuevo.carga_salida = dict(self.carga_salida)
+        nuevo.estab_stock = dict(self.estab_stock)
+        return nuevo
+
+    def cargar_plan(self, df_plan: pd.DataFrame):
+        """Suma al libro las cargas de las filas ya planificadas (con ENTRADA_SAL/SALIDA_SAL)."""
+        for fecha, unds in df_plan.dropna(subset=["ENTRADA_SAL"]).groupby("ENTRADA_SAL")["UNDS"].sum().items():
+            self.carga_entrada[fecha] = self.carga_entrada.get(fecha, 0) + unds
+        for fecha, unds in df_plan.dropna(subset=["SALIDA_SAL"]).groupby("SALIDA_SAL")["UNDS"].sum().items():
+            self.carga_salida[fecha] = self.carga_salida.get(fecha, 0) + unds
+
+        # Ocupación diaria ya existente en estabilización (por filas ya planificadas)
+        for _, r in df_plan.dropna(subset=["ENTRADA_SAL"]).iterrows():
+            dia_rec = r["DIA"]
+            ent     = r["ENTRADA_SAL"]
+            unds    = r["UNDS"]
+            if pd.notna(dia_rec) and pd.notna(ent) and ent.date() > dia_rec.date():
+                _sumar_en_rango(self.estab_stock, dia_rec, ent - pd.Timedelta(days=1), unds)
+        return self
+
+    # ---- Calendario ----
+    def es_habil(self, fecha):
+        return es_habil(fecha, self.festivos)
+
+    def siguiente_habil(self, fecha):
+        return siguiente_habil(fecha, self.festivos)
+
+    def anterior_habil(self, fecha):
+        return anterior_habil(fecha, self.festivos)
+
+    def salida_ajustada(self, entrada, dias_sal_optimos, extra_salida=None):
+        """
+        SALIDA = ENTRADA + DIAS_SAL_OPTIMOS, ajustada por fin de semana y festivos.
+        Festivo de martes a jueves: se elige el hábil anterior o siguiente con menos carga de salida
+        (sumando 'extra_salida', cargas aún no registradas en el libro).
+        """
+        salida = entrada + timedelta(days=int(dias_sal_optimos))
+        if self.ajuste_finde:
+            if salida.weekday() == 5:
+                salida = self.anterior_habil(salida)
+            elif salida.weekday() == 6:
+                salida = self.siguiente_habil(salida)
+        if self.ajuste_festivos and (salida.normalize() in self.festivos):
+            dia_semana = salida.weekday()
+            if dia_semana == 0:
+                salida = self.siguiente_habil(salida)
+            elif dia_semana in [1, 2, 3]:
+                anterior = self.anterior_habil(salida)
+                siguiente = self.siguiente_habil(salida)
+                carga_ant = self.carga_salida.get(anterior, 0)
+                carga_sig = self.carga_salida.get(siguiente, 0)
+                if extra_salida:
+                    carga_ant += extra_salida.get(anterior, 0)
+                    carga_sig += extra_salida.get(siguiente, 0)
+                salida = anterior if carga_ant <= carga_sig else siguiente
+            elif dia_semana == 4:
+                salida = self.anterior_habil(salida)
+        return salida
+
+    # ---- Capacidades por día/intento ----
+    def get_cap_ent(self, date_dt, attempt):
+        dkey = pd.to_datetime(date_dt).normalize()
+        ov = self.cap_overrides_ent.get(dkey)
+        if ov is not None:
+            if attempt == 1 and pd.notna(ov.get("CAP1")):
+                return int(ov["CAP1"])
+            if attempt == 2 and pd.notna(ov.get("CAP2")):
+                return int(ov["CAP2"])
+        return self.cap_ent[0] if attempt == 1 else self.cap_ent[1]
+
+    def get_cap_sal(self, date_dt, attempt):
+        dkey = pd.to_datetime(date_dt).normalize()
+        ov = self.cap_overrides_sal.get(dkey)
+        if ov is not None:
+            if attempt == 1 and pd.notna(ov.get("CAP1")):
+                return int(ov["CAP1"])
+            if attempt == 2 and pd.notna(ov.get("CAP2")):
+                return int(ov["CAP2"])
+        return self.cap_sal[0] if attempt == 1 else self.cap_sal[1]
+
+    # Capacidad de estabilización por día (override si existe)
+    def get_estab_cap(self, date_dt):
+        dkey = pd.to_datetime(date_dt).normalize()
+        ov = self.estab_cap_overrides.get(dkey)
+        return ov if (ov is not None and pd.notna(ov)) else self.estab_cap
+
+    # Chequeo de capacidad de estabilización en rango [ini, fin]
+    def cabe_en_estab_rango(self, fecha_ini, fecha_fin_inclusive, unds):
+        if pd.isna(fecha_ini) or pd.isna(fecha_fin_inclusive):
+            return True
+        if fecha_fin_inclusive < fecha_ini:
+            return True
+        for d in pd.date_range(fecha_ini, fecha_fin_inclusive, freq="D"):
+            d0 = d.normalize()
+            if self.estab_stock.get(d0, 0) + unds > self.get_estab_cap(d0):
+                return False
+        return True
+
+    # Devuelve déficits de estabilización por día (dict fecha->faltan_unds) para un rango
+    def deficits_estab(self, fecha_ini, fecha_fin_inclusive, unds):
+        deficits = {}
+        if pd.isna(fecha_ini) or pd.isna(fecha_fin_inclusive):
+            return deficits
+        if fecha_fin_inclusive < fecha_ini:
+            return deficits
+        for d in pd.date_range(fecha_ini, fecha_fin_inclusive, freq="D"):
+            d0 = d.normalize()
+            falta = (self.estab_stock.get(d0, 0) + unds) - self.get_estab_cap(d0)
+            if falta > 0:
+                deficits[d0] = int(falta)
+        return deficits
+
+    # ---- Movimientos ----
+    def registrar(self, dia_recepcion, entrada, salida, unds):
+        """Compromete en el libro la ENTRADA, la SALIDA y los días de estabilización de un lote."""
+        self.carga_entrada[entrada] = self.carga_entrada.get(entrada, 0) + unds
+        self.carga_salida[salida] = self.carga_salida.get(salida, 0) + unds
+        if entrada.date() > dia_recepcion.date():
+            _sumar_en_rango(self.estab_stock, dia_recepcion, entrada - pd.Timedelta(days=1), unds)
+
+    def retirar(self, dia_recepcion, entrada, salida, unds):
+        """Operación inversa de registrar (libera la capacidad de un lote ya planificado)."""
+        if pd.notna(entrada):
+            self.carga_entrada[entrada] = self.carga_entrada.get(entrada, 0) - unds
+            if pd.notna(dia_recepcion) and entrada.date() > dia_recepcion.date():
+                _sumar_en_rango(self.estab_stock, dia_recepcion, entrada - pd.Timedelta(days=1), -unds)
+        if pd.notna(salida):
+            self.carga_salida[salida] = self.carga_salida.get(salida, 0) - unds
+
+    # ---- Consultas ----
+    def capacidades_diarias(self, fechas) -> dict:
+        """Capacidad por día de cada recurso e intento: {ENTRADA_CAP1, ..., ESTAB_CAP: array int64}."""
+        return {
+            "ENTRADA_CAP1": np.array([self.get_cap_ent(d, 1) for d in fechas], dtype=np.int64),
+            "ENTRADA_CAP2": np.array([self.get_cap_ent(d, 2) for d in fechas], dtype=np.int64),
+            "SALIDA_CAP1": np.array([self.get_cap_sal(d, 1) for d in fechas], dtype=np.int64),
+            "SALIDA_CAP2": np.array([self.get_cap_sal(d, 2) for d in fechas], dtype=np.int64),
+            "ESTAB_CAP": np.array([int(self.get_estab_cap(d)) for d in fechas], dtype=np.int64),
+        }
+
+    def ocupacion(self, desde, hasta) -> pd.DataFrame:
+        """Carga, capacidad y holgura por día en [desde, hasta] para ENTRADA, SALIDA y ESTABILIZACIÓN."""
+        fechas = pd.date_range(pd.Timestamp(desde).normalize(), pd.Timestamp(hasta).normalize(), freq="D")
+        ent = pd.Series(self.carga_entrada, dtype="float64")
+        sal = pd.Series(self.carga_salida, dtype="float64")
+        if not ent.empty:
+            ent = ent.groupby(pd.to_datetime(ent.index).normalize()).sum()
+        if not sal.empty:
+            sal = sal.groupby(pd.to_datetime(sal.index).normalize()).sum()
+        est = pd.Series(self.estab_stock, dtype="float64")
+        df = pd.DataFrame({"FECHA": fechas})
+        caps = self.capacidades_diarias(fechas)
+        df["ENTRADA_UNDS"] = ent.reindex(fechas, fill_value=0).to_numpy().astype(int)
+        df["ENTRADA_CAP1"] = caps["ENTRADA_CAP1"]
+        df["ENTRADA_CAP2"] = caps["ENTRADA_CAP2"]
+        df["SALIDA_UNDS"] = sal.reindex(fechas, fill_value=0).to_numpy().astype(int)
+        df["SALIDA_CAP1"] = caps["SALIDA_CAP1"]
+        df["SALIDA_CAP2"] = caps["SALIDA_CAP2"]
+        df["ESTAB_UNDS"] = est.reindex(fechas, fill_value=0).to_numpy().astype(int)
+        df["ESTAB_CAP"] = caps["ESTAB_CAP"]
+        df["HOLGURA_ENTRADA_1"] = df["ENTRADA_CAP1"] - df["ENTRADA_UNDS"]
+        df["HOLGURA_ENTRADA_2"] = df["ENTRADA_CAP2"] - df["ENTRADA_UNDS"]
+        df["HOLGURA_SALIDA_1"] = df["SALIDA_CAP1"] - df["SALIDA_UNDS"]
+        df["HOLGURA_SALIDA_2"] = df["SALIDA_CAP2"] - df["SALIDA_UNDS"]
+        df["HOLGURA_ESTAB"] = df["ESTAB_CAP"] - df["ESTAB_UNDS"]
+        return df
+
+# -------------------------------
+# Cubo diario de cargas (exportación para análisis)
+# -------------------------------
+FAMILIA_TOTAL = "TOTAL"
+
+def cubo_cargas(df_plan: pd.DataFrame, libro: "LibroCargas", familias=None) -> pd.DataFrame:
+    """
+    Cubo diario de cargas en formato largo: FECHA × METRICA (ENTRADA, SALIDA, ESTAB) × FAMILIA
+    (las de 'familias', SIN_FAMILIA y TOTAL), con la capacidad de cada intento (CAP1/CAP2; en ESTAB
+    las dos son la de la cámara), la utilización sobre cada una (UTIL1_%/UTIL2_%) y el exceso.
+    En las filas de familia UTIL es su parte de la capacidad (suman la del TOTAL) y EXCESO va vacío:
+    el exceso solo tiene sentido sobre el total del día.
+    Sale directamente de las matrices día × familia (cargas_por_familia) y de las capacidades del
+    libro, sin reagregar las filas de lotes; columnas compactas (categóricas, int32, float32).
+    """
+    matrices = cargas_por_familia(df_plan, familias)
+    fechas = matrices["ESTAB"].index
+    familias_cubo = list(matrices["ESTAB"].columns) + [FAMILIA_TOTAL]
+    n_dias, n_fam = len(fechas), len(familias_cubo)
+    caps = libro.capacidades_diarias(fechas)
+    cap_metrica = {
+        "ENTRADA": (caps["ENTRADA_CAP1"], caps["ENTRADA_CAP2"]),
+        "SALIDA": (caps["SALIDA_CAP1"], caps["SALIDA_CAP2"]),
+        "ESTAB": (caps["ESTAB_CAP"], caps["ESTAB_CAP"]),
+    }
+
+    # (métrica, día, familia): la última familia es el TOTAL del día
+    unds = np.stack([
+        np.column_stack([matrices[m].to_numpy(), matrices[m].to_numpy().sum(axis=1)]) if n_dias
+        else np.zeros((0, n_fam), dtype=np.int64)
+        for m in METRICAS_FAMILIA
+    ]).reshape(-1)
+    cap1 = np.repeat(np.stack([cap_metrica[m][0] for m in METRICAS_FAMILIA]).reshape(-1), n_fam)
+    cap2 = np.repeat(np.stack([cap_metrica[m][1] for m in METRICAS_FAMILIA]).reshape(-1), n_fam)
+    es_total = np.tile(np.arange(n_fam) == n_fam - 1, len(METRICAS_FAMILIA) * n_dias)
+
+    def _util(cap):
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return np.where(cap > 0, np.round(unds / np.where(cap > 0, cap, 1) * 100, 1), np.nan).astype(np.float32)
+
+    def _exceso(cap):
+        return pd.arrays.IntegerArray(np.maximum(unds - cap, 0).astype(np.int32), mask=~es_total)
+
+    return pd.DataFrame({
+        "FECHA": np.tile(np.repeat(fechas.to_numpy(), n_fam), len(METRICAS_FAMILIA)),
+        "METRICA": pd.Categorical(np.repeat(METRICAS_FAMILIA, n_dias * n_fam), categories=METRICAS_FAMILIA),
+        "FAMILIA": pd.Categorical(np.tile(familias_cubo, len(METRICAS_FAMILIA) * n_dias), categories=familias_cubo),
+        "UNDS": unds.astype(np.int32),
+        "CAP1": cap1.astype(np.int32),
+        "CAP2": cap2.astype(np.int32),
+        "UTIL1_%": _util(cap1),
+        "UTIL2_%": _util(cap2),
+        "EXCESO1": _exceso(cap1),
+        "EXCESO2": _exceso(cap2),
+    })
+
+def cubo_a_bytes(cubo: pd.DataFrame, formato: str = "parquet") -> bytes:
+    """Serializa el cubo: "parquet" (columnar comprimido, conserva tipos) o "csv" (fechas AAAA-MM-DD)."""
+    if formato == "parquet":
+        buf = BytesIO()
+        cubo.to_parquet(buf, index=False, compression="zstd")
+        return buf.getvalue()
+    if formato == "csv":
+        return cubo.to_csv(index=False, date_format="%Y-%m-%d", float_format="%.1f").encode("utf-8")
+    raise ValueError(f"Formato de cubo desconocido: {formato} (válidos: parquet, csv)")
+
+# -------------------------------
+# Pirámide de ocupación (día → semana → mes)
+# -------------------------------
+RESOLUCIONES = {"Día": "D", "Semana": "W", "Mes": "M"}
+_METRICAS_OCUPACION = {
+    # métrica: (columna de carga, columna de capacidad límite)
+    "ENTRADA": ("ENTRADA_UNDS", "ENTRADA_CAP2"),
+    "SALIDA": ("SALIDA_UNDS", "SALIDA_CAP2"),
+    "ESTAB": ("ESTAB_UNDS", "ESTAB_CAP"),
+}
+
+def piramide_ocupacion(df_diario: pd.DataFrame) -> dict:
+    """
+    Agrega la ocupación diaria (salida de LibroCargas.ocupacion) a semanas y meses.
+    Por cada métrica (ENTRADA, SALIDA, ESTAB) y periodo: _PICO (máximo diario), _MEDIA y
+    _DIAS_EXCESO (días con carga por encima de la capacidad; 2º intento en ENTRADA/SALIDA).
+    Devuelve {"D": df, "W": df, "M": df} con FECHA = inicio del periodo y DIAS = días cubiertos.
+    """
+    base = pd.DataFrame({"FECHA": pd.to_datetime(df_diario["FECHA"])})
+    for met, (col_unds, col_cap) in _METRICAS_OCUPACION.items():
+        base[f"{met}_UNDS"] = df_diario[col_unds].to_numpy()
+        base[f"{met}_CAP"] = df_diario[col_cap].to_numpy()
+        base[f"{met}_EXCESO"] = (df_diario[col_unds] > df_diario[col_cap]).to_numpy().astype("int32")
+
+    niveles = {}
+    dia = pd.DataFrame({"FECHA": base["FECHA"], "DIAS": 1})
+    for met in _METRICAS_OCUPACION:
+        dia[f"{met}_PICO"] = base[f"{met}_UNDS"]
+        dia[f"{met}_MEDIA"] = base[f"{met}_UNDS"].astype(float)
+        dia[f"{met}_CAP"] = base[f"{met}_CAP"]
+        dia[f"{met}_DIAS_EXCESO"] = base[f"{met}_EXCESO"]
+    niveles["D"] = dia
+
+    for clave, periodo in (("W", "W"), ("M", "M")):
+        inicio = base["FECHA"].dt.to_period(periodo).dt.start_time
+        g = base.groupby(inicio, sort=True)
+        agg = pd.DataFrame({"DIAS": g.size()})
+        for met in _METRICAS_OCUPACION:
+            agg[f"{met}_PICO"] = g[f"{met}_UNDS"].max()
+            agg[f"{met}_MEDIA"] = g[f"{met}_UNDS"].mean().round(1)
+            agg[f"{met}_CAP"] = g[f"{met}_CAP"].min()
+            agg[f"{met}_DIAS_EXCESO"] = g[f"{met}_EXCESO"].sum().astype("int32")
+        niveles[clave] = agg.rename_axis("FECHA").reset_index()
+    return niveles
+
+def resolucion_automatica(n_dias: int, max_puntos: int = 120) -> str:
+    """Resolución más fina que no supera 'max_puntos' barras para el horizonte dado."""
+    if n_dias <= max_puntos:
+        return "D"
+    if n_dias / 7 <= max_puntos:
+        return "W"
+    return "M"
+
+# -------------------------------
+# Línea de holgura por día (consultas para la planificación manual)
+# -------------------------------
+class _ArbolMinimos:
+    """Árbol de segmentos sobre una lista de valores: suma en un rango y mínimo de un rango en O(log n)."""
+
+    def __init__(self, valores):
+        self.n = len(valores)
+        self.minimo = [0] * (4 * max(self.n, 1))
+        self.pendiente = [0] * (4 * max(self.n, 1))   # suma aplicada a todo el nodo, sin propagar
+        if self.n:
+            self._construir(1, 0, self.n - 1, valores)
+
+    def _construir(self, nodo, i, j, valores):
+        if i == j:
+            self.minimo[nodo] = valores[i]
+            return
+        m = (i + j) // 2
+        self._construir(2 * nodo, i, m, valores)
+        self._construir(2 * nodo + 1, m + 1, j, valores)
+        self.minimo[nodo] = min(self.minimo[2 * nodo], self.minimo[2 * nodo + 1])
+
+    def sumar(self, ini, fin, valor, nodo=1, i=0, j=None):
+        if j is None:
+            j = self.n - 1
+        if fin < i or j < ini or ini > fin:
+            return
+        if ini <= i and j <= fin:
+            self.minimo[nodo] += valor
+            self.pendiente[nodo] += valor
+            return
+        m = (i + j) // 2
+        self.sumar(ini, fin, valor, 2 * nodo, i, m)
+        self.sumar(ini, fin, valor, 2 * nodo + 1, m + 1, j)
+        self.minimo[nodo] = min(self.minimo[2 * nodo], self.minimo[2 * nodo + 1]) + self.pendiente[nodo]
+
+    def minimo_en(self, ini, fin, nodo=1, i=0, j=None):
+        if j is None:
+            j = self.n - 1
+        if fin < i or j < ini or ini > fin:
+            return float("inf")
+        if ini <= i and j <= fin:
+            return self.minimo[nodo]
+        m = (i + j) // 2
+        return min(
+            self.minimo_en(ini, fin, 2 * nodo, i, m),
+            self.minimo_en(ini, fin, 2 * nodo + 1, m + 1, j),
+        ) + self.pendiente[nodo]
+
+_COLUMNAS_HOLGURA = ("LOTE", "DIA", "ENTRADA_SAL", "SALIDA_SAL", "UNDS")
+
+class LineaHolgura:
+    """
+    Holgura por día (capacidad restante) de ENTRADA y SALIDA por intento y de ESTABILIZACIÓN
+    para un plan, precalculada sobre un horizonte de días:
+      - ENTRADA/SALIDA: listas por día (consulta O(1))
+      - ESTABILIZACIÓN: árbol de segmentos con suma y mínimo en rango (consulta y actualización O(log H))
+    Se mantiene de forma incremental: sincronizar(df) aplica solo las filas que cambian respecto
+    al último plan sincronizado. 'libro' aporta capacidades y calendario (sus cargas se ignoran).
+    """
+
+    MARGEN_DIAS = 60   # días extra a cada lado del plan al construir el horizonte
+
+    def __init__(self, libro: LibroCargas, df_plan: pd.DataFrame):
+        self.libro = libro.copia()
+        self._recargar(df_plan)
+
+    # ---- Construcción ----
+    def _recargar(self, df_plan):
+        self.libro.carga_entrada, self.libro.carga_salida, self.libro.estab_stock = {}, {}, {}
+        self.libro.cargar_plan(df_plan)
+        self.plan = df_plan
+        fechas = pd.concat([df_plan[c] for c in _COLUMNAS_HOLGURA[1:4] if c in df_plan.columns]).dropna()
+        hoy = pd.Timestamp.today().normalize()
+        desde = fechas.min().normalize() if not fechas.empty else hoy
+        hasta = fechas.max().normalize() if not fechas.empty else hoy
+        self._construir(desde - pd.Timedelta(days=self.MARGEN_DIAS), hasta + pd.Timedelta(days=self.MARGEN_DIAS))
+
+    def _construir(self, desde, hasta):
+        ocup = self.libro.ocupacion(desde, hasta)
+        self.desde, self.hasta = desde, hasta
+        self.ent = {1: ocup["HOLGURA_ENTRADA_1"].tolist(), 2: ocup["HOLGURA_ENTRADA_2"].tolist()}
+        self.sal = {1: ocup["HOLGURA_SALIDA_1"].tolist(), 2: ocup["HOLGURA_SALIDA_2"].tolist()}
+        self.estab = _ArbolMinimos(ocup["HOLGURA_ESTAB"].tolist())
+
+    def _indice(self, fecha):
+        return (pd.Timestamp(fecha).normalize() - self.desde).days
+
+    def _cubrir(self, *fechas):
+        """Amplía el horizonte (reconstruyendo desde el libro) si alguna fecha queda fuera."""
+        fechas = [pd.Timestamp(f).normalize() for f in fechas if pd.notna(f)]
+        if not fechas or (min(fechas) >= self.desde and max(fechas) <= self.hasta):
+            return
+        margen = pd.Timedelta(days=self.MARGEN_DIAS)
+        self._construir(min(min(fechas) - margen, self.desde), max(max(fechas) + margen, self.hasta))
+
+    # ---- Actualización incremental ----
+    def _aplicar(self, dia_recepcion, entrada, salida, unds, signo):
+        """Suma (signo=+1) o retira (signo=-1) las cargas de un lote en el libro y en la línea."""
+        if pd.isna(unds):
+            return
+        u = signo * unds
+        self._cubrir(dia_recepcion, entrada, salida)
+        if pd.notna(entrada):
+            self.libro.carga_entrada[entrada] = self.libro.carga_entrada.get(entrada, 0) + u
+            k = self._indice(entrada)
+            self.ent[1][k] -= u
+            self.ent[2][k] -= u
+            if pd.notna(dia_recepcion) and entrada.date() > dia_recepcion.date():
+                _sumar_en_rango(self.libro.estab_stock, dia_recepcion, entrada - pd.Timedelta(days=1), u)
+                self.estab.sumar(self._indice(dia_recepcion), k - 1, -u)
+        if pd.notna(salida):
+            self.libro.carga_salida[salida] = self.libro.carga_salida.get(salida, 0) + u
+            k = self._indice(salida)
+            self.sal[1][k] -= u
+            self.sal[2][k] -= u
+
+    def sincronizar(self, df_plan: pd.DataFrame) -> pd.DataFrame:
+        """
+        Lleva la línea al plan 'df_plan' aplicando solo las filas que cambian (por LOTE) respecto
+        al último plan sincronizado; si no hay delta posible, la reconstruye.
+        Devuelve las filas de 'df_plan' que entran (nuevas o modificadas).
+        """
+        if df_plan is self.plan:
+            return df_plan.iloc[:0]
+        columnas = [c for c in _COLUMNAS_HOLGURA if c in self.plan.columns and c in df_plan.columns]
+        delta = None
+        if len(columnas) == len(_COLUMNAS_HOLGURA):
+            delta = delta_planes(self.plan[columnas], df_plan[columnas])
+        if delta is None:
+            self._recargar(df_plan)
+            return df_plan
+        for signo, filas in ((-1, delta["salen"]), (1, delta["entran"])):
+            for dia, entrada, salida, unds in filas[list(_COLUMNAS_HOLGURA[1:])].itertuples(index=False):
+                self._aplicar(dia, entrada, salida, unds, signo)
+        self.plan = df_plan
+        return df_plan.iloc[delta["pos_entran"]]
+
+    # ---- Consultas ----
+    def holgura(self, fecha) -> dict:
+        """Capacidad restante de un día: ENTRADA_1/2, SALIDA_1/2 (por intento) y ESTAB."""
+        self._cubrir(fecha)
+        k = self._indice(fecha)
+        return {
+            "ENTRADA_1": self.ent[1][k], "ENTRADA_2": self.ent[2][k],
+            "SALIDA_1": self.sal[1][k], "SALIDA_2": self.sal[2][k],
+            "ESTAB": self.estab.minimo_en(k, k),
+        }
+
+    def max_unidades(self, dia_recepcion, entrada, salida=None, intento=2, dias_sal_optimos=None, propias=0):
+        """
+        Máximo de unidades que caben con ENTRADA el día 'entrada' para un lote recibido 'dia_recepcion':
+        el mínimo entre la holgura de ENTRADA ese día, la de SALIDA (la fecha dada o, con
+        'dias_sal_optimos', la SALIDA ajustada por calendario) y la menor holgura de ESTABILIZACIÓN
+        entre la recepción y la víspera de la entrada.
+        'propias' son las unidades del propio lote si ya está en el plan con esos mismos días
+        (se le devuelven para consultar la holgura de una fila existente).
+        Devuelve (unidades, recurso_limitante); un valor negativo indica capacidad ya superada.
+        """
+        entrada = pd.Timestamp(entrada).normalize()
+        if salida is None and dias_sal_optimos is not None and pd.notna(dias_sal_optimos):
+            salida = self.libro.salida_ajustada(entrada, dias_sal_optimos)
+        self._cubrir(dia_recepcion, entrada, salida)
+        k = self._indice(entrada)
+        limites = [("ENTRADA", self.ent[intento][k])]
+        if pd.notna(dia_recepcion) and entrada > pd.Timestamp(dia_recepcion).normalize():
+            limites.append(("ESTABILIZACIÓN", self.estab.minimo_en(self._indice(dia_recepcion), k - 1)))
+        if salida is not None and pd.notna(salida):
+            limites.append(("SALIDA", self.sal[intento][self._indice(salida)]))
+        recurso, holgura = min(limites, key=lambda par: par[1])
+        return int(holgura + propias), recurso
+
+    def holgura_filas(self, df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Para cada fila planificada de 'df' (del plan sincronizado): unidades máximas con sus fechas
+        actuales en 1º y 2º intento (MAX_UNDS_1, MAX_UNDS_2) y recurso que limita el 2º (LIMITE).
+        Filas sin ENTRADA_SAL → NA.
+        """
+        max1, max2, limite = [], [], []
+        for dia, entrada, salida, unds in df[list(_COLUMNAS_HOLGURA[1:])].itertuples(index=False):
+            if pd.isna(entrada) or pd.isna(unds):
+                max1.append(pd.NA)
+                max2.append(pd.NA)
+                limite.append(pd.NA)
+                continue
+            salida = salida if pd.notna(salida) else None
+            m1, _ = self.max_unidades(dia, entrada, salida, intento=1, propias=unds)
+            m2, rec = self.max_unidades(dia, entrada, salida, intento=2, propias=unds)
+            max1.append(m1)
+            max2.append(m2)
+            limite.append(rec)
+        return pd.DataFrame({
+            "MAX_UNDS_1": pd.array(max1, dtype="Int64"),
+            "MAX_UNDS_2": pd.array(max2, dtype="Int64"),
+            "LIMITE": pd.array(limite, dtype="string"),
+        }, index=df.index)
+
+
+# -------------------------------
+# Planificador (GLOBAL, overrides por PRODUCTO y estabilización + overrides por FECHA entrada/salida/estab)
+# -------------------------------
+# REGLAS ESPECIALES DE ENTRADA COMÚN
+# - Grupos unitarios (cada código: todas sus filas al MISMO día de ENTRADA)
+# - Grupo conjunto (dos códigos al MISMO día entre sí). Si no cabe, fallback por separado.
+GRUPOS_ENTRADA_COMUN_UNITARIOS = [["JBSPRCLC-MEX"], ["JCIVRROD-MEX"], ["JBCPRCLC-MEX"]]
+GRUPO_ENTRADA_COMUN_CONJUNTO = ["JCIVRPORCISAN", "PCIVRPORCISAN"]
+CODIGOS_ENTRADA_COMUN = {c for g in GRUPOS_ENTRADA_COMUN_UNITARIOS for c in g} | set(GRUPO_ENTRADA_COMUN_CONJUNTO)
+
+def _norm_tipo(v):
+    s = str(v).strip().upper()
+    if "IBER" in s:
+        return "IBÉRICO"
+    if "BLAN" in s:
+        return "BLANCO"
+    return "OTRO"
+
+def _norm_nitrif(v):
+    try:
+        return int(v)
+    except Exception:
+        return None
+
+class PlanificacionCancelada(Exception):
+    """Se lanza dentro del planificador cuando se activa el evento de cancelación."""
+
+# -------------------------------
+# Asignación voraz de pendientes (también se ejecuta en procesos hijos, por bloques independientes)
+# -------------------------------
+UMBRAL_PARALELO = 400   # nº mínimo de lotes pendientes para repartir bloques entre procesos
+
+# Orden de asignación de los pendientes
+ORDEN_CRONOLOGICO = "cronologico"   # por DIA y PRODUCTO (comportamiento original)
+ORDEN_HOLGURA = "holgura"           # primero los lotes con menos días de entrada factibles
+ORDENES_ASIGNACION = {
+    "Cronológico (DIA, PRODUCTO)": ORDEN_CRONOLOGICO,
+    "Menos flexibles primero": ORDEN_HOLGURA,
+}
+
+# Motor del bucle voraz: núcleo numérico por días enteros (por defecto) o bucle por lotes con fechas
+MOTOR_NUCLEO = "nucleo"
+MOTOR_PYTHON = "python"
+
+def _dias_max_entero(dias_max_almacen):
+    """
+    Días máx. de almacén como entero para el núcleo y las huellas. Un override vacío (NaN) no deja
+    ningún día candidato (-1), igual que la comparación `<= NaN` del motor por lotes.
+    """
+    return -1 if pd.isna(dias_max_almacen) else int(dias_max_almacen)
+
+def _huella_lote(dia_recepcion, dias_max_almacen, dias_sal_optimos, festivos):
+    """
+    Intervalo [ini, fin] (días) que contiene todas las fechas cuya carga puede leer o modificar la
+    asignación del lote: entradas y estabilización en [DIA, DIA + días máx.] y, para cada entrada
+    candidata, la salida óptima y los hábiles anterior/siguiente que mira el ajuste por festivo.
+    """
+    ini = dia_recepcion.normalize()
+    fin = (dia_recepcion + pd.Timedelta(days=_dias_max_entero(dias_max_almacen))).normalize()
+    entrada = dia_recepcion if es_habil(dia_recepcion, festivos) else siguiente_habil(dia_recepcion, festivos)
+    while (entrada - dia_recepcion).days <= dias_max_almacen:
+        salida = entrada + timedelta(days=int(dias_sal_optimos))
+        ini = min(ini, anterior_habil(salida, festivos).normalize())
+        fin = max(fin, siguiente_habil(salida, festivos).normalize())
+        entrada = siguiente_habil(entrada, festivos)
+    return ini, fin
+
+def bloques_independientes(intervalos):
+    """
+    Barrido por inicio: agrupa las posiciones cuyos intervalos [ini, fin] comparten algún día.
+    Lotes de bloques distintos no tocan ninguna fecha común, así que no interactúan por capacidad.
+    Devuelve listas de posiciones (cada una en orden creciente), ordenadas por inicio de bloque.
+    """
+    bloques, fin_bloque = [], None
+    for i in sorted(range(len(intervalos)), key=lambda i: intervalos[i][0]):
+        ini, fin = intervalos[i]
+        if bloques and ini <= fin_bloque:
+            bloques[-1].append(i)
+            fin_bloque = max(fin_bloque, fin)
+        else:
+            bloques.append([i])
+            fin_bloque = fin
+    return [sorted(b) for b in bloques]
+
+def _repartir_bloques(bloques, n_trozos):
+    """Reparte bloques consecutivos en como mucho n_trozos trozos de tamaño parecido (posiciones ordenadas)."""
+    total = sum(len(b) for b in bloques)
+    objetivo = -(-total // max(1, n_trozos))
+    trozos, actual = [], []
+    for b in bloques:
+        actual.extend(b)
+        if len(actual) >= objetivo:
+            trozos.append(sorted(actual))
+            actual = []
+    if actual:
+        trozos.append(sorted(actual))
+    return trozos
+
+def _orden_por_holgura(lotes, libro, resultados):
+    """
+    Generador de lotes por flexibilidad dinámica: primero los que tienen menos días de entrada
+    factibles (2º intento) con las cargas actuales, y a igualdad los de menos unidades.
+    Montículo con versiones: tras cada asignación solo se recalculan los lotes pendientes cuyas
+    fechas dependientes (entradas, estabilización y salidas posibles) tocó esa asignación.
+    'resultados' es la lista que va rellenando _asignar_pendientes (se lee el último registro).
+    """
+    carga_entrada, carga_salida, estab_stock = libro.carga_entrada, libro.carga_salida, libro.estab_stock
+    festivos = libro.festivos
+    cap_ent2, cap_sal2, cap_estab = {}, {}, {}   # capacidades por fecha (constantes durante la planificación)
+
+    # Por lote: [(entrada candidata, nº de días de estabilización previos, salida)] y esos días normalizados.
+    # La salida solo depende de las cargas si cae en festivo de martes a jueves (None: se calcula al vuelo).
+    candidatos, dias_estab = [], []
+    dependientes = {}   # fecha → lotes cuya flexibilidad depende de la carga de esa fecha
+    for k, (_, _, dia, _, dso, _, _, dmax, _, _) in enumerate(lotes):
+        inicio = dia.normalize()
+        cands = []
+        e = dia if es_habil(dia, festivos) else siguiente_habil(dia, festivos)
+        while (e - dia).days <= dmax:
+            bruta = e + timedelta(days=int(dso))
+            dinamica = libro.ajuste_festivos and bruta.normalize() in festivos and bruta.weekday() in (1, 2, 3)
+            cands.append((e, (e.normalize() - inicio).days, None if dinamica else libro.salida_ajustada(e, dso)))
+            e = siguiente_habil(e, festivos)
+        n_dias = max([n for _, n, _ in cands], default=0)
+        dias = [inicio + pd.Timedelta(days=i) for i in range(n_dias)]
+        candidatos.append(cands)
+        dias_estab.append(dias)
+        fechas = set(dias)
+        for e, _, _ in cands:
+            bruta = e + timedelta(days=int(dso))
+            fechas.update((e.normalize(), bruta.normalize(), anterior_habil(bruta, festivos).normalize(),
+                           siguiente_habil(bruta, festivos).normalize()))
+        for f in fechas:
+            dependientes.setdefault(f, []).append(k)
+
+    def _cap(cache, fecha, get):
+        c = cache.get(fecha)
+        if c is None:
+            c = cache[fecha] = get(fecha)
+        return c
+
+    def _flexibilidad(k):
+        unds, dso = lotes[k][3], lotes[k][4]
+        n, verificados, dias = 0, 0, dias_estab[k]
+        for e, n_estab, s in candidatos[k]:
+            # La estabilización de una entrada posterior incluye la de las anteriores: si falla un día, fallan todas
+            while verificados < n_estab:
+                d = dias[verificados]
+                if estab_stock.get(d, 0) + unds > _cap(cap_estab, d, libro.get_estab_cap):
+                    return n
+                verificados += 1
+            if carga_entrada.get(e, 0) + unds > _cap(cap_ent2, e, lambda f: libro.get_cap_ent(f, 2)):
+                continue
+            if s is None:
+                s = libro.salida_ajustada(e, dso)
+            if carga_salida.get(s, 0) + unds <= _cap(cap_sal2, s, lambda f: libro.get_cap_sal(f, 2)):
+                n += 1
+        return n
+
+    flexibilidad = [_flexibilidad(k) for k in range(len(lotes))]
+    version = [0] * len(lotes)
+    pendiente = [True] * len(lotes)
+    monticulo = [(flexibilidad[k], l[3], k, 0) for k, l in enumerate(lotes)]
+    heapq.heapify(monticulo)
+    while monticulo:
+        _, _, k, v = heapq.heappop(monticulo)
+        if not pendiente[k] or v != version[k]:
+            continue
+        pendiente[k] = False
+        yield lotes[k]
+
+        _, _, entrada, salida = resultados[-1]
+        if entrada is None:
+            continue
+        dia = lotes[k][2]
+        tocadas = {entrada.normalize(), salida.normalize()}
+        if entrada.date() > dia.date():
+            tocadas.update(pd.date_range(dia.normalize(), (entrada - pd.Timedelta(days=1)).normalize(), freq="D"))
+        # Se recalculan también los lotes en 0: la flexibilidad no es monótona, porque la salida en
+        # festivo de martes a jueves puede pasar a un día con más capacidad al cargar el otro
+        afectados = {j for f in tocadas for j in dependientes.get(f, ()) if pendiente[j]}
+        for j in afectados:
+            nueva = _flexibilidad(j)
+            if nueva != flexibilidad[j]:
+                flexibilidad[j] = nueva
+                version[j] += 1
+                heapq.heappush(monticulo, (nueva, lotes[j][3], j, version[j]))
+
+# -------------------------------
+# Núcleo numérico de asignación (días como enteros; compilado con Numba si está disponible)
+# -------------------------------
+def _nucleo_asignacion(
+    dia, unds, dso, dmax, tipo, nitr,
+    habil, sal_fija, sal_ant, sal_sig,
+    cap_ent1, cap_ent2, cap_sal1, cap_sal2, cap_estab,
+    carga_ent, carga_sal, estab,
+    perfil_tipo, n_tipos, perfil_nitr, n_nitr, tot_tipo, tot_nitr,
+    ent_out, sal_out,
+    ancho, sug_n, sug_e, sug_s, sug_ent1, sug_ent2, sug_sal1, sug_sal2, sug_est, sug_est_n, sug_est_dia, sug_est_val
+):
+    """
+    Mismo voraz que _asignar_pendientes (orden cronológico) sobre días como desplazamientos enteros.
+    Entradas/salidas elegidas en ent_out/sal_out (-1 si el lote no encaja); cargas y perfiles se
+    actualizan in situ. Para cada lote que no encaja se guardan, con las cargas de ese momento, los
+    déficits por entrada candidata (hasta 'ancho' por lote) que _sugerencias_lote calcula en Python.
+    Solo usa indexado 1D para funcionar igual con listas (Python) y arrays (Numba).
+    """
+    for i in range(len(dia)):
+        d0, u = dia[i], unds[i]
+        ent_out[i] = -1
+        sal_out[i] = -1
+        for intento in range(1, 3):
+            mejor_e, mejor_s, mejor_coste = -1, -1, 4
+            e = d0
+            while e - d0 <= dmax[i]:
+                if habil[e]:
+                    cap_e = cap_ent1[e] if intento == 1 else cap_ent2[e]
+                    if carga_ent[e] + u <= cap_e:
+                        cabe = True
+                        for k in range(d0, e):
+                            if estab[k] + u > cap_estab[k]:
+                                cabe = False
+                                break
+                        if cabe:
+                            r = e + dso[i]
+                            s = sal_fija[r]
+                            if s < 0:
+                                s = sal_ant[r] if carga_sal[sal_ant[r]] <= carga_sal[sal_sig[r]] else sal_sig[r]
+                            cap_s = cap_sal1[s] if intento == 1 else cap_sal2[s]
+                            if carga_sal[s] + u <= cap_s:
+                                coste_tipo = 0
+                                if tot_tipo[e] > 0 and perfil_tipo[e * n_tipos + tipo[i]] == 0:
+                                    coste_tipo = 1
+                                coste_nitr = 0
+                                if tot_nitr[e] > 0 and (nitr[i] < 0 or perfil_nitr[e * n_nitr + nitr[i]] == 0):
+                                    coste_nitr = 1
+                                coste = 2 * coste_tipo + coste_nitr
+                                if coste < mejor_coste:
+                                    mejor_e, mejor_s, mejor_coste = e, s, coste
+                e += 1
+            if mejor_e >= 0:
+                carga_ent[mejor_e] += u
+                carga_sal[mejor_s] += u
+                for k in range(d0, mejor_e):
+                    estab[k] += u
+                perfil_tipo[mejor_e * n_tipos + tipo[i]] += 1
+                tot_tipo[mejor_e] += 1
+                if nitr[i] >= 0:
+                    perfil_nitr[mejor_e * n_nitr + nitr[i]] += 1
+                    tot_nitr[mejor_e] += 1
+                ent_out[i] = mejor_e
+                sal_out[i] = mejor_s
+                break
+
+        if ent_out[i] < 0:
+            # Déficits para las sugerencias (entradas candidatas en orden; el intento solo cambia la capacidad)
+            j = 0
+            e = d0
+            while e - d0 <= dmax[i]:
+                if habil[e]:
+                    c = i * ancho + j
+                    n_est, max_est = 0, 0
+                    for k in range(d0, e):
+                        falta = estab[k] + u - cap_estab[k]
+                        if falta > 0:
+                            if falta > max_est:
+                                max_est = falta
+                            if n_est < 3:
+                                sug_est_dia[c * 3 + n_est] = k
+                                sug_est_val[c * 3 + n_est] = falta
+                            n_est += 1
+                    r = e + dso[i]
+                    s = sal_fija[r]
+                    if s < 0:
+                        s = sal_ant[r] if carga_sal[sal_ant[r]] <= carga_sal[sal_sig[r]] else sal_sig[r]
+                    sug_e[c] = e
+                    sug_s[c] = s
+                    sug_ent1[c] = max(0, carga_ent[e] + u - cap_ent1[e])
+                    sug_ent2[c] = max(0, carga_ent[e] + u - cap_ent2[e])
+                    sug_sal1[c] = max(0, carga_sal[s] + u - cap_sal1[s])
+                    sug_sal2[c] = max(0, carga_sal[s] + u - cap_sal2[s])
+                    sug_est[c] = max_est
+                    sug_est_n[c] = min(n_est, 3)
+                    j += 1
+                e += 1
+            sug_n[i] = j
+
+# Numba es opcional: si está instalado, el núcleo se compila (JIT) la primera vez que se usa.
+# Se importa aquí y no al cargar el módulo: importar numba cuesta ~1 s en cada arranque de la app.
+_NUCLEO_COMPILADO = {}
+
+def _nucleo_compilado():
+    """Núcleo compilado con Numba (se importa y compila en la primera llamada); None sin Numba."""
+    if "nucleo" not in _NUCLEO_COMPILADO:
+        try:
+            from numba import njit
+        except ImportError:
+            njit = None
+        _NUCLEO_COMPILADO["nucleo"] = njit(cache=True)(_nucleo_asignacion) if njit is not None else None
+    return _NUCLEO_COMPILADO["nucleo"]
+
+def _calendario_entero(libro, origen, fin_bruto):
+    """
+    Calendario, capacidades y cargas del libro como arrays por día desde 'origen' (posición = días):
+    hábiles, salida ajustada por día bruto (ENTRADA + DIAS_SAL_OPTIMOS) hasta 'fin_bruto' (sal_fija,
+    o -1 si depende de la carga por festivo de martes a jueves: sal_ant/sal_sig), capacidades por
+    intento y cargas actuales. Lo comparten el núcleo de asignación y el análisis de ampliación.
+    """
+    festivos = libro.festivos
+    n_bruto = (fin_bruto - origen).days + 1
+    sal_fija = np.full(n_bruto, -1, dtype=np.int64)
+    sal_ant = np.zeros(n_bruto, dtype=np.int64)
+    sal_sig = np.zeros(n_bruto, dtype=np.int64)
+    for r, f in enumerate(pd.date_range(origen, periods=n_bruto, freq="D")):
+        if libro.ajuste_festivos and f in festivos and f.weekday() in (1, 2, 3):
+            sal_ant[r] = (anterior_habil(f, festivos) - origen).days
+            sal_sig[r] = (siguiente_habil(f, festivos) - origen).days
+        else:
+            sal_fija[r] = (libro.salida_ajustada(f, 0) - origen).days
+    horizonte = int(max(sal_fija.max(), sal_sig.max(), n_bruto - 1)) + 1
+    fechas = pd.date_range(origen, periods=horizonte, freq="D")
+
+    def _cargas(dic):
+        arr = np.zeros(horizonte, dtype=np.int64)
+        for f, v in dic.items():
+            k = (f - origen).days
+            if 0 <= k < horizonte:
+                arr[k] += v
+        return arr
+
+    return {
+        "fechas": fechas,
+        "habil": np.array([es_habil(f, festivos) for f in fechas], dtype=np.bool_),
+        "sal_fija": sal_fija, "sal_ant": sal_ant, "sal_sig": sal_sig,
+        "cap_ent1": np.array([libro.get_cap_ent(f, 1) for f in fechas], dtype=np.int64),
+        "cap_ent2": np.array([libro.get_cap_ent(f, 2) for f in fechas], dtype=np.int64),
+        "cap_sal1": np.array([libro.get_cap_sal(f, 1) for f in fechas], dtype=np.int64),
+        "cap_sal2": np.array([libro.get_cap_sal(f, 2) for f in fechas], dtype=np.int64),
+        "cap_estab": np.array([libro.get_estab_cap(f) for f in fechas], dtype=np.int64),
+        "carga_ent": _cargas(libro.carga_entrada),
+        "carga_sal": _cargas(libro.carga_salida),
+        "estab": _cargas(libro.estab_stock),
+    }
+
+def _ejecutar_nucleo(args):
+    """Ejecuta _nucleo_asignacion (compilado si hay Numba) y devuelve los argumentos como arrays, ya actualizados."""
+    nucleo_jit = _nucleo_compilado()
+    if nucleo_jit is None:
+        # Sin Numba: listas de Python (el acceso por índice es mucho más rápido que en arrays numpy)
+        args = [a.tolist() if isinstance(a, np.ndarray) else a for a in args]
+        _nucleo_asignacion(*args)
+        return [np.asarray(a) if isinstance(a, list) else a for a in args]
+    nucleo_jit(*args)
+    return args
+
+def _asignar_con_nucleo(lotes, libro, entrada_profile, avisar=None):
+    """
+    Traduce lotes, calendario, capacidades, cargas y perfiles a desplazamientos enteros en días y
+    ejecuta _nucleo_asignacion (compilado si hay Numba). Después vuelca al libro las cargas que han
+    cambiado y monta las sugerencias de los que no encajan en el mismo orden que el bucle por lotes.
+    Devuelve None si el plan tiene horas distintas de 00:00 (las claves por día no serían equivalentes).
+    """
+    if not lotes:
+        return [], {}
+    medianoche = lambda f: f == f.normalize()
+    if not all(medianoche(l[2]) for l in lotes) or not all(
+        medianoche(f) for dic in (libro.carga_entrada, libro.carga_salida, libro.estab_stock) for f in dic
+    ):
+        return None
+
+    origen = min(l[2] for l in lotes) - pd.Timedelta(days=7)
+    fin_bruto = max(l[2] + pd.Timedelta(days=_dias_max_entero(l[7]) + int(l[4])) for l in lotes) + pd.Timedelta(days=7)
+    cal = _calendario_entero(libro, origen, fin_bruto)
+    fechas, horizonte = cal["fechas"], len(cal["fechas"])
+    carga_ent, carga_sal, estab = cal["carga_ent"], cal["carga_sal"], cal["estab"]
+
+    # Perfiles TIPO/NITRIF por día de entrada como contadores planos [día * n_códigos + código]
+    codigos_tipo = {t: c for c, t in enumerate(sorted(
+        {l[8] for l in lotes} | {t for p in entrada_profile.values() for t in p["tipo"]}, key=str))}
+    codigos_nitr = {t: c for c, t in enumerate(sorted(
+        {l[9] for l in lotes if l[9] is not None} | {t for p in entrada_profile.values() for t in p["nitrif"]}, key=str))}
+    n_tipos, n_nitr = max(1, len(codigos_tipo)), max(1, len(codigos_nitr))
+    perfil_tipo = np.zeros(horizonte * n_tipos, dtype=np.int64)
+    perfil_nitr = np.zeros(horizonte * n_nitr, dtype=np.int64)
+    tot_tipo = np.zeros(horizonte, dtype=np.int64)
+    tot_nitr = np.zeros(horizonte, dtype=np.int64)
+    for f, p in entrada_profile.items():
+        k = (f - origen).days
+        if 0 <= k < horizonte:
+            for t, n in p["tipo"].items():
+                perfil_tipo[k * n_tipos + codigos_tipo[t]] += n
+                tot_tipo[k] += n
+            for t, n in p["nitrif"].items():
+                perfil_nitr[k * n_nitr + codigos_nitr[t]] += n
+                tot_nitr[k] += n
+
+    n = len(lotes)
+    ancho = max(_dias_max_entero(l[7]) for l in lotes) + 1
+    sug = [np.zeros(n, dtype=np.int64)] + [np.zeros(n * ancho, dtype=np.int64) for _ in range(8)] + \
+          [np.zeros(n * ancho * 3, dtype=np.int64) for _ in range(2)]
+    cargas_ini = (carga_ent.copy(), carga_sal.copy(), estab.copy())
+    args = [
+        np.array([(l[2] - origen).days for l in lotes], dtype=np.int64),
+        np.array([l[3] for l in lotes], dtype=np.int64),
+        np.array([l[4] for l in lotes], dtype=np.int64),
+        np.array([_dias_max_entero(l[7]) for l in lotes], dtype=np.int64),
+        np.array([codigos_tipo[l[8]] for l in lotes], dtype=np.int64),
+        np.array([codigos_nitr[l[9]] if l[9] is not None else -1 for l in lotes], dtype=np.int64),
+        cal["habil"], cal["sal_fija"], cal["sal_ant"], cal["sal_sig"],
+        cal["cap_ent1"], cal["cap_ent2"], cal["cap_sal1"], cal["cap_sal2"], cal["cap_estab"],
+        carga_ent, carga_sal, estab,
+        perfil_tipo, n_tipos, perfil_nitr, n_nitr, tot_tipo, tot_nitr,
+        np.empty(n, dtype=np.int64), np.empty(n, dtype=np.int64),
+        ancho, *sug,
+    ]
+    if avisar is not None:
+        avisar(0)
+    args = _ejecutar_nucleo(args)
+    carga_ent, carga_sal, estab = args[15], args[16], args[17]
+    ent_out, sal_out = args[24], args[25]
+    sug_n, sug_e, sug_s, sug_ent1, sug_ent2, sug_sal1, sug_sal2, sug_est, sug_est_n, sug_est_dia, sug_est_val = args[27:]
+
+    # Cargas finales al libro (solo los días que han cambiado)
+    for dic, ini, fin in zip((libro.carga_entrada, libro.carga_salida, libro.estab_stock), cargas_ini, (carga_ent, carga_sal, estab)):
+        for k in np.flatnonzero(fin != ini):
+            dic[fechas[k]] = dic.get(fechas[k], 0) + int(fin[k] - ini[k])
+
+    resultados, sugerencias = [], {}
+    for i, lote in enumerate(lotes):
+        if avisar is not None:
+            avisar(i)
+        pos, idx = lote[0], lote[1]
+        if ent_out[i] >= 0:
+            entrada, salida = fechas[ent_out[i]], fechas[sal_out[i]]
+            resultados.append((pos, idx, entrada, salida))
+            prof = entrada_profile.setdefault(entrada, {"tipo": Counter(), "nitrif": Counter()})
+            prof["tipo"][lote[8]] += 1
+            if lote[9] is not None:
+                prof["nitrif"][lote[9]] += 1
+            continue
+
+        resultados.append((pos, idx, None, None))
+        filas_sug = []
+        for c in range(i * ancho, i * ancho + int(sug_n[i])):
+            entrada, salida = fechas[sug_e[c]], fechas[sug_s[c]]
+            def_est_dias = [(fechas[sug_est_dia[c * 3 + m]], int(sug_est_val[c * 3 + m])) for m in range(sug_est_n[c])]
+            for attempt, d_ent, d_sal in ((1, sug_ent1[c], sug_sal1[c]), (2, sug_ent2[c], sug_sal2[c])):
+                filas_sug.append(_fila_sugerencia(
+                    lote, entrada, salida, attempt, int(d_ent), int(sug_est[c]), def_est_dias, int(d_sal)
+                ))
+        if filas_sug:
+            sugerencias[pos] = _mejores_sugerencias(filas_sug)
+    return resultados, sugerencias
+
+def _fila_sugerencia(lote, entrada, salida, attempt, deficit_ent, deficit_estab_max, def_est_dias, deficit_sal):
+    """Fila de la tabla de sugerencias (con texto de recomendación rápida) para una entrada candidata e intento."""
+    lote_id, prod, unds, dia_recepcion = lote[6], lote[5], lote[3], lote[2]
+
+    # Generar texto de recomendación rápida
+    recomendaciones = []
+    if deficit_ent > 0:
+        recomendaciones.append(
+            f"Subir ENTRADA el {entrada.normalize().date()} en +{int(deficit_ent)} unds (INTENTO {attempt})."
+        )
+    if deficit_sal > 0:
+        recomendaciones.append(
+            f"Subir SALIDA el {salida.normalize().date()} en +{int(deficit_sal)} unds (INTENTO {attempt})."
+        )
+    if deficit_estab_max > 0:
+        # listar solo días con déficit > 0 (máx. 3 para no saturar)
+        dias_estab = [f"{k.date()}(+{v})" for k, v in def_est_dias[:3] if v > 0]
+        if dias_estab:
+            recomendaciones.append("Subir ESTABILIZACIÓN en: " + ", ".join(dias_estab))
+
+    return {
+        "LOTE": lote_id,
+        "PRODUCTO": prod,
+        "UNDS": unds,
+        "DIA_RECEPCION": pd.to_datetime(dia_recepcion).normalize(),
+        "ENTRADA_PROPUESTA": pd.to_datetime(entrada).normalize(),
+        "SALIDA_PROPUESTA": pd.to_datetime(salida).normalize(),
+        "INTENTO": attempt,
+        "DEFICIT_ENTRADA": int(deficit_ent),
+        "DEFICIT_ESTAB_MAX": int(deficit_estab_max),
+        "DEFICIT_SALIDA": int(deficit_sal),
+        "MAX_DEFICIT": int(max(deficit_ent, deficit_estab_max, deficit_sal)),
+        "TOTAL_DEFICIT": int(deficit_ent + deficit_estab_max + deficit_sal),
+        "RECOMENDACION": " | ".join(recomendaciones) if recomendaciones else "Sin ajustes necesarios"
+    }
+
+def _mejores_sugerencias(sugerencias_rows_lote):
+    sugerencias_rows_lote.sort(
+        key=lambda r: (r["MAX_DEFICIT"], r["TOTAL_DEFICIT"], r["ENTRADA_PROPUESTA"])
+    )
+    return sugerencias_rows_lote[:20]
+
+def _sugerencias_lote(libro, lote):
+    """
+    Filas de sugerencias (las 20 mejores por déficit) para un lote que no encaja, con las cargas
+    actuales del libro: déficit de ENTRADA, ESTABILIZACIÓN y SALIDA por entrada candidata e intento.
+    """
+    dia_recepcion, unds, dias_sal_optimos, dias_max_almacen = lote[2], lote[3], lote[4], lote[7]
+    carga_entrada, carga_salida = libro.carga_entrada, libro.carga_salida
+    es_habil, siguiente_habil = libro.es_habil, libro.siguiente_habil
+    entrada = dia_recepcion if es_habil(dia_recepcion) else siguiente_habil(dia_recepcion)
+
+    sugerencias_rows_lote = []
+    while (entrada - dia_recepcion).days <= dias_max_almacen:
+        if not es_habil(entrada):
+            entrada = siguiente_habil(entrada)
+            continue
+
+        for attempt in [1, 2]:
+            cap_ent_dia = libro.get_cap_ent(entrada, attempt)
+            deficit_ent = max(0, (carga_entrada.get(entrada, 0) + unds) - cap_ent_dia)
+
+            def_est = libro.deficits_estab(dia_recepcion, entrada - pd.Timedelta(days=1), unds)
+            deficit_estab_max = max(def_est.values()) if def_est else 0
+
+            salida = libro.salida_ajustada(entrada, dias_sal_optimos)
+
+            cap_sal_dia = libro.get_cap_sal(salida, attempt)
+            deficit_sal = max(0, (carga_salida.get(salida, 0) + unds) - cap_sal_dia)
+
+            sugerencias_rows_lote.append(_fila_sugerencia(
+                lote, entrada, salida, attempt, deficit_ent, deficit_estab_max, list(def_est.items()), deficit_sal
+            ))
+
+        entrada = siguiente_habil(entrada)
+
+    return _mejores_sugerencias(sugerencias_rows_lote)
+
+def _asignar_pendientes(lotes, libro, entrada_profile, avisar=None, orden=ORDEN_CRONOLOGICO, motor=MOTOR_NUCLEO):
+    """
+    Bucle voraz de asignación sobre 'lotes' (tuplas preparadas por planificar_filas_na, ya en orden
+    DIA/PRODUCTO). Con orden=ORDEN_HOLGURA se procesan por flexibilidad dinámica (_orden_por_holgura).
+    En orden cronológico y motor=MOTOR_NUCLEO se usa el núcleo numérico (_asignar_con_nucleo), con el
+    mismo resultado. Actualiza 'libro' y 'entrada_profile' in situ.
+    Devuelve ([(pos, idx, entrada | None, salida | None)], {pos: filas de sugerencias}).
+    """
+    if orden == ORDEN_CRONOLOGICO and motor == MOTOR_NUCLEO:
+        salida_nucleo = _asignar_con_nucleo(lotes, libro, entrada_profile, avisar)
+        if salida_nucleo is not None:
+            return salida_nucleo
+
+    carga_entrada, carga_salida = libro.carga_entrada, libro.carga_salida
+    get_cap_ent, get_cap_sal = libro.get_cap_ent, libro.get_cap_sal
+    cabe_en_estab_rango, deficits_estab = libro.cabe_en_estab_rango, libro.deficits_estab
+    es_habil, siguiente_habil = libro.es_habil, libro.siguiente_habil
+
+    resultados, sugerencias = [], {}
+    secuencia = _orden_por_holgura(lotes, libro, resultados) if orden == ORDEN_HOLGURA else lotes
+    for i_lote, lote in enumerate(secuencia):
+        (pos, idx, dia_recepcion, unds, dias_sal_optimos, prod, lote_id,
+         dias_max_almacen, tipo_lote, nitr_lote) = lote
+        if avisar is not None:
+            avisar(i_lote)
+
+        entrada_ini = dia_recepcion if es_habil(dia_recepcion) else siguiente_habil(dia_recepcion)
+        asignado = False
+
+        for attempt in [1, 2]:
+            candidatos = []
+            entrada = entrada_ini
+            while (entrada - dia_recepcion).days <= dias_max_almacen:
+                cap_ent_dia = get_cap_ent(entrada, attempt)
+                if carga_entrada.get(entrada, 0) + unds <= cap_ent_dia:
+                    if cabe_en_estab_rango(dia_recepcion, entrada - pd.Timedelta(days=1), unds):
+                        salida = libro.salida_ajustada(entrada, dias_sal_optimos)
+
+                        cap_sal_dia = get_cap_sal(salida, attempt)
+                        if carga_salida.get(salida, 0) + unds <= cap_sal_dia:
+                            # Candidato válido; calcular score por TIPO/NITRIF + fecha
+                            prof = entrada_profile.get(entrada, {"tipo": Counter(), "nitrif": Counter()})
+                            tipo_counts   = prof["tipo"]
+                            nitrif_counts = prof["nitrif"]
+
+                            if sum(tipo_counts.values()) == 0:
+                                cost_tipo = 0
+                            else:
+                                cost_tipo = 0 if tipo_counts.get(tipo_lote, 0) > 0 else 1
+
+                            if sum(nitrif_counts.values()) == 0:
+                                cost_nitr = 0
+                            else:
+                                cost_nitr = 0 if (nitr_lote is not None and nitrif_counts.get(nitr_lote, 0) > 0) else 1
+
+                            score = (cost_tipo, cost_nitr, entrada)
+                            candidatos.append((score, entrada, salida))
+
+                entrada = siguiente_habil(entrada)
+
+            if candidatos:
+                candidatos.sort(key=lambda t: t[0])
+                _, entrada_sel, salida_sel = candidatos[0]
+
+                resultados.append((pos, idx, entrada_sel, salida_sel))
+                libro.registrar(dia_recepcion, entrada_sel, salida_sel, unds)
+
+                if entrada_sel not in entrada_profile:
+                    entrada_profile[entrada_sel] = {"tipo": Counter(), "nitrif": Counter()}
+                entrada_profile[entrada_sel]["tipo"][tipo_lote] += 1
+                if nitr_lote is not None:
+                    entrada_profile[entrada_sel]["nitrif"][nitr_lote] += 1
+
+                asignado = True
+                break
+
+        # Si no se pudo asignar → generar sugerencias (tabla detallada por combinación + texto rápido)
+        if not asignado:
+            resultados.append((pos, idx, None, None))
+            filas_sug = _sugerencias_lote(libro, lote)
+            if filas_sug:
+                sugerencias[pos] = filas_sug
+
+    return resultados, sugerencias
+
+def _columna_entera(df: pd.DataFrame, col: str, filas: np.ndarray, valores: np.ndarray) -> pd.Series:
+    """Columna 'col' con 'valores' en las posiciones 'filas', en el esquema compacto (int32 o Int32)."""
+    if col in df.columns:
+        base = pd.to_numeric(df[col], errors="coerce").astype("Int64").to_numpy(dtype="float64", na_value=np.nan)
+    else:
+        base = np.full(len(df), np.nan)
+    base[filas] = valores
+    out = pd.Series(base, index=df.index)
+    return out.astype("int32") if not np.isnan(base).any() else out.astype("Int32")
+
+def _escribir_asignaciones(df, asignada, entrada, salida, no_encaja):
+    """
+    Vuelca en df (in situ, una asignación vectorizada por columna y sin cambios de dtype) los
+    resultados acumulados por posición de fila: ENTRADA_SAL/SALIDA_SAL donde 'asignada', con
+    DIAS_SAL, DIAS_ALMACENADOS y DIFERENCIA_DIAS_SAL derivados en la misma pasada, y
+    LOTE_NO_ENCAJA donde no_encaja >= 0 (1 = no encaja).
+    """
+    filas = np.flatnonzero(asignada)
+    if len(filas):
+        for col, valores in (("ENTRADA_SAL", entrada), ("SALIDA_SAL", salida)):
+            nueva = df[col].to_numpy(dtype="datetime64[ns]", copy=True)
+            nueva[filas] = valores[filas]
+            serie = pd.Series(nueva, index=df.index)
+            df[col] = serie.astype(df[col].dtype) if pd.api.types.is_datetime64_dtype(df[col]) else serie
+        ent, sal = entrada[filas], salida[filas]
+        dia = df["DIA"].to_numpy(dtype="datetime64[ns]")[filas]
+        df["DIAS_SAL"] = _columna_entera(df, "DIAS_SAL", filas, (sal - ent) // np.timedelta64(1, "D"))
+        df["DIAS_ALMACENADOS"] = _columna_entera(df, "DIAS_ALMACENADOS", filas, (ent - dia) // np.timedelta64(1, "D"))
+
+    marcadas = np.flatnonzero(no_encaja >= 0)
+    if len(marcadas):
+        no_cabe = df["LOTE_NO_ENCAJA"].astype("boolean").to_numpy(dtype=object, na_value=pd.NA)
+        no_cabe[marcadas] = no_encaja[marcadas] == 1
+        df["LOTE_NO_ENCAJA"] = pd.Series(no_cabe, index=df.index, dtype="boolean")
+
+    # Métrica final
+    if "DIAS_SAL" in df.columns and "DIAS_SAL_OPTIMOS" in df.columns:
+        df["DIFERENCIA_DIAS_SAL"] = df["DIAS_SAL"] - df["DIAS_SAL_OPTIMOS"]
+
+def planificar_filas_na(
+    df_plan,
+    dias_max_almacen_global,
+    dias_max_por_producto,
+    estab_cap,
+    cap_overrides_ent,
+    cap_overrides_sal,
+    estab_cap_overrides,
+    progreso=None,
+    cancelar=None,
+    libro=None,
+    *,
+    cap_ent=CAP_ENT_DEFAULT,
+    cap_sal=CAP_SAL_DEFAULT,
+    dias_festivos=DIAS_FESTIVOS_DEFAULT,
+    ajuste_finde=True,
+    ajuste_festivos=True,
+    procesos=None,
+    orden=ORDEN_CRONOLOGICO,
+    motor=MOTOR_NUCLEO
+):
+    """
+    Planifica ENTRADA_SAL/SALIDA_SAL de las filas sin ENTRADA respetando lo ya planificado.
+    - progreso: callback opcional progreso(fase, hechos, total)
+    - cancelar: threading.Event opcional; si se activa se lanza PlanificacionCancelada
+    - libro: LibroCargas opcional que ya refleja las filas planificadas de df_plan; se actualiza
+      in situ con las nuevas asignaciones (si no se pasa, se construye con cap_ent/cap_sal/
+      estab_cap, los overrides y el calendario indicado)
+    - procesos: nº de procesos para planificar en paralelo bloques de lotes independientes (None = nº de
+      CPUs; 1 = secuencial). Solo se usa con al menos UMBRAL_PARALELO pendientes; el resultado es idéntico.
+    - orden: ORDEN_CRONOLOGICO (DIA, PRODUCTO) u ORDEN_HOLGURA (menos días de entrada factibles primero)
+    - motor: MOTOR_NUCLEO (núcleo por días enteros, compilado si hay Numba) o MOTOR_PYTHON (bucle por lotes)
+    """
+    def _avisar(fase, hechos, total):
+        if cancelar is not None and cancelar.is_set():
+            raise PlanificacionCancelada()
+        if progreso is not None:
+            progreso(fase, hechos, total)
+
+    df_corr = df_plan.copy(deep=False)
+
+    # Asegurar columnas auxiliares (LOTE_NO_ENCAJA booleano nullable)
+    if "LOTE_NO_ENCAJA" in df_corr.columns:
+        df_corr["LOTE_NO_ENCAJA"] = no_encaja_a_bool(df_corr["LOTE_NO_ENCAJA"])
+    else:
+        df_corr["LOTE_NO_ENCAJA"] = pd.Series(pd.NA, index=df_corr.index, dtype="boolean")
+
+    # Resultados por posición de fila: se acumulan en arrays tipados y se vuelcan en df_corr de una
+    # vez al final (_escribir_asignaciones); las lecturas intermedias de ENTRADA_SAL usan _entradas()
+    n_filas = len(df_corr)
+    res_asignada = np.zeros(n_filas, dtype=bool)
+    res_entrada = np.full(n_filas, np.datetime64("NaT"), dtype="datetime64[ns]")
+    res_salida = np.full(n_filas, np.datetime64("NaT"), dtype="datetime64[ns]")
+    res_no_encaja = np.full(n_filas, -1, dtype=np.int8)   # -1 sin cambio, 0 encaja, 1 no encaja
+    entrada_inicial = df_corr["ENTRADA_SAL"].to_numpy(dtype="datetime64[ns]")
+
+    def _entradas():
+        return np.where(res_asignada, res_entrada, entrada_inicial)
+
+    def _asignar(fila, entrada, salida):
+        res_asignada[fila] = True
+        res_entrada[fila] = pd.Timestamp(entrada).to_datetime64()
+        res_salida[fila] = pd.Timestamp(salida).to_datetime64()
+        res_no_encaja[fila] = 0
+
+    # Libro de cargas: lo ya planificado se respeta
+    if libro is None:
+        libro = LibroCargas(
+            cap_ent, cap_sal, estab_cap,
+            cap_overrides_ent, cap_overrides_sal, estab_cap_overrides,
+            dias_festivos, ajuste_finde, ajuste_festivos
+        ).cargar_plan(df_corr)
+    carga_entrada, carga_salida = libro.carga_entrada, libro.carga_salida
+    get_cap_ent, get_cap_sal, get_estab_cap = libro.get_cap_ent, libro.get_cap_sal, libro.get_estab_cap
+    cabe_en_estab_rango, deficits_estab = libro.cabe_en_estab_rango, libro.deficits_estab
+    es_habil, siguiente_habil = libro.es_habil, libro.siguiente_habil
+
+    # REGLAS ESPECIALES DE ENTRADA COMÚN
+    # - Grupos unitarios (mismo día por código):
+    #   ["JBSPRCLC-MEX"], ["JCIVRROD-MEX"], ["JBCPRCLC-MEX"]
+    # - Grupo conjunto (mismo día entre ambos, con fallback por separado):
+    #   ["JCIVRPORCISAN", "PCIVRPORCISAN"]
+    def _aplicar_entrada_comun_para_grupo(codigos, marcar_si_falla=False):
+        if "PRODUCTO" not in df_corr.columns:
+            return False
+
+        entradas = _entradas()
+        en_grupo = df_corr["PRODUCTO"].astype(str).isin(codigos).to_numpy()
+        filas_grupo = np.flatnonzero(en_grupo & np.isnat(entradas))
+        if not len(filas_grupo):
+            return False
+        pending = df_corr.iloc[filas_grupo]
+
+        fechas_existentes = sorted(
+            pd.Series(entradas[en_grupo & ~np.isnat(entradas)]).dt.normalize().unique().tolist()
+        )
+        fecha_preferente = fechas_existentes[0] if len(fechas_existentes) > 0 else None
+
+        inicios, limites = [], []
+        for _, r in pending.iterrows():
+            dia_recepcion = r["DIA"]
+            prod = r["PRODUCTO"]
+            dias_max_almacen = dias_max_por_producto.get(prod, dias_max_almacen_global)
+            entrada_ini_i = dia_recepcion if es_habil(dia_recepcion) else siguiente_habil(dia_recepcion)
+            limite_i = dia_recepcion + pd.Timedelta(days=_dias_max_entero(dias_max_almacen))
+            inicios.append(entrada_ini_i.normalize())
+            limites.append(limite_i.normalize())
+
+        if not inicios:
+            return False
+
+        inicio_comun = max(inicios)
+        limite_comun = min(limites)
+        if inicio_comun > limite_comun:
+            if marcar_si_falla:
+                res_no_encaja[filas_grupo] = 1
+            return False
+
+        def _es_factible_entrada_comun(d, attempt):
+            if d is None:
+                return False
+            d = pd.to_datetime(d).normalize()
+
+            total_unds = int(pending["UNDS"].sum())
+            if carga_entrada.get(d, 0) + total_unds > get_cap_ent(d, attempt):
+                return False
+
+            sim_stock = dict(libro.estab_stock)
+            for _, r in pending.iterrows():
+                dia_rec = r["DIA"]
+                unds_i = int(r["UNDS"])
+                if d.date() > dia_rec.date():
+                    for k in pd.date_range(dia_rec.normalize(), (d - pd.Timedelta(days=1)).normalize(), freq="D"):
+                        k0 = k.normalize()
+                        if sim_stock.get(k0, 0) + unds_i > get_estab_cap(k0):
+                            return False
+                        sim_stock[k0] = sim_stock.get(k0, 0) + unds_i
+
+            add_salida = {}
+            for _, r in pending.iterrows():
+                unds_i = int(r["UNDS"])
+                dias_sal_optimos = int(r["DIAS_SAL_OPTIMOS"])
+                salida = libro.salida_ajustada(d, dias_sal_optimos, add_salida)
+                add_salida[salida] = add_salida.get(salida, 0) + unds_i
+
+            for sfecha, suma_unds in add_salida.items():
+                if carga_salida.get(sfecha, 0) + suma_unds > get_cap_sal(sfecha, attempt):
+                    return False
+
+            return True
+
+        entrada_elegida = None
+        for attempt in [1, 2]:
+            candidatos = []
+            if fecha_preferente is not None:
+                if (fecha_preferente >= inicio_comun) and (fecha_preferente <= limite_comun):
+                    candidatos.append(pd.to_datetime(fecha_preferente).normalize())
+
+            d = inicio_comun
+            if not es_habil(d):
+                d = siguiente_habil(d)
+            while d <= limite_comun:
+                if d not in candidatos:
+                    candidatos.append(d)
+                d = siguiente_habil(d)
+
+            for d in candidatos:
+                if _es_factible_entrada_comun(d, attempt):
+                    entrada_elegida = d
+                    break
+            if entrada_elegida is not None:
+                break
+
+        if entrada_elegida is not None:
+            for fila, (_, r) in zip(filas_grupo, pending.iterrows()):
+                dia_recepcion = r["DIA"]
+                unds_i = int(r["UNDS"])
+                dias_sal_optimos = int(r["DIAS_SAL_OPTIMOS"])
+
+                salida = libro.salida_ajustada(entrada_elegida, dias_sal_optimos)
+                _asignar(fila, entrada_elegida, salida)
+                libro.registrar(dia_recepcion, entrada_elegida, salida, unds_i)
+
+            return True
+
+        if marcar_si_falla:
+            res_no_encaja[filas_grupo] = 1
+        return False
+
+    # Ejecutar reglas especiales
+    n_grupos = len(GRUPOS_ENTRADA_COMUN_UNITARIOS) + 1
+    for i_grupo, codigos in enumerate(GRUPOS_ENTRADA_COMUN_UNITARIOS):
+        _avisar("Reglas de entrada común", i_grupo, n_grupos)
+        _aplicar_entrada_comun_para_grupo(codigos, marcar_si_falla=False)
+
+    _avisar("Reglas de entrada común", n_grupos - 1, n_grupos)
+    exito_conjunto = _aplicar_entrada_comun_para_grupo(GRUPO_ENTRADA_COMUN_CONJUNTO, marcar_si_falla=False)
+    if not exito_conjunto:
+        for codigo in GRUPO_ENTRADA_COMUN_CONJUNTO:
+            _aplicar_entrada_comun_para_grupo([codigo], marcar_si_falla=False)
+    # ===============================
+    # Asignación de pendientes minimizando cambios de TIPO/NITRIF por día
+    # ===============================
+    entrada_profile = {}
+    entradas = _entradas()
+    if "ENTRADA_SAL" in df_corr.columns:
+        filas_ya = np.flatnonzero(~np.isnat(entradas))
+        ya = df_corr.iloc[filas_ya]
+        if not ya.empty:
+            col_tipo = "TIPO NITRIF" if "TIPO NITRIF" in ya.columns else None
+            col_nitrif = "NITRIF" if "NITRIF" in ya.columns else None
+            for fila, (_, r) in zip(filas_ya, ya.iterrows()):
+                d = pd.Timestamp(entradas[fila]).normalize()
+                tipo = _norm_tipo(r[col_tipo]) if col_tipo else "OTRO"
+                nitr = _norm_nitrif(r[col_nitrif]) if col_nitrif else None
+                if d not in entrada_profile:
+                    entrada_profile[d] = {"tipo": Counter(), "nitrif": Counter()}
+                entrada_profile[d]["tipo"][tipo] += 1
+                if nitr is not None:
+                    entrada_profile[d]["nitrif"][nitr] += 1
+
+    col_tipo = "TIPO NITRIF" if "TIPO NITRIF" in df_corr.columns else None
+    col_nitrif = "NITRIF" if "NITRIF" in df_corr.columns else None
+
+    # Sugerencias para lotes que no encajan
+    sugerencias_rows = []
+
+    filas_pendientes = np.flatnonzero(np.isnat(entradas))
+    pendientes = df_corr.iloc[filas_pendientes].assign(_FILA=filas_pendientes)
+    if "DIA" in pendientes.columns:
+        pendientes = pendientes.sort_values(["DIA", "PRODUCTO"], kind="stable")
+    filas_lotes = pendientes.pop("_FILA").to_numpy()   # posición en df_corr de cada lote pendiente
+
+    lotes = []
+    for pos, (idx, row) in enumerate(pendientes.iterrows()):
+        prod = row.get("PRODUCTO", None)
+        lotes.append((
+            pos, idx, row["DIA"], int(row["UNDS"]), int(row["DIAS_SAL_OPTIMOS"]), prod, row.get("LOTE", idx),
+            dias_max_por_producto.get(prod, dias_max_almacen_global),
+            _norm_tipo(row[col_tipo]) if col_tipo else "OTRO",
+            _norm_nitrif(row[col_nitrif]) if col_nitrif else None,
+        ))
+    n_pendientes = len(lotes)
+
+    # Bloques independientes: si hay procesos disponibles y trabajo suficiente, cada trozo de
+    # bloques se planifica en otro proceso; el resultado es el mismo que en secuencial
+    if procesos is None:
+        procesos = os.cpu_count() or 1
+    trozos = []
+    if procesos > 1 and n_pendientes >= UMBRAL_PARALELO:
+        intervalos = [_huella_lote(l[2], l[7], l[4], libro.festivos) for l in lotes]
+        trozos = _repartir_bloques(bloques_independientes(intervalos), procesos)
+
+    if len(trozos) > 1:
+        resultados, sugerencias_por_lote = [], {}
+        ejecutor = ProcessPoolExecutor(max_workers=len(trozos), mp_context=multiprocessing.get_context("spawn"))
+        try:
+            futuros = {
+                ejecutor.submit(_asignar_pendientes, [lotes[i] for i in trozo], libro, entrada_profile, None, orden, motor): len(trozo)
+                for trozo in trozos
+            }
+            en_curso, hechos = set(futuros), 0
+            while en_curso:
+                _avisar(f"Asignación de lotes ({len(trozos)} procesos)", hechos, n_pendientes)
+                listos, en_curso = wait(en_curso, timeout=0.25, return_when=FIRST_COMPLETED)
+                for f in listos:
+                    res, sug = f.result()
+                    resultados.extend(res)
+                    sugerencias_por_lote.update(sug)
+                    hechos += futuros[f]
+        finally:
+            ejecutor.shutdown(wait=False, cancel_futures=True)
+        resultados.sort(key=lambda t: t[0])
+        # Los procesos trabajan sobre copias: se comprometen aquí las asignaciones en el libro
+        for pos, idx, entrada_sel, salida_sel in resultados:
+            if entrada_sel is not None:
+                libro.registrar(lotes[pos][2], entrada_sel, salida_sel, lotes[pos][3])
+    else:
+        resultados, sugerencias_por_lote = _asignar_pendientes(
+            lotes, libro, entrada_profile, avisar=lambda i: _avisar("Asignación de lotes", i, n_pendientes),
+            orden=orden, motor=motor
+        )
+        resultados.sort(key=lambda t: t[0])
+
+    for pos, idx, entrada_sel, salida_sel in resultados:
+        if entrada_sel is not None:
+            _asignar(filas_lotes[pos], entrada_sel, salida_sel)
+        else:
+            res_no_encaja[filas_lotes[pos]] = 1
+            sugerencias_rows.extend(sugerencias_por_lote.get(pos, []))
+
+    _avisar("Asignación de lotes", n_pendientes, n_pendientes)
+
+    # Volcado de todas las asignaciones (y DIAS_SAL, DIAS_ALMACENADOS, DIFERENCIA_DIAS_SAL)
+    _escribir_asignaciones(df_corr, res_asignada, res_entrada, res_salida, res_no_encaja)
+
+    cols_sug = [
+        "LOTE", "PRODUCTO", "UNDS", "DIA_RECEPCION",
+        "ENTRADA_PROPUESTA", "SALIDA_PROPUESTA", "INTENTO",
+        "DEFICIT_ENTRADA", "DEFICIT_ESTAB_MAX", "DEFICIT_SALIDA",
+        "MAX_DEFICIT", "TOTAL_DEFICIT","RECOMENDACION"
+    ]
+    df_sugerencias = pd.DataFrame(sugerencias_rows, columns=cols_sug) if sugerencias_rows else pd.DataFrame(columns=cols_sug)
+
+    if not df_sugerencias.empty:
+        df_sugerencias = df_sugerencias.sort_values(
+            by=["MAX_DEFICIT", "TOTAL_DEFICIT", "ENTRADA_PROPUESTA", "SALIDA_PROPUESTA", "LOTE"],
+            ascending=[True, True, True, True, True]
+        ).reset_index(drop=True)
+
+    return df_corr, df_sugerencias
+
+# -------------------------------
+# Varios sitios (líneas de salazón y cámaras de estabilización independientes)
+# -------------------------------
+COLUMNA_SITIO = "SITIO"
+SITIO_DEFECTO = "PRINCIPAL"          # lotes sin SITIO (o ficheros sin la columna)
+SITIO_CONSOLIDADO = "CONSOLIDADO"    # vista suma de todos los sitios
+PARAMETROS_SITIO = ("cap_ent", "cap_sal", "estab_cap", "cap_overrides_ent", "cap_overrides_sal", "estab_cap_overrides")
+
+def sitio_de_filas(df: pd.DataFrame) -> pd.Series:
+    """SITIO de cada fila como texto; sin columna SITIO o celda vacía → SITIO_DEFECTO."""
+    if COLUMNA_SITIO not in df.columns:
+        return pd.Series(SITIO_DEFECTO, index=df.index, dtype=object)
+    s = df[COLUMNA_SITIO].astype("string").str.strip()
+    return s.where(s.notna() & (s != ""), SITIO_DEFECTO).astype(object)
+
+def sitios_plan(df: pd.DataFrame) -> list:
+    """Sitios distintos del plan, ordenados."""
+    return sorted(sitio_de_filas(df).unique().tolist())
+
+def parametros_de_sitio(sitio, parametros_sitio=None, **comunes) -> dict:
+    """
+    Parámetros de capacidad de un sitio (claves de PARAMETROS_SITIO): los comunes con lo que defina
+    parametros_sitio[sitio] encima. Los overrides por fecha se combinan: los del sitio mandan sobre
+    los comunes en la misma fecha.
+    """
+    out = dict(comunes)
+    for clave, valor in ((parametros_sitio or {}).get(sitio) or {}).items():
+        if clave not in PARAMETROS_SITIO:
+            raise ValueError(f"Parámetro de sitio desconocido: {clave} (válidos: {PARAMETROS_SITIO})")
+        if "overrides" in clave:
+            out[clave] = {**(comunes.get(clave) or {}), **(valor or {})}
+        else:
+            out[clave] = valor
+    return out
+
+def _planificar_sitio(df_sitio, args, kwargs):
+    """Trabajo de un proceso: planificar_filas_na de las filas de un sitio."""
+    return planificar_filas_na(df_sitio, *args, **kwargs)
+
+def planificar_por_sitio(
+    df_plan,
+    dias_max_almacen_global,
+    dias_max_por_producto,
+    estab_cap,
+    cap_overrides_ent,
+    cap_overrides_sal,
+    estab_cap_overrides,
+    progreso=None,
+    cancelar=None,
+    *,
+    parametros_sitio=None,
+    cap_ent=CAP_ENT_DEFAULT,
+    cap_sal=CAP_SAL_DEFAULT,
+    procesos=None,
+    **kwargs
+):
+    """
+    planificar_filas_na con dimensión SITIO: cada sitio tiene sus propias capacidades de ENTRADA/
+    SALIDA, cámara y overrides (parametros_de_sitio sobre los comunes) y se planifica por separado.
+    Con varios sitios, procesos > 1 y al menos UMBRAL_PARALELO lotes pendientes, los sitios se
+    planifican a la vez en procesos (cada uno en secuencial dentro de su proceso); el resultado es
+    el mismo que sitio a sitio.
+    - parametros_sitio: {sitio: {cap_ent, cap_sal, estab_cap, cap_overrides_ent, ...}}; lo que falte
+      se toma de los parámetros comunes
+    - el resto de argumentos como en planificar_filas_na (salvo 'libro': hay un libro por sitio)
+    Devuelve el plan con las filas en el orden de df_plan y las sugerencias de todos los sitios
+    (columna SITIO). Con un único sitio equivale a planificar_filas_na con sus parámetros.
+    """
+    comunes = dict(
+        cap_ent=cap_ent, cap_sal=cap_sal, estab_cap=estab_cap,
+        cap_overrides_ent=cap_overrides_ent, cap_overrides_sal=cap_overrides_sal,
+        estab_cap_overrides=estab_cap_overrides,
+    )
+
+    def _trabajo(sitio, procesos_sitio):
+        p = parametros_de_sitio(sitio, parametros_sitio, **comunes)
+        args = (
+            dias_max_almacen_global, dias_max_por_producto, p["estab_cap"],
+            p["cap_overrides_ent"], p["cap_overrides_sal"], p["estab_cap_overrides"],
+        )
+        return args, dict(kwargs, cap_ent=p["cap_ent"], cap_sal=p["cap_sal"], procesos=procesos_sitio)
+
+    sitio = sitio_de_filas(df_plan)
+    sitios = sorted(sitio.unique().tolist())
+    if len(sitios) <= 1:
+        unico = sitios[0] if sitios else SITIO_DEFECTO
+        args, kw = _trabajo(unico, procesos)
+        df_out, df_sug = planificar_filas_na(df_plan, *args, progreso, cancelar, **kw)
+        if COLUMNA_SITIO in df_plan.columns:
+            df_sug.insert(0, COLUMNA_SITIO, unico)
+        return df_out, df_sug
+
+    def _avisar(fase, hechos, total):
+        if cancelar is not None and cancelar.is_set():
+            raise PlanificacionCancelada()
+        if progreso is not None:
+            progreso(fase, hechos, total)
+
+    if procesos is None:
+        procesos = os.cpu_count() or 1
+    sitio = sitio.to_numpy()
+    filas = {s: np.flatnonzero(sitio == s) for s in sitios}
+    resultados = {}
+    if procesos > 1 and df_plan["ENTRADA_SAL"].isna().sum() >= UMBRAL_PARALELO:
+        n_procesos = min(procesos, len(sitios))
+        ejecutor = ProcessPoolExecutor(max_workers=n_procesos, mp_context=multiprocessing.get_context("spawn"))
+        try:
+            futuros = {
+                ejecutor.submit(_planificar_sitio, df_plan.iloc[filas[s]], *_trabajo(s, 1)): s
+                for s in sitios
+            }
+            en_curso = set(futuros)
+            while en_curso:
+                _avisar(f"Planificación por sitio ({n_procesos} procesos)", len(resultados), len(sitios))
+                listos, en_curso = wait(en_curso, timeout=0.25, return_when=FIRST_COMPLETED)
+                for f in listos:
+                    resultados[futuros[f]] = f.result()
+        finally:
+            ejecutor.shutdown(wait=False, cancel_futures=True)
+    else:
+        for i, s in enumerate(sitios):
+            _avisar("Planificación por sitio", i, len(sitios))
+            args, kw = _trabajo(s, 1)
+            resultados[s] = planificar_filas_na(
+                df_plan.iloc[filas[s]], *args,
+                lambda fase, hechos, total, s=s: _avisar(f"{s} · {fase}", hechos, total), cancelar, **kw
+            )
+    _avisar("Planificación por sitio", len(sitios), len(sitios))
+
+    # Se recompone el orden de filas original a partir de las posiciones de cada sitio
+    orden = np.argsort(np.concatenate([filas[s] for s in sitios]), kind="stable")
+    df_out = pd.concat([resultados[s][0] for s in sitios]).iloc[orden]
+
+    sugerencias = [resultados[s][1].assign(**{COLUMNA_SITIO: s}) for s in sitios if not resultados[s][1].empty]
+    if sugerencias:
+        df_sug = pd.concat(sugerencias, ignore_index=True).sort_values(
+            by=["MAX_DEFICIT", "TOTAL_DEFICIT", "ENTRADA_PROPUESTA", "SALIDA_PROPUESTA", "LOTE"], kind="stable"
+        ).reset_index(drop=True)
+    else:
+        df_sug = resultados[sitios[0]][1].assign(**{COLUMNA_SITIO: pd.Series(dtype=object)})
+    df_sug.insert(0, COLUMNA_SITIO, df_sug.pop(COLUMNA_SITIO))
+    return df_out, df_sug
+
+def _por_sitio(df_plan: pd.DataFrame):
+    """(sitio, filas del sitio) para cada sitio del plan."""
+    sitio = sitio_de_filas(df_plan)
+    return [(s, df_plan[sitio == s]) for s in sorted(sitio.unique().tolist())]
+
+def estabilizacion_por_sitio(df_plan: pd.DataFrame, estab_cap: int, estab_cap_overrides: dict | None = None,
+                             parametros_sitio=None, familias=None) -> dict:
+    """
+    calcular_estabilizacion_diaria de cada sitio con su cámara y la vista consolidada
+    (clave SITIO_CONSOLIDADO): unidades y capacidad sumadas de todas las cámaras por fecha, y EXCESO
+    como suma de los excesos de cada cámara (no se compensa el hueco de una con el exceso de otra).
+    """
+    out, capacidades = {}, []
+    for sitio, df_sitio in _por_sitio(df_plan):
+        p = parametros_de_sitio(sitio, parametros_sitio, estab_cap=estab_cap, estab_cap_overrides=estab_cap_overrides)
+        out[sitio] = calcular_estabilizacion_diaria(df_sitio, p["estab_cap"], p["estab_cap_overrides"], familias)
+        capacidades.append((p["estab_cap"], p["estab_cap_overrides"]))
+
+    partes = [df for df in out.values() if not df.empty]
+    if not partes:
+        out[SITIO_CONSOLIDADO] = calcular_estabilizacion_diaria(df_plan.iloc[:0], estab_cap, familias=familias)
+        return out
+    cols_unds = [c for c in partes[0].columns if c.startswith("ESTAB_")]
+    cons = pd.concat(partes).groupby("FECHA", as_index=False)[cols_unds + ["EXCESO"]].sum()
+    # La capacidad consolidada suma todas las cámaras, también las que ese día están vacías
+    cons.insert(len(cols_unds) + 1, "CAPACIDAD", sum(_capacidad_estab(cons["FECHA"], c, o) for c, o in capacidades))
+    cons.insert(len(cols_unds) + 2, "UTIL_%", (cons["ESTAB_UNDS"] / cons["CAPACIDAD"] * 100).round(1))
+    out[SITIO_CONSOLIDADO] = cons
+    return out
+
+def ocupacion_por_sitio(df_plan: pd.DataFrame, desde, hasta, parametros_sitio=None, **comunes) -> dict:
+    """
+    LibroCargas.ocupacion de cada sitio (parametros_de_sitio sobre 'comunes', que también admite el
+    calendario: dias_festivos, ajuste_finde, ajuste_festivos) y la consolidada (SITIO_CONSOLIDADO):
+    suma por día de cargas, capacidades y holguras de todos los sitios.
+    """
+    calendario = {k: comunes.pop(k) for k in ("dias_festivos", "ajuste_finde", "ajuste_festivos") if k in comunes}
+    out = {}
+    for sitio, df_sitio in _por_sitio(df_plan):
+        p = parametros_de_sitio(sitio, parametros_sitio, **comunes)
+        out[sitio] = LibroCargas(**p, **calendario).cargar_plan(df_sitio).ocupacion(desde, hasta)
+    if out:
+        partes = list(out.values())
+        cons = partes[0].copy()
+        columnas = cons.columns.drop("FECHA")
+        cons[columnas] = sum(df[columnas] for df in partes)
+        out[SITIO_CONSOLIDADO] = cons
+    return out
+
+class LineaHolguraSitios:
+    """
+    Una LineaHolgura por sitio ({sitio: LibroCargas}) detrás de la misma interfaz que LineaHolgura:
+    sincronizar y holgura_filas reparten las filas por SITIO. Filas de un sitio sin libro → NA.
+    """
+
+    def __init__(self, libros: dict, df_plan: pd.DataFrame):
+        sitio = sitio_de_filas(df_plan)
+        self.lineas = {s: LineaHolgura(libro, df_plan[sitio == s]) for s, libro in libros.items()}
+
+    def sincronizar(self, df_plan: pd.DataFrame) -> pd.DataFrame:
+        sitio = sitio_de_filas(df_plan)
+        entran = [linea.sincronizar(df_plan[sitio == s]) for s, linea in self.lineas.items()]
+        return pd.concat(entran) if entran else df_plan.iloc[:0]
+
+    def holgura_filas(self, df: pd.DataFrame) -> pd.DataFrame:
+        sitio = sitio_de_filas(df)
+        partes = [linea.holgura_filas(df[sitio == s]) for s, linea in self.lineas.items()]
+        return pd.concat(partes).reindex(df.index)
+
+def cubo_cargas_por_sitio(df_plan: pd.DataFrame, libros: dict, familias=None) -> pd.DataFrame:
+    """cubo_cargas de cada sitio con su libro ({sitio: LibroCargas}), apilados con la columna SITIO delante."""
+    cubos = []
+    for sitio, df_sitio in _por_sitio(df_plan):
+        cubo = cubo_cargas(df_sitio, libros[sitio], familias)
+        cubo.insert(0, COLUMNA_SITIO, sitio)
+        cubos.append(cubo)
+    cubo = pd.concat(cubos, ignore_index=True)
+    cubo[COLUMNA_SITIO] = cubo[COLUMNA_SITIO].astype("category")
+    return cubo
+
+# -------------------------------
+# Mejora por búsqueda local (tras el plan voraz)
+# -------------------------------
+def mejorar_plan(
+    df_plan,
+    dias_max_almacen_global,
+    dias_max_por_producto,
+    estab_cap,
+    cap_overrides_ent,
+    cap_overrides_sal,
+    estab_cap_overrides,
+    modificables=None,
+    presupuesto_s=5.0,
+    profundidad=2,
+    progreso=None,
+    cancelar=None,
+    *,
+    cap_ent=CAP_ENT_DEFAULT,
+    cap_sal=CAP_SAL_DEFAULT,
+    dias_festivos=DIAS_FESTIVOS_DEFAULT,
+    ajuste_finde=True,
+    ajuste_festivos=True
+):
+    """
+    Mejora un plan ya calculado con búsqueda local limitada en tiempo (presupuesto_s segundos).
+    Objetivo lexicográfico: (1) lotes que no encajan, (2) mezcla de TIPO/NITRIF por día de entrada,
+    (3) suma de |DIFERENCIA_DIAS_SAL|.
+    Vecindarios: mover un lote a otro día de entrada, intercambiar los días de dos lotes y cadenas de
+    expulsión (sacar hasta 'profundidad' lotes ya asignados para hacer hueco a uno que no encaja).
+    Las capacidades se comprueban contra el 2º intento (el límite duro del planificador).
+    Solo se tocan las filas de 'modificables' (etiquetas de índice; None = todas). Los lotes de las
+    reglas de entrada común (CODIGOS_ENTRADA_COMUN), asignados o no, quedan fuera de los vecindarios:
+    moverlos uno a uno separaría el grupo de su día de entrada compartido.
+    Devuelve (df_mejorado, resumen).
+    """
+    inicio = time.monotonic()
+    limite = inicio + float(presupuesto_s)
+
+    def _tiempo_agotado():
+        if cancelar is not None and cancelar.is_set():
+            raise PlanificacionCancelada()
+        return time.monotonic() >= limite
+
+    df = df_plan.copy(deep=False)
+    if "LOTE_NO_ENCAJA" in df.columns:
+        df["LOTE_NO_ENCAJA"] = no_encaja_a_bool(df["LOTE_NO_ENCAJA"])
+    libro = LibroCargas(
+        cap_ent, cap_sal, estab_cap,
+        cap_overrides_ent, cap_overrides_sal, estab_cap_overrides,
+        dias_festivos, ajuste_finde, ajuste_festivos
+    ).cargar_plan(df)
+
+    n = len(df)
+    dia = df["DIA"].tolist()
+    unds = pd.to_numeric(df["UNDS"], errors="coerce").fillna(0).astype(int).tolist()
+    dso = pd.to_numeric(df["DIAS_SAL_OPTIMOS"], errors="coerce").tolist() if "DIAS_SAL_OPTIMOS" in df.columns else [None] * n
+    prods = df["PRODUCTO"].astype(str).tolist() if "PRODUCTO" in df.columns else [""] * n
+    tipos = [_norm_tipo(v) for v in df["TIPO NITRIF"]] if "TIPO NITRIF" in df.columns else ["OTRO"] * n
+    nitrifs = [_norm_nitrif(v) for v in df["NITRIF"]] if "NITRIF" in df.columns else [None] * n
+    entrada = [e if pd.notna(e) else None for e in df["ENTRADA_SAL"]]
+    salida = [s if pd.notna(s) else None for s in df["SALIDA_SAL"]]
+    entrada_orig, salida_orig = list(entrada), list(salida)
+
+    permitidas = set(df.index) if modificables is None else set(modificables)
+    movible = [
+        (idx in permitidas) and pd.notna(dia[k]) and pd.notna(dso[k]) and unds[k] > 0
+        and prods[k] not in CODIGOS_ENTRADA_COMUN
+        for k, idx in enumerate(df.index)
+    ]
+
+    # Días de entrada candidatos por lote (hábiles dentro del límite de almacenamiento)
+    _candidatos = {}
+    def candidatos(k):
+        if k not in _candidatos:
+            dmax = dias_max_por_producto.get(prods[k], dias_max_almacen_global)
+            e = dia[k] if libro.es_habil(dia[k]) else libro.siguiente_habil(dia[k])
+            lista = []
+            while (e - dia[k]).days <= dmax:
+                lista.append(e)
+                e = libro.siguiente_habil(e)
+            _candidatos[k] = lista
+        return _candidatos[k]
+
+    # Perfil TIPO/NITRIF por día de entrada y términos del objetivo
+    perfil = {}
+    def _mezcla(d):
+        p = perfil.get(d)
+        if p is None:
+            return 0
+        return max(0, len(p["tipo"]) - 1) + max(0, len(p["nitrif"]) - 1)
+
+    def _perfil_sumar(k, d, signo):
+        p = perfil.setdefault(d, {"tipo": Counter(), "nitrif": Counter()})
+        p["tipo"][tipos[k]] += signo
+        if p["tipo"][tipos[k]] <= 0:
+            del p["tipo"][tipos[k]]
+        if nitrifs[k] is not None:
+            p["nitrif"][nitrifs[k]] += signo
+            if p["nitrif"][nitrifs[k]] <= 0:
+                del p["nitrif"][nitrifs[k]]
+
+    def _desv(k):
+        if entrada[k] is None or pd.isna(dso[k]):
+            return 0
+        return abs((salida[k] - entrada[k]).days - int(dso[k]))
+
+    for k in range(n):
+        if entrada[k] is not None:
+            _perfil_sumar(k, entrada[k].normalize(), +1)
+    obj = {
+        "no_encaja": sum(1 for k in range(n) if movible[k] and entrada[k] is None),
+        "mezcla": sum(_mezcla(d) for d in perfil),
+        "desviacion": sum(_desv(k) for k in range(n)),
+    }
+    def _objetivo():
+        return (obj["no_encaja"], obj["mezcla"], obj["desviacion"])
+    obj_inicial = _objetivo()
+
+    # Índices por día para localizar bloqueadores
+    por_entrada, por_salida = {}, {}
+    for k in range(n):
+        if entrada[k] is not None:
+            por_entrada.setdefault(entrada[k], set()).add(k)
+            por_salida.setdefault(salida[k], set()).add(k)
+
+    def _quitar(k):
+        e, s = entrada[k], salida[k]
+        d = e.normalize()
+        antes = _mezcla(d)
+        obj["desviacion"] -= _desv(k)
+        libro.retirar(dia[k], e, s, unds[k])
+        _perfil_sumar(k, d, -1)
+        obj["mezcla"] += _mezcla(d) - antes
+        por_entrada[e].discard(k)
+        por_salida[s].discard(k)
+        entrada[k], salida[k] = None, None
+        if movible[k]:
+            obj["no_encaja"] += 1
+        return e, s
+
+    def _poner(k, e, s):
+        d = e.normalize()
+        antes = _mezcla(d)
+        libro.registrar(dia[k], e, s, unds[k])
+        _perfil_sumar(k, d, +1)
+        obj["mezcla"] += _mezcla(d) - antes
+        entrada[k], salida[k] = e, s
+        obj["desviacion"] += _desv(k)
+        por_entrada.setdefault(e, set()).add(k)
+        por_salida.setdefault(s, set()).add(k)
+        if movible[k]:
+            obj["no_encaja"] -= 1
+
+    def _cabe(k, e):
+        """SALIDA resultante si el lote k cabe entrando el día e (2º intento), o None."""
+        u = unds[k]
+        if libro.carga_entrada.get(e, 0) + u > libro.get_cap_ent(e, 2):
+            return None
+        if not libro.cabe_en_estab_rango(dia[k], e - pd.Timedelta(days=1), u):
+            return None
+        s = libro.salida_ajustada(e, dso[k])
+        if libro.carga_salida.get(s, 0) + u > libro.get_cap_sal(s, 2):
+            return None
+        return s
+
+    # Lotes movibles por día de recepción y estancia máxima (días de DIA a ENTRADA) que pueden tener:
+    # un lote que comparte estabilización con k se recibió como mucho 'alcance' días antes que k
+    por_dia = {}
+    alcance = 0
+    for k in range(n):
+        if movible[k]:
+            por_dia.setdefault(dia[k].normalize(), []).append(k)
+            dmax = dias_max_por_producto.get(prods[k], dias_max_almacen_global)
+            alcance = max(alcance, _dias_max_entero(dmax))
+            if entrada[k] is not None:
+                alcance = max(alcance, (entrada[k] - dia[k]).days)
+
+    def _bloqueadores(k, e, limite_n=8):
+        """Lotes movibles asignados que compiten con k entrando el día e (entrada, salida o estabilización)."""
+        s = libro.salida_ajustada(e, dso[k])
+        fin_estab = e - pd.Timedelta(days=1)
+        cand = set(por_entrada.get(e, ())) | set(por_salida.get(s, ()))
+        if fin_estab.date() >= dia[k].date():
+            desde = dia[k].normalize() - pd.Timedelta(days=alcance + 1)
+            for d in pd.date_range(desde, fin_estab.normalize(), freq="D"):
+                for j in por_dia.get(d, ()):
+                    if entrada[j] is not None and dia[j] <= fin_estab and entrada[j] > dia[k]:
+                        cand.add(j)
+        cand = [j for j in cand if movible[j] and j != k]
+        cand.sort(key=lambda j: (-unds[j], j))
+        return cand[:limite_n]
+
+    def _colocar(k, nivel, prohibidos):
+        """Intenta colocar el lote k (sin asignar), expulsando y recolocando hasta 'nivel' lotes."""
+        for e in candidatos(k):
+            s = _cabe(k, e)
+            if s is not None:
+                _poner(k, e, s)
+                return True
+        if nivel == 0:
+            return False
+        for e in candidatos(k):
+            for j in _bloqueadores(k, e):
+                if j in prohibidos or _tiempo_agotado():
+                    continue
+                ej, sj = _quitar(j)
+                s = _cabe(k, e)
+                if s is not None:
+                    _poner(k, e, s)
+                    if _colocar(j, nivel - 1, prohibidos | {k, j}):
+                        return True
+                    _quitar(k)
+                _poner(j, ej, sj)
+        return False
+
+    def _mejor_movimiento(k):
+        """Mueve el lote asignado k al día candidato que más mejora el objetivo (si alguno mejora)."""
+        e0, s0 = entrada[k], salida[k]
+        mejor, mejor_obj = None, _objetivo()
+        _quitar(k)
+        for e in candidatos(k):
+            if e == e0:
+                continue
+            s = _cabe(k, e)
+            if s is None:
+                continue
+            _poner(k, e, s)
+            if _objetivo() < mejor_obj:
+                mejor, mejor_obj = (e, s), _objetivo()
+            _quitar(k)
+        _poner(k, *(mejor or (e0, s0)))
+        return mejor is not None
+
+    def _intercambio(a, b):
+        """Intercambia los días de entrada de a y b si ambos caben y el objetivo mejora."""
+        ea, eb = entrada[a], entrada[b]
+        if ea == eb or eb not in candidatos(a) or ea not in candidatos(b):
+            return False
+        antes = _objetivo()
+        sa0, sb0 = salida[a], salida[b]
+        _quitar(a)
+        _quitar(b)
+        sa = _cabe(a, eb)
+        if sa is not None:
+            _poner(a, eb, sa)
+            sb = _cabe(b, ea)
+            if sb is not None:
+                _poner(b, ea, sb)
+                if _objetivo() < antes:
+                    return True
+                _quitar(b)
+            _quitar(a)
+        _poner(a, ea, sa0)
+        _poner(b, eb, sb0)
+        return False
+
+    movimientos = 0
+    hubo_mejora = True
+    while hubo_mejora and not _tiempo_agotado():
+        hubo_mejora = False
+        # 1) Reducir lotes que no encajan (colocación directa o cadena de expulsión)
+        for k in range(n):
+            if _tiempo_agotado():
+                break
+            if movible[k] and entrada[k] is None and _colocar(k, profundidad, frozenset({k})):
+                movimientos += 1
+                hubo_mejora = True
+        # 2) Reducir mezcla y desviación moviendo lotes asignados
+        for k in range(n):
+            if _tiempo_agotado():
+                break
+            if movible[k] and entrada[k] is not None and _mejor_movimiento(k):
+                movimientos += 1
+                hubo_mejora = True
+        # 3) Intercambios entre lotes con TIPO/NITRIF distinto al de su día
+        for a in range(n):
+            if _tiempo_agotado():
+                break
+            if not (movible[a] and entrada[a] is not None) or _mezcla(entrada[a].normalize()) == 0:
+                continue
+            for e in candidatos(a):
+                for b in list(por_entrada.get(e, ())):
+                    if movible[b] and b != a and entrada[a] is not None and _intercambio(a, b):
+                        movimientos += 1
+                        hubo_mejora = True
+                        break
+        if progreso is not None:
+            progreso("Búsqueda local", int(time.monotonic() - inicio), int(presupuesto_s))
+
+    # Volcado de los lotes que han cambiado, por posición (el índice puede tener etiquetas repetidas)
+    cambiados = [k for k in range(n) if entrada[k] != entrada_orig[k] or salida[k] != salida_orig[k]]
+    if cambiados:
+        ent = pd.Series([entrada[k] for k in cambiados], dtype="datetime64[ns]")
+        sal = pd.Series([salida[k] for k in cambiados], dtype="datetime64[ns]")
+        valores = {
+            "ENTRADA_SAL": ent,
+            "SALIDA_SAL": sal,
+            "DIAS_SAL": (sal - ent).dt.days.astype("Int64"),
+            "DIAS_ALMACENADOS": (ent - pd.Series([dia[k] for k in cambiados])).dt.days.astype("Int64"),
+            "LOTE_NO_ENCAJA": ent.isna().astype("boolean"),
+        }
+        for col, v in valores.items():
+            if col not in df.columns:
+                df[col] = pd.Series(pd.NA, index=df.index, dtype=v.dtype)
+            df.iloc[cambiados, df.columns.get_loc(col)] = v.to_numpy()
+        if "DIAS_SAL_OPTIMOS" in df.columns:
+            df["DIFERENCIA_DIAS_SAL"] = df["DIAS_SAL"] - df["DIAS_SAL_OPTIMOS"]
+
+    resumen = {
+        "objetivo_inicial": obj_inicial,
+        "objetivo_final": _objetivo(),
+        "lotes_cambiados": len(cambiados),
+        "movimientos": movimientos,
+        "segundos": round(time.monotonic() - inicio, 2),
+    }
+    return df, resumen
+
+# -------------------------------
+# Ampliación mínima conjunta de capacidad (todos los lotes pendientes a la vez)
+# -------------------------------
+RECURSOS = ("ENTRADA", "SALIDA", "ESTABILIZACION")
+
+def analizar_ampliacion_capacidad(
+    df_plan,
+    dias_max_almacen_global,
+    dias_max_por_producto,
+    estab_cap,
+    cap_overrides_ent,
+    cap_overrides_sal,
+    estab_cap_overrides,
+    *,
+    cap_ent=CAP_ENT_DEFAULT,
+    cap_sal=CAP_SAL_DEFAULT,
+    dias_festivos=DIAS_FESTIVOS_DEFAULT,
+    ajuste_finde=True,
+    ajuste_festivos=True
+):
+    """
+    Calcula las ampliaciones por fecha de ENTRADA, SALIDA y ESTABILIZACIÓN que hacen que TODOS los
+    lotes pendientes (sin ENTRADA_SAL) quepan a la vez, sobre las cargas ya planificadas.
+
+    Núcleo de factibilidad: colocación voraz de los pendientes (primero los de menos días candidatos,
+    luego los de más unidades) con capacidad = 2º intento + holgura uniforme por recurso, sobre el
+    núcleo por días enteros (_nucleo_asignacion). Se busca por bisección la holgura común y después,
+    recurso a recurso, la de cada uno. Las ampliaciones por fecha salen de UNA asignación conjunta,
+    así que no se cuentan dos veces.
+    El voraz no es monótono en la holgura (más capacidad puede cambiar un día elegido y dejar sin
+    sitio a un lote posterior): la holgura devuelta siempre es factible, pero es una cota superior
+    heurística, no necesariamente el mínimo de ampliaciones.
+
+    Devuelve un dict con:
+      - "ampliaciones": FECHA, RECURSO, CAPACIDAD_ACTUAL, AMPLIACION, CAPACIDAD_NECESARIA
+      - "overrides_ent" / "overrides_sal": FECHA, CAP1, CAP2 (formato de las tablas de overrides)
+      - "overrides_estab": FECHA, CAP
+      - "holgura": {recurso: holgura uniforme mínima encontrada}
+      - "asignacion": LOTE, ENTRADA_SAL, SALIDA_SAL propuestas para los pendientes
+      - "imposibles": lotes sin ningún día de entrada candidato (no se arreglan con capacidad)
+    """
+    libro = LibroCargas(
+        cap_ent, cap_sal, estab_cap,
+        cap_overrides_ent, cap_overrides_sal, estab_cap_overrides,
+        dias_festivos, ajuste_finde, ajuste_festivos
+    ).cargar_plan(df_plan)
+
+    pend = df_plan[df_plan["ENTRADA_SAL"].isna() & df_plan["DIA"].notna()]
+    if "DIAS_SAL_OPTIMOS" in pend.columns:
+        pend = pend[pend["DIAS_SAL_OPTIMOS"].notna()]
+    lotes, imposibles = [], []
+    for idx, r in pend.iterrows():
+        prod = r.get("PRODUCTO", None)
+        dmax = dias_max_por_producto.get(prod, dias_max_almacen_global)
+        dia = r["DIA"]
+        e = dia if libro.es_habil(dia) else libro.siguiente_habil(dia)
+        cands = []
+        while (e - dia).days <= dmax:
+            cands.append(e)
+            e = libro.siguiente_habil(e)
+        lote = {"LOTE": r.get("LOTE", idx), "DIA": dia, "UNDS": int(r["UNDS"]),
+                "DSO": int(r["DIAS_SAL_OPTIMOS"]), "CANDIDATOS": cands}
+        (lotes if cands else imposibles).append(lote)
+    # Los más restringidos primero
+    lotes.sort(key=lambda l: (len(l["CANDIDATOS"]), -l["UNDS"]))
+
+    def _colocar_libro(h_ent, h_sal, h_est):
+        """Asignación voraz con capacidades ampliadas sobre el libro (fechas con hora); None si algún lote no cabe."""
+        prueba = libro.copia()
+        asignacion = []
+        for l in lotes:
+            u, dia = l["UNDS"], l["DIA"]
+            elegido = None
+            for e in l["CANDIDATOS"]:
+                if prueba.carga_entrada.get(e, 0) + u > prueba.get_cap_ent(e, 2) + h_ent:
+                    continue
+                if e.date() > dia.date() and any(
+                    prueba.estab_stock.get(d, 0) + u > prueba.get_estab_cap(d) + h_est
+                    for d in pd.date_range(dia.normalize(), (e - pd.Timedelta(days=1)).normalize(), freq="D")
+                ):
+                    continue
+                s = prueba.salida_ajustada(e, l["DSO"])
+                if prueba.carga_salida.get(s, 0) + u > prueba.get_cap_sal(s, 2) + h_sal:
+                    continue
+                elegido = (e, s)
+                break
+            if elegido is None:
+                return None
+            prueba.registrar(dia, elegido[0], elegido[1], u)
+            asignacion.append(elegido)
+        return asignacion
+
+    # Mismo voraz en el núcleo por días enteros: todos los lotes del mismo tipo y sin NITRIF (sin coste
+    # de mezcla, gana la primera entrada que cabe) y 1º intento = 2º intento = capacidad + holgura
+    medianoche = lambda f: f == f.normalize()
+    cal = None
+    if lotes and all(medianoche(l["DIA"]) for l in lotes) and all(
+        medianoche(f) for dic in (libro.carga_entrada, libro.carga_salida, libro.estab_stock) for f in dic
+    ):
+        origen = min(l["DIA"] for l in lotes) - pd.Timedelta(days=7)
+        fin_bruto = max(l["CANDIDATOS"][-1] + pd.Timedelta(days=l["DSO"]) for l in lotes) + pd.Timedelta(days=7)
+        cal = _calendario_entero(libro, origen, fin_bruto)
+        n, horizonte = len(lotes), len(cal["fechas"])
+        dia_k = np.array([(l["DIA"] - origen).days for l in lotes], dtype=np.int64)
+        dmax_k = np.array([(l["CANDIDATOS"][-1].normalize() - l["DIA"]).days for l in lotes], dtype=np.int64)
+        ancho = int(dmax_k.max()) + 1
+        fijos = [
+            dia_k, np.array([l["UNDS"] for l in lotes], dtype=np.int64),
+            np.array([l["DSO"] for l in lotes], dtype=np.int64), dmax_k,
+            np.zeros(n, dtype=np.int64), np.full(n, -1, dtype=np.int64),
+            cal["habil"], cal["sal_fija"], cal["sal_ant"], cal["sal_sig"],
+        ]
+
+    def _colocar_nucleo(h_ent, h_sal, h_est):
+        """Como _colocar_libro con el núcleo; None si algún lote no cabe."""
+        cap_ent = cal["cap_ent2"] + h_ent
+        cap_sal = cal["cap_sal2"] + h_sal
+        args = fijos + [
+            cap_ent, cap_ent, cap_sal, cap_sal, cal["cap_estab"] + h_est,
+            cal["carga_ent"].copy(), cal["carga_sal"].copy(), cal["estab"].copy(),
+            np.zeros(horizonte, dtype=np.int64), 1, np.zeros(horizonte, dtype=np.int64), 1,
+            np.zeros(horizonte, dtype=np.int64), np.zeros(horizonte, dtype=np.int64),
+            np.empty(n, dtype=np.int64), np.empty(n, dtype=np.int64),
+            ancho, np.zeros(n, dtype=np.int64),
+            *[np.zeros(n * ancho, dtype=np.int64) for _ in range(8)],
+            *[np.zeros(n * ancho * 3, dtype=np.int64) for _ in range(2)],
+        ]
+        args = _ejecutar_nucleo(args)
+        ent_out, sal_out = args[24], args[25]
+        if (ent_out < 0).any():
+            return None
+        return [(cal["fechas"][e], cal["fechas"][s]) for e, s in zip(ent_out, sal_out)]
+
+    _colocar_todos = _colocar_nucleo if cal is not None else _colocar_libro
+
+    def _biseccion(factible, alto):
+        """
+        Menor h >= 0 con factible(h). Si 'alto' no es factible (cargas ya planificadas por encima
+        de la capacidad en los días candidatos) se duplica hasta que lo sea antes de bisecar.
+        """
+        bajo = 0
+        if factible(0):
+            return 0
+        while not factible(alto):
+            bajo, alto = alto, 2 * alto
+        while alto - bajo > 1:
+            medio = (bajo + alto) // 2
+            if factible(medio):
+                alto = medio
+            else:
+                bajo = medio
+        return alto
+
+    total = sum(l["UNDS"] for l in lotes)
+    # Punto de partida: el total de unidades pendientes (basta si no hay días ya sobrecargados)
+    h = _biseccion(lambda x: _colocar_todos(x, x, x) is not None, max(total, 1))
+    holgura = [h, h, h]
+    for i in range(3):
+        def _factible(x, i=i):
+            prueba = list(holgura)
+            prueba[i] = x
+            return _colocar_todos(*prueba) is not None
+        holgura[i] = _biseccion(_factible, holgura[i]) if holgura[i] > 0 else 0
+
+    # Cargas finales: el libro con la asignación conjunta de la holgura encontrada
+    final = libro.copia()
+    asignacion = []
+    for l, (e, s) in zip(lotes, _colocar_todos(*holgura) if lotes else []):
+        final.registrar(l["DIA"], e, s, l["UNDS"])
+        asignacion.append((l["LOTE"], e, s))
+
+    filas = []
+    def _ampliar(recurso, fecha, carga, cap_actual):
+        if carga > cap_actual:
+            filas.append({
+                "FECHA": pd.Timestamp(fecha).normalize(), "RECURSO": recurso,
+                "CAPACIDAD_ACTUAL": int(cap_actual), "AMPLIACION": int(carga - cap_actual),
+                "CAPACIDAD_NECESARIA": int(carga),
+            })
+    for fecha, carga in final.carga_entrada.items():
+        _ampliar("ENTRADA", fecha, carga, final.get_cap_ent(fecha, 2))
+    for fecha, carga in final.carga_salida.items():
+        _ampliar("SALIDA", fecha, carga, final.get_cap_sal(fecha, 2))
+    for fecha, carga in final.estab_stock.items():
+        _ampliar("ESTABILIZACION", fecha, carga, final.get_estab_cap(fecha))
+    cols = ["FECHA", "RECURSO", "CAPACIDAD_ACTUAL", "AMPLIACION", "CAPACIDAD_NECESARIA"]
+    df_amp = pd.DataFrame(filas, columns=cols).sort_values(["FECHA", "RECURSO"], kind="stable").reset_index(drop=True)
+
+    def _overrides_cap(recurso, get_cap):
+        sub = df_amp[df_amp["RECURSO"] == recurso]
+        return pd.DataFrame({
+            "FECHA": sub["FECHA"].to_numpy(),
+            "CAP1": pd.array([get_cap(f, 1) for f in sub["FECHA"]], dtype="Int64"),
+            "CAP2": pd.array(sub["CAPACIDAD_NECESARIA"].to_numpy(), dtype="Int64"),
+        })
+    sub_est = df_amp[df_amp["RECURSO"] == "ESTABILIZACION"]
+
+    return {
+        "ampliaciones": df_amp,
+        "overrides_ent": _overrides_cap("ENTRADA", final.get_cap_ent),
+        "overrides_sal": _overrides_cap("SALIDA", final.get_cap_sal),
+        "overrides_estab": pd.DataFrame({
+            "FECHA": sub_est["FECHA"].to_numpy(),
+            "CAP": pd.array(sub_est["CAPACIDAD_NECESARIA"].to_numpy(), dtype="Int64"),
+        }),
+        "holgura": dict(zip(RECURSOS, holgura)),
+        "asignacion": pd.DataFrame(asignacion, columns=["LOTE", "ENTRADA_SAL", "SALIDA_SAL"]),
+        "imposibles": pd.DataFrame(
+            [{"LOTE": l["LOTE"], "DIA": l["DIA"], "UNDS": l["UNDS"]} for l in imposibles],
+            columns=["LOTE", "DIA", "UNDS"]
+        ),
+    }
+
+# -------------------------------
+# Diferencias entre dos versiones del plan (vectorizado, por LOTE)
+# -------------------------------
+CAMBIOS_LOTE = ["Nuevo", "Eliminado", "Ahora encaja", "Ya no encaja", "Movido"]
+
+def _cargas_diarias(df: pd.DataFrame, origen, n_dias: int) -> dict:
+    """
+    Cargas por día (posición = días desde 'origen') de ENTRADA, SALIDA y ESTABILIZACIÓN, con numpy:
+    bincount para entrada/salida y diferencias acumuladas para los rangos [DIA, ENTRADA-1].
+    """
+    unds = pd.to_numeric(df["UNDS"], errors="coerce").fillna(0).to_numpy(dtype="int64")
+    def _pos(col):
+        if col not in df.columns:
+            return np.full(len(df), -1, dtype="int64")
+        f = pd.to_datetime(df[col], errors="coerce").dt.normalize()
+        return ((f - origen).dt.days).fillna(-1).to_numpy(dtype="int64")
+    p_dia, p_ent, p_sal = _pos("DIA"), _pos("ENTRADA_SAL"), _pos("SALIDA_SAL")
+
+    def _suma(p):
+        ok = p >= 0
+        return np.bincount(p[ok], weights=unds[ok], minlength=n_dias)[:n_dias].astype("int64")
+
+    ok = (p_dia >= 0) & (p_ent > p_dia)
+    delta = np.zeros(n_dias + 1, dtype="int64")
+    np.add.at(delta, p_dia[ok], unds[ok])
+    np.add.at(delta, p_ent[ok], -unds[ok])
+    return {"ENTRADA": _suma(p_ent), "SALIDA": _suma(p_sal), "ESTAB": np.cumsum(delta)[:n_dias]}
+
+def comparar_planes(df_antes: pd.DataFrame, df_despues: pd.DataFrame) -> dict:
+    """
+    Compara dos versiones del plan uniendo por LOTE (si un LOTE se repite, por LOTE + nº de aparición).
+    Devuelve un dict con:
+      - "lotes": un registro por lote con cambios (CAMBIO en CAMBIOS_LOTE, fechas antes/después y
+        desplazamiento en días de ENTRADA y SALIDA)
+      - "cargas": por FECHA, carga antes/después/delta de ENTRADA, SALIDA y ESTAB (solo días con cambios)
+      - "resumen": nº de lotes por tipo de cambio
+    """
+    cols = ["LOTE", "PRODUCTO", "DIA", "UNDS", "ENTRADA_SAL", "SALIDA_SAL"]
+    def _preparar(df):
+        sub = df[[c for c in cols if c in df.columns]]
+        lote = sub["LOTE"].astype("string") if "LOTE" in sub.columns else pd.Series(
+            df.index.astype(str), index=df.index, dtype="string")
+        n = 0 if lote.is_unique else lote.groupby(lote, dropna=False).cumcount()
+        sub = sub.assign(LOTE=lote, _N=n)
+        for c in ("ENTRADA_SAL", "SALIDA_SAL"):
+            if c not in sub.columns:
+                sub[c] = pd.NaT
+        return sub
+
+    a, d = _preparar(df_antes), _preparar(df_despues)
+    m = a.merge(d, on=["LOTE", "_N"], how="outer", suffixes=("_ANTES", "_DESPUES"), indicator=True)
+
+    ent_a, ent_d = m["ENTRADA_SAL_ANTES"], m["ENTRADA_SAL_DESPUES"]
+    sal_a, sal_d = m["SALIDA_SAL_ANTES"], m["SALIDA_SAL_DESPUES"]
+    misma_salida = (sal_a == sal_d) | (sal_a.isna() & sal_d.isna())
+    movido = ent_a.notna() & ent_d.notna() & ((ent_a != ent_d) | ~misma_salida)
+    condiciones = [
+        (m["_merge"] == "right_only").to_numpy(),
+        (m["_merge"] == "left_only").to_numpy(),
+        (ent_a.isna() & ent_d.notna()).to_numpy(),
+        (ent_a.notna() & ent_d.isna()).to_numpy(),
+        movido.to_numpy(),
+    ]
+    cambio = np.select(condiciones, CAMBIOS_LOTE, default="")
+    con_cambio = cambio != ""
+    m = m[con_cambio].assign(CAMBIO=pd.Categorical(cambio[con_cambio], categories=CAMBIOS_LOTE))
+
+    def _valor(col):
+        # Valor de la versión nueva y, si el lote se eliminó, el de la anterior
+        if f"{col}_DESPUES" in m.columns:
+            despues, antes = m[f"{col}_DESPUES"], m[f"{col}_ANTES"]
+            if isinstance(despues.dtype, pd.CategoricalDtype) or isinstance(antes.dtype, pd.CategoricalDtype):
+                # Cada versión tiene sus propias categorías (p. ej. un PRODUCTO nuevo): se une como texto
+                despues, antes = despues.astype(object), antes.astype(object)
+            return despues.fillna(antes)
+        return m[col] if col in m.columns else pd.Series(pd.NA, index=m.index)
+
+    lotes = pd.DataFrame({
+        "LOTE": m["LOTE"],
+        "CAMBIO": m["CAMBIO"],
+        "PRODUCTO": _valor("PRODUCTO"),
+        "UNDS": _valor("UNDS"),
+        "ENTRADA_ANTES": m["ENTRADA_SAL_ANTES"],
+        "ENTRADA_DESPUES": m["ENTRADA_SAL_DESPUES"],
+        "DELTA_ENTRADA_DIAS": (m["ENTRADA_SAL_DESPUES"] - m["ENTRADA_SAL_ANTES"]).dt.days.astype("Int32"),
+        "SALIDA_ANTES": m["SALIDA_SAL_ANTES"],
+        "SALIDA_DESPUES": m["SALIDA_SAL_DESPUES"],
+        "DELTA_SALIDA_DIAS": (m["SALIDA_SAL_DESPUES"] - m["SALIDA_SAL_ANTES"]).dt.days.astype("Int32"),
+    }).sort_values(["CAMBIO", "LOTE"], kind="stable").reset_index(drop=True)
+
+    # Cargas diarias antes/después sobre un eje de días común
+    fechas = pd.concat([
+        pd.to_datetime(df[c], errors="coerce")
+        for df in (df_antes, df_despues) for c in ("DIA", "ENTRADA_SAL", "SALIDA_SAL") if c in df.columns
+    ]).dropna()
+    cols_cargas = ["FECHA"] + [f"{r}_{s}" for r in ("ENTRADA", "SALIDA", "ESTAB") for s in ("ANTES", "DESPUES", "DELTA")]
+    if fechas.empty:
+        cargas = pd.DataFrame(columns=cols_cargas)
+    else:
+        origen = fechas.min().normalize()
+        n_dias = (fechas.max().normalize() - origen).days + 1
+        ca, cd = _cargas_diarias(df_antes, origen, n_dias), _cargas_diarias(df_despues, origen, n_dias)
+        cargas = pd.DataFrame({"FECHA": pd.date_range(origen, periods=n_dias, freq="D")})
+        hay_cambio = np.zeros(n_dias, dtype=bool)
+        for r in ("ENTRADA", "SALIDA", "ESTAB"):
+            cargas[f"{r}_ANTES"] = ca[r]
+            cargas[f"{r}_DESPUES"] = cd[r]
+            cargas[f"{r}_DELTA"] = cd[r] - ca[r]
+            hay_cambio |= cargas[f"{r}_DELTA"].to_numpy() != 0
+        cargas = cargas[hay_cambio].reset_index(drop=True)
+
+    resumen = lotes["CAMBIO"].value_counts(sort=False).reindex(CAMBIOS_LOTE, fill_value=0)
+    return {"lotes": lotes, "cargas": cargas, "resumen": {k: int(v) for k, v in resumen.items()}}
+
+# -------------------------------
+# Diario de versiones del plan (deshacer/rehacer por deltas)
+# -------------------------------
+def _iguales_por_fila(a: pd.DataFrame, b: pd.DataFrame) -> np.ndarray:
+    """Máscara de filas iguales (mismas columnas y orden); NA se considera igual a NA."""
+    iguales = np.ones(len(a), dtype=bool)
+    for col in a.columns:
+        va, vb = a[col], b[col]
+        na_a, na_b = va.isna().to_numpy(), vb.isna().to_numpy()
+        mismo = va.to_numpy(dtype=object, na_value=None) == vb.to_numpy(dtype=object, na_value=None)
+        iguales &= np.where(na_a | na_b, na_a & na_b, mismo)
+    return iguales
+
+def delta_planes(antes: pd.DataFrame, despues: pd.DataFrame):
+    """
+    Delta entre dos versiones consecutivas del plan, por LOTE: filas que salen de 'antes'
+    (eliminadas o modificadas) y filas que entran en 'despues' (nuevas o modificadas), con su posición.
+    Devuelve None si no se puede expresar como delta (sin LOTE único, columnas distintas, índice no
+    consecutivo o filas sin cambios reordenadas): entonces el diario guarda una instantánea.
+    """
+    if list(antes.columns) != list(despues.columns) or "LOTE" not in antes.columns:
+        return None
+    for df in (antes, despues):
+        if not df.index.equals(pd.RangeIndex(len(df))):
+            return None
+    clave_a, clave_d = antes["LOTE"].astype("string"), despues["LOTE"].astype("string")
+    if clave_a.isna().any() or clave_d.isna().any() or not (clave_a.is_unique and clave_d.is_unique):
+        return None
+
+    # Filas comunes sin cambios: deben conservar su orden relativo
+    pos_d_de_a = pd.Index(clave_d).get_indexer(clave_a)
+    comunes_a = np.flatnonzero(pos_d_de_a >= 0)
+    comunes_d = pos_d_de_a[comunes_a]
+    iguales = _iguales_por_fila(
+        antes.iloc[comunes_a].reset_index(drop=True), despues.iloc[comunes_d].reset_index(drop=True)
+    )
+    quedan_a, quedan_d = comunes_a[iguales], comunes_d[iguales]
+    if not (np.diff(quedan_d) > 0).all():
+        return None
+
+    sale = np.ones(len(antes), dtype=bool)
+    sale[quedan_a] = False
+    entra = np.ones(len(despues), dtype=bool)
+    entra[quedan_d] = False
+    pos_sale, pos_entra = np.flatnonzero(sale), np.flatnonzero(entra)
+    return {
+        "pos_salen": pos_sale, "salen": antes.iloc[pos_sale],
+        "pos_entran": pos_entra, "entran": despues.iloc[pos_entra],
+        "tipos_antes": antes.dtypes.astype(str).to_dict(),
+        "tipos_despues": despues.dtypes.astype(str).to_dict(),
+    }
+
+def aplicar_delta(plan: pd.DataFrame, delta: dict, adelante=True) -> pd.DataFrame:
+    """Aplica un delta de delta_planes hacia delante (antes → despues) o hacia atrás. Coste O(filas cambiadas + n)."""
+    if adelante:
+        quitar, filas, pos_filas, tipos = delta["pos_salen"], delta["entran"], delta["pos_entran"], delta["tipos_despues"]
+    else:
+        quitar, filas, pos_filas, tipos = delta["pos_entran"], delta["salen"], delta["pos_salen"], delta["tipos_antes"]
+    restantes = np.delete(np.arange(len(plan)), quitar)
+    n = len(restantes) + len(pos_filas)
+    libres = np.ones(n, dtype=bool)
+    libres[pos_filas] = False
+    destino = np.concatenate([np.flatnonzero(libres), pos_filas])
+    out = pd.concat([plan.iloc[restantes], filas], ignore_index=True)
+    out = out.iloc[np.argsort(destino, kind="stable")].reset_index(drop=True)
+    for col, tipo in tipos.items():
+        if str(out[col].dtype) != tipo:
+            out[col] = out[col].astype(tipo)
+    return out
+
+class DiarioPlan:
+    """
+    Diario de versiones del plan (solo se añade): cada versión guarda el delta respecto a su versión
+    padre y, cada 'cada_instantanea' niveles (o si no hay delta posible), una instantánea completa.
+    Deshacer/rehacer e ir a una versión reproducen deltas por el camino más corto en el árbol de
+    versiones; registrar tras deshacer crea una rama nueva sin borrar la anterior.
+    """
+
+    def __init__(self, df_inicial: pd.DataFrame, origen="Versión inicial", cada_instantanea=20):
+        self.cada_instantanea = cada_instantanea
+        self.versiones = [self._entrada(None, origen, None, df_inicial, 0, len(df_inicial))]
+        self.actual = 0
+        self.plan = df_inicial
+
+    @staticmethod
+    def _entrada(padre, origen, delta, instantanea, profundidad, n_cambios):
+        return {
+            "padre": padre, "origen": origen, "delta": delta, "instantanea": instantanea,
+            "profundidad": profundidad, "filas_cambiadas": int(n_cambios), "momento": pd.Timestamp.now(),
+        }
+
+    def registrar(self, df_nuevo: pd.DataFrame, origen: str) -> int:
+        """Añade df_nuevo como hija de la versión actual. Devuelve su nº de versión (no registra si no hay cambios)."""
+        delta = delta_planes(self.plan, df_nuevo)
+        if delta is not None and len(delta["pos_salen"]) == 0 and len(delta["pos_entran"]) == 0:
+            self.plan = df_nuevo
+            return self.actual
+        profundidad = self.versiones[self.actual]["profundidad"] + 1
+        instantanea = df_nuevo if (delta is None or profundidad % self.cada_instantanea == 0) else None
+        n_cambios = len(df_nuevo) if delta is None else max(len(delta["pos_salen"]), len(delta["pos_entran"]))
+        self.versiones.append(self._entrada(self.actual, origen, delta, instantanea, profundidad, n_cambios))
+        self.actual = len(self.versiones) - 1
+        self.plan = df_nuevo
+        return self.actual
+
+    def _ancestros(self, v):
+        camino = [v]
+        while self.versiones[camino[-1]]["padre"] is not None:
+            camino.append(self.versiones[camino[-1]]["padre"])
+        return camino
+
+    def ir_a(self, version: int) -> pd.DataFrame:
+        """Reconstruye la versión pedida: por el ancestro común con la actual o desde la instantánea más cercana."""
+        if version == self.actual:
+            return self.plan
+        sube = self._ancestros(self.actual)
+        baja = self._ancestros(version)
+        comunes = set(sube) & set(baja)
+        lca = next(v for v in sube if v in comunes)
+        sube = sube[:sube.index(lca)]
+        baja = baja[:baja.index(lca)]
+        # Alternativa: instantánea más cercana por encima de la versión destino
+        ruta_inst = next(i for i, v in enumerate(self._ancestros(version)) if self.versiones[v]["instantanea"] is not None)
+
+        if ruta_inst < len(sube) + len(baja) or any(self.versiones[v]["delta"] is None for v in sube + baja):
+            camino = self._ancestros(version)[:ruta_inst + 1]
+            plan = self.versiones[camino[-1]]["instantanea"]
+            for v in reversed(camino[:-1]):
+                plan = aplicar_delta(plan, self.versiones[v]["delta"], adelante=True)
+        else:
+            plan = self.plan
+            for v in sube:
+                plan = aplicar_delta(plan, self.versiones[v]["delta"], adelante=False)
+            for v in reversed(baja):
+                plan = aplicar_delta(plan, self.versiones[v]["delta"], adelante=True)
+        self.actual = version
+        self.plan = plan
+        return plan
+
+    @property
+    def puede_deshacer(self):
+        return self.versiones[self.actual]["padre"] is not None
+
+    @property
+    def puede_rehacer(self):
+        return any(e["padre"] == self.actual for e in self.versiones)
+
+    def deshacer(self) -> pd.DataFrame:
+        return self.ir_a(self.versiones[self.actual]["padre"]) if self.puede_deshacer else self.plan
+
+    def rehacer(self) -> pd.DataFrame:
+        """Vuelve a la hija más reciente de la versión actual."""
+        hijas = [i for i, e in enumerate(self.versiones) if e["padre"] == self.actual]
+        return self.ir_a(hijas[-1]) if hijas else self.plan
+
+    def historial(self) -> pd.DataFrame:
+        return pd.DataFrame({
+            "VERSION": range(len(self.versiones)),
+            "ORIGEN": [e["origen"] for e in self.versiones],
+            "PADRE": pd.array([e["padre"] for e in self.versiones], dtype="Int32"),
+            "FILAS_CAMBIADAS": [e["filas_cambiadas"] for e in self.versiones],
+            "INSTANTANEA": [e["instantanea"] is not None for e in self.versiones],
+            "MOMENTO": [e["momento"] for e in self.versiones],
+            "ACTUAL": [i == self.actual for i in range(len(self.versiones))],
+        })
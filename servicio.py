@@ -0,0 +1,485 @@
+# servicio.py
+# Servicio HTTP local de planificación para integración con el ERP (sin Streamlit).
+#
+#   python servicio.py --puerto 8502 [--plan plan.xlsx] [--config parametros.json]
+#
+# Mantiene en memoria el plan, el calendario, las capacidades y el libro de cargas entre
+# peticiones. Las consultas (GET) se atienden en paralelo; las escrituras (POST) se serializan.
+#
+#   GET  /salud                          estado del servicio
+#   GET  /plan                           plan completo
+#   GET  /sugerencias                    sugerencias para lotes que no encajan
+#   GET  /ocupacion?desde=&hasta=        carga, capacidad y holgura por día
+#        &resolucion=D|W|M               (opcional) pico/media/días sobre capacidad por semana o mes
+#   GET  /holgura?desde=&hasta=          solo holguras por día
+#   GET  /estabilizacion                 ocupación diaria de la cámara de estabilización
+#   GET  /familias?metrica=ENTRADA|SALIDA|ESTAB   unidades por día y familia de producto
+#   GET  /cubo[?formato=parquet|csv]     cubo diario de cargas (día × recurso × familia × intento)
+#   GET  /parametros                     parámetros de planificación vigentes
+#   GET  /rechazados                     filas de la última recepción que no pasaron la validación
+#   POST /recepciones                    alta/actualización de lotes + planificación → ENTRADA/SALIDA
+#                                        (las filas inválidas se apartan: ver GET /rechazados)
+#   POST /planificar                     replanifica los lotes pendientes del plan
+#   POST /estabilizacion                 estabilización de un plan recibido (sin tocar el estado)
+#   POST /parametros                     cambia capacidades/overrides/calendario
+#
+# Formato: JSON por defecto; CSV con ?formato=csv o "Accept: text/csv".
+# Los cuerpos POST pueden ser JSON (lista de filas o {"lotes": [...]}) o CSV (Content-Type: text/csv).
+import argparse
+import json
+import threading
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import StringIO
+from urllib.parse import parse_qs, urlparse
+
+import pandas as pd
+
+from planificador import (
+    CAP_ENT_DEFAULT,
+    CAP_SAL_DEFAULT,
+    DIAS_FESTIVOS_DEFAULT,
+    DIAS_MAX_ALMACEN_DEFAULT,
+    ESTAB_CAP_DEFAULT,
+    FAMILIAS_PRODUCTO_DEFAULT,
+    METRICAS_FAMILIA,
+    ORDEN_CRONOLOGICO,
+    ORDENES_ASIGNACION,
+    LibroCargas,
+    calcular_estabilizacion_diaria,
+    cargas_por_familia,
+    compactar_plan,
+    compilar_familias,
+    cubo_a_bytes,
+    cubo_cargas,
+    normalizar_lotes,
+    piramide_ocupacion,
+    planificar_filas_na,
+    preparar_para_mostrar,
+    validar_lotes,
+)
+
+COLS_RESULTADO = ["LOTE", "ENTRADA_SAL", "SALIDA_SAL", "DIAS_SAL", "DIAS_ALMACENADOS", "LOTE_NO_ENCAJA"]
+
+
+class CerrojoLecturaEscritura:
+    """Varios lectores a la vez o un único escritor (los escritores en espera tienen prioridad)."""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._lectores = 0
+        self._escribiendo = False
+        self._escritores_en_espera = 0
+
+    @contextmanager
+    def leer(self):
+        with self._cond:
+            while self._escribiendo or self._escritores_en_espera:
+                self._cond.wait()
+            self._lectores += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._lectores -= 1
+                if self._lectores == 0:
+                    self._cond.notify_all()
+
+    @contextmanager
+    def escribir(self):
+        with self._cond:
+            self._escritores_en_espera += 1
+            while self._escribiendo or self._lectores:
+                self._cond.wait()
+            self._escritores_en_espera -= 1
+            self._escribiendo = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._escribiendo = False
+                self._cond.notify_all()
+
+
+# -------------------------------
+# Parámetros (JSON ↔ estructuras del planificador)
+# -------------------------------
+def parametros_por_defecto():
+    return {
+        "cap_ent": list(CAP_ENT_DEFAULT),
+        "cap_sal": list(CAP_SAL_DEFAULT),
+        "estab_cap": ESTAB_CAP_DEFAULT,
+        "dias_max_almacen_global": DIAS_MAX_ALMACEN_DEFAULT,
+        "dias_max_por_producto": {},
+        "cap_overrides_ent": {},     # {"2025-03-05": {"CAP1": 2000, "CAP2": 2500}}
+        "cap_overrides_sal": {},
+        "estab_cap_overrides": {},   # {"2025-03-05": 3000}
+        "dias_festivos": list(DIAS_FESTIVOS_DEFAULT),
+        "ajuste_finde": True,
+        "ajuste_festivos": True,
+        "orden": ORDEN_CRONOLOGICO,  # o "holgura": menos flexibles primero
+        "familias": [dict(f) for f in FAMILIAS_PRODUCTO_DEFAULT],   # [{"FAMILIA", "TIPO", "PATRON"}]
+    }
+
+def _entero(nombre, v):
+    if isinstance(v, bool) or not isinstance(v, (int, float, str)):
+        raise ValueError(f"{nombre}: se esperaba un número entero, no {v!r}")
+    try:
+        f = float(v)
+    except ValueError:
+        raise ValueError(f"{nombre}: se esperaba un número entero, no {v!r}") from None
+    if not f.is_integer():
+        raise ValueError(f"{nombre}: se esperaba un número entero, no {v!r}")
+    return int(f)
+
+def _fecha(nombre, v):
+    try:
+        return pd.Timestamp(v).normalize()
+    except (TypeError, ValueError):
+        raise ValueError(f"{nombre}: fecha no válida {v!r}") from None
+
+def _diccionario(nombre, v):
+    if not isinstance(v, dict):
+        raise ValueError(f"{nombre}: se esperaba un objeto JSON, no {type(v).__name__}")
+    return v
+
+def validar_parametros(cambios) -> dict:
+    """
+    Comprueba y convierte los parámetros recibidos al tipo de parametros_por_defecto() (enteros,
+    pares de capacidades, fechas de overrides y festivos, booleanos, orden y familias).
+    Lanza ValueError con el primer problema encontrado; no modifica 'cambios'.
+    """
+    cambios = _diccionario("parametros", cambios)
+    desconocidos = set(cambios) - set(parametros_por_defecto())
+    if desconocidos:
+        raise ValueError(f"Parámetros desconocidos: {sorted(desconocidos)}")
+    out = {}
+    for clave, v in cambios.items():
+        if clave in ("cap_ent", "cap_sal"):
+            if not isinstance(v, (list, tuple)) or len(v) != 2:
+                raise ValueError(f"{clave}: se esperaba [CAP1, CAP2], no {v!r}")
+            out[clave] = [_entero(clave, c) for c in v]
+        elif clave in ("estab_cap", "dias_max_almacen_global"):
+            out[clave] = _entero(clave, v)
+        elif clave == "dias_max_por_producto":
+            out[clave] = {str(p): _entero(f"{clave}[{p}]", d) for p, d in _diccionario(clave, v).items()}
+        elif clave in ("cap_overrides_ent", "cap_overrides_sal"):
+            ov = {}
+            for f, caps in _diccionario(clave, v).items():
+                _fecha(clave, f)
+                caps = _diccionario(f"{clave}[{f}]", caps)
+                ov[f] = {c: (_entero(f"{clave}[{f}].{c}", caps[c]) if caps.get(c) is not None else None)
+                         for c in ("CAP1", "CAP2")}
+            out[clave] = ov
+        elif clave == "estab_cap_overrides":
+            ov = {}
+            for f, c in _diccionario(clave, v).items():
+                _fecha(clave, f)
+                ov[f] = _entero(f"{clave}[{f}]", c) if c is not None else None
+            out[clave] = ov
+        elif clave == "dias_festivos":
+            if not isinstance(v, (list, tuple)):
+                raise ValueError(f"{clave}: se esperaba una lista de fechas, no {v!r}")
+            out[clave] = [str(_fecha(clave, f).date()) for f in v]
+        elif clave in ("ajuste_finde", "ajuste_festivos"):
+            if not isinstance(v, bool):
+                raise ValueError(f"{clave}: se esperaba true/false, no {v!r}")
+            out[clave] = v
+        elif clave == "orden":
+            if v not in ORDENES_ASIGNACION.values():
+                raise ValueError(f"Orden desconocido: {v} (válidos: {sorted(ORDENES_ASIGNACION.values())})")
+            out[clave] = v
+        elif clave == "familias":
+            if not isinstance(v, list) or not all(isinstance(f, dict) for f in v):
+                raise ValueError(f"{clave}: se esperaba una lista de objetos FAMILIA/TIPO/PATRON")
+            compilar_familias(pd.Series([], dtype=object), v)   # valida tipos y regex
+            out[clave] = [dict(f) for f in v]
+    return out
+
+def _overrides_cap(dic):
+    out = {}
+    for fecha, caps in (dic or {}).items():
+        out[pd.Timestamp(fecha).normalize()] = {
+            "CAP1": (int(caps["CAP1"]) if caps.get("CAP1") is not None else None),
+            "CAP2": (int(caps["CAP2"]) if caps.get("CAP2") is not None else None),
+        }
+    return out
+
+def _overrides_estab(dic):
+    return {pd.Timestamp(f).normalize(): int(v) for f, v in (dic or {}).items() if v is not None}
+
+
+class EstadoPlanificador:
+    """Plan, sugerencias, parámetros y libro de cargas vivos entre peticiones."""
+
+    def __init__(self, parametros=None, plan=None):
+        self.cerrojo = CerrojoLecturaEscritura()
+        self.parametros = parametros_por_defecto()
+        self.parametros.update(validar_parametros(parametros or {}))
+        self.plan, self.rechazados = validar_lotes(plan if plan is not None else pd.DataFrame(
+            columns=["LOTE", "PRODUCTO", "UNDS", "DIA", "DIAS_SAL_OPTIMOS", "ENTRADA_SAL", "SALIDA_SAL"]
+        ))
+        self.sugerencias = pd.DataFrame()
+        self.version = 0
+        self._compilar_parametros()
+        self.libro = self._nuevo_libro(self.plan)
+
+    def _compilar_parametros(self):
+        p = self.parametros
+        self.cap_overrides_ent = _overrides_cap(p["cap_overrides_ent"])
+        self.cap_overrides_sal = _overrides_cap(p["cap_overrides_sal"])
+        self.estab_cap_overrides = _overrides_estab(p["estab_cap_overrides"])
+
+    def _nuevo_libro(self, plan):
+        p = self.parametros
+        return LibroCargas(
+            p["cap_ent"], p["cap_sal"], p["estab_cap"],
+            self.cap_overrides_ent, self.cap_overrides_sal, self.estab_cap_overrides,
+            p["dias_festivos"], p["ajuste_finde"], p["ajuste_festivos"]
+        ).cargar_plan(plan)
+
+    def _planificar(self, plan, libro):
+        p = self.parametros
+        return planificar_filas_na(
+            plan, p["dias_max_almacen_global"], p["dias_max_por_producto"],
+            p["estab_cap"], self.cap_overrides_ent, self.cap_overrides_sal, self.estab_cap_overrides,
+            libro=libro, orden=p["orden"]
+        )
+
+    def _instalar(self, plan, sugerencias, libro):
+        self.plan = compactar_plan(plan)
+        self.sugerencias = sugerencias
+        self.libro = libro
+        self.version += 1
+
+    # ---- Escrituras (serializadas) ----
+    def actualizar_parametros(self, cambios: dict):
+        cambios = validar_parametros(cambios)
+        with self.cerrojo.escribir():
+            # Si algo falla al recompilar overrides o libro, se vuelve a los parámetros anteriores
+            anteriores = self.parametros
+            self.parametros = {**anteriores, **cambios}
+            try:
+                self._compilar_parametros()
+                libro = self._nuevo_libro(self.plan)
+            except Exception:
+                self.parametros = anteriores
+                self._compilar_parametros()
+                raise
+            self.libro = libro
+            self.version += 1
+            return dict(self.parametros)
+
+    def recibir_lotes(self, df_lotes: pd.DataFrame) -> pd.DataFrame:
+        """
+        Da de alta (o sustituye, por LOTE) los lotes recibidos y planifica los pendientes.
+        Devuelve ENTRADA_SAL/SALIDA_SAL de los lotes recibidos; las filas que no pasan la validación
+        no entran en el plan y quedan en self.rechazados (GET /rechazados).
+        """
+        if "LOTE" not in df_lotes.columns:
+            raise ValueError("Falta la columna LOTE")
+        nuevos, rechazados = validar_lotes(df_lotes)
+        claves = set(nuevos["LOTE"].astype(str))
+        with self.cerrojo.escribir():
+            self.rechazados = rechazados
+            libro = self.libro.copia()
+            sustituidos = self.plan["LOTE"].astype(str).isin(claves)
+            for _, r in self.plan[sustituidos & self.plan["ENTRADA_SAL"].notna()].iterrows():
+                libro.retirar(r["DIA"], r["ENTRADA_SAL"], r["SALIDA_SAL"], int(r["UNDS"]))
+            libro.cargar_plan(nuevos)   # filas que ya llegan con ENTRADA/SALIDA fijadas
+            trabajo = pd.concat([self.plan[~sustituidos], nuevos], ignore_index=True)
+            plan, sugerencias = self._planificar(compactar_plan(trabajo), libro)
+            self._instalar(plan, sugerencias, libro)
+            return self.plan[self.plan["LOTE"].astype(str).isin(claves)][COLS_RESULTADO]
+
+    def replanificar_pendientes(self) -> pd.DataFrame:
+        with self.cerrojo.escribir():
+            pendientes = self.plan["ENTRADA_SAL"].isna()
+            claves = set(self.plan.loc[pendientes, "LOTE"].astype(str))
+            libro = self.libro.copia()
+            plan, sugerencias = self._planificar(self.plan, libro)
+            self._instalar(plan, sugerencias, libro)
+            return self.plan[self.plan["LOTE"].astype(str).isin(claves)][COLS_RESULTADO]
+
+    # ---- Lecturas (concurrentes) ----
+    def _rango_por_defecto(self):
+        fechas = pd.concat([self.plan[c] for c in ("DIA", "ENTRADA_SAL", "SALIDA_SAL") if c in self.plan.columns])
+        fechas = fechas.dropna()
+        if fechas.empty:
+            hoy = pd.Timestamp.today().normalize()
+            return hoy, hoy
+        return fechas.min(), fechas.max()
+
+    def ocupacion(self, desde=None, hasta=None) -> pd.DataFrame:
+        with self.cerrojo.leer():
+            d0, d1 = self._rango_por_defecto()
+            return self.libro.ocupacion(desde or d0, hasta or d1)
+
+    def estabilizacion(self, df_plan=None) -> pd.DataFrame:
+        with self.cerrojo.leer():
+            plan = self.plan if df_plan is None else normalizar_lotes(df_plan)
+            return calcular_estabilizacion_diaria(
+                plan, self.parametros["estab_cap"], self.estab_cap_overrides, self.parametros["familias"]
+            )
+
+    def cubo(self) -> pd.DataFrame:
+        with self.cerrojo.leer():
+            return cubo_cargas(self.plan, self.libro, self.parametros["familias"])
+
+    def cargas_familia(self, metrica="ESTAB") -> pd.DataFrame:
+        metrica = metrica.upper()
+        if metrica not in METRICAS_FAMILIA:
+            raise ValueError(f"Métrica desconocida: {metrica} (válidas: {list(METRICAS_FAMILIA)})")
+        with self.cerrojo.leer():
+            cargas = cargas_por_familia(self.plan, self.parametros["familias"], metricas=(metrica,))
+            return cargas[metrica].reset_index()
+
+    def leer(self, nombre):
+        with self.cerrojo.leer():
+            return getattr(self, nombre)
+
+
+# -------------------------------
+# HTTP
+# -------------------------------
+def _leer_tabla(cuerpo: bytes, content_type: str) -> pd.DataFrame:
+    if "csv" in (content_type or ""):
+        return pd.read_csv(StringIO(cuerpo.decode("utf-8")))
+    datos = json.loads(cuerpo or b"[]")
+    if isinstance(datos, dict):
+        datos = datos.get("lotes", [])
+    return pd.DataFrame(datos)
+
+
+class ManejadorPlanificador(BaseHTTPRequestHandler):
+    estado: EstadoPlanificador = None   # se asigna al crear el servidor
+
+    def _formato(self, query):
+        if query.get("formato", [""])[0] == "csv":
+            return "csv"
+        return "csv" if "text/csv" in self.headers.get("Accept", "") else "json"
+
+    def _responder(self, codigo, cuerpo: bytes, tipo: str):
+        self.send_response(codigo)
+        self.send_header("Content-Type", tipo)
+        self.send_header("Content-Length", str(len(cuerpo)))
+        self.end_headers()
+        self.wfile.write(cuerpo)
+
+    def _json(self, obj, codigo=200):
+        self._responder(codigo, json.dumps(obj, ensure_ascii=False, default=str).encode("utf-8"),
+                        "application/json; charset=utf-8")
+
+    def _tabla(self, df: pd.DataFrame, formato: str):
+        if formato == "csv":
+            buf = StringIO()
+            preparar_para_mostrar(df).to_csv(buf, index=False, date_format="%Y-%m-%d")
+            self._responder(200, buf.getvalue().encode("utf-8"), "text/csv; charset=utf-8")
+        else:
+            cuerpo = df.to_json(orient="records", date_format="iso", force_ascii=False)
+            self._responder(200, cuerpo.encode("utf-8"), "application/json; charset=utf-8")
+
+    def _cuerpo(self) -> bytes:
+        n = int(self.headers.get("Content-Length", 0) or 0)
+        return self.rfile.read(n) if n else b""
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        q = parse_qs(url.query)
+        formato = self._formato(q)
+        estado = self.estado
+        try:
+            if url.path == "/salud":
+                self._json({"ok": True, "version": estado.leer("version"), "lotes": len(estado.leer("plan"))})
+            elif url.path == "/plan":
+                self._tabla(estado.leer("plan"), formato)
+            elif url.path == "/sugerencias":
+                self._tabla(estado.leer("sugerencias"), formato)
+            elif url.path == "/rechazados":
+                self._tabla(estado.leer("rechazados"), formato)
+            elif url.path in ("/ocupacion", "/holgura"):
+                df = estado.ocupacion(q.get("desde", [None])[0], q.get("hasta", [None])[0])
+                if url.path == "/holgura":
+                    df = df[["FECHA"] + [c for c in df.columns if c.startswith("HOLGURA_")]]
+                elif q.get("resolucion"):
+                    df = piramide_ocupacion(df)[q["resolucion"][0].upper()]
+                self._tabla(df, formato)
+            elif url.path == "/estabilizacion":
+                self._tabla(estado.estabilizacion(), formato)
+            elif url.path == "/familias":
+                self._tabla(estado.cargas_familia(q.get("metrica", ["ESTAB"])[0]), formato)
+            elif url.path == "/cubo":
+                if q.get("formato", [""])[0] == "parquet":
+                    self._responder(200, cubo_a_bytes(estado.cubo(), "parquet"), "application/vnd.apache.parquet")
+                else:
+                    self._tabla(estado.cubo(), formato)
+            elif url.path == "/parametros":
+                self._json(estado.leer("parametros"))
+            else:
+                self._json({"error": f"Ruta no encontrada: {url.path}"}, 404)
+        except (ValueError, KeyError) as e:
+            self._json({"error": str(e)}, 400)
+        except Exception as e:
+            self._json({"error": f"Error interno: {type(e).__name__}: {e}"}, 500)
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        formato = self._formato(parse_qs(url.query))
+        estado = self.estado
+        try:
+            cuerpo = self._cuerpo()
+            if url.path == "/recepciones":
+                df = _leer_tabla(cuerpo, self.headers.get("Content-Type", ""))
+                self._tabla(estado.recibir_lotes(df), formato)
+            elif url.path == "/planificar":
+                self._tabla(estado.replanificar_pendientes(), formato)
+            elif url.path == "/estabilizacion":
+                df = _leer_tabla(cuerpo, self.headers.get("Content-Type", ""))
+                self._tabla(estado.estabilizacion(df), formato)
+            elif url.path == "/parametros":
+                self._json(estado.actualizar_parametros(json.loads(cuerpo or b"{}")))
+            else:
+                self._json({"error": f"Ruta no encontrada: {url.path}"}, 404)
+        except (ValueError, KeyError) as e:
+            self._json({"error": str(e)}, 400)
+        except Exception as e:
+            self._json({"error": f"Error interno: {type(e).__name__}: {e}"}, 500)
+
+
+def crear_servidor(estado: EstadoPlanificador, host="127.0.0.1", puerto=8502) -> ThreadingHTTPServer:
+    manejador = type("Manejador", (ManejadorPlanificador,), {"estado": estado})
+    return ThreadingHTTPServer((host, puerto), manejador)
+
+
+def _leer_fichero(ruta: str) -> pd.DataFrame:
+    if ruta.lower().endswith(".csv"):
+        return pd.read_csv(ruta)
+    return pd.read_excel(ruta, engine="openpyxl")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Servicio HTTP local del planificador de lotes Naturiber")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--puerto", type=int, default=8502)
+    parser.add_argument("--plan", help="Excel/CSV con el plan inicial (opcional)")
+    parser.add_argument("--config", help="JSON con parámetros de planificación (opcional)")
+    args = parser.parse_args(argv)
+
+    parametros = None
+    if args.config:
+        with open(args.config, encoding="utf-8") as f:
+            parametros = json.load(f)
+    plan = _leer_fichero(args.plan) if args.plan else None
+
+    servidor = crear_servidor(EstadoPlanificador(parametros, plan), args.host, args.puerto)
+    print(f"Servicio de planificación en http://{args.host}:{args.puerto}")
+    try:
+        servidor.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        servidor.server_close()
+
+
+if __name__ == "__main__":
+    main()
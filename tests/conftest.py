@@ -0,0 +1,8 @@
+# tests/conftest.py
+# Los módulos del proyecto (planificador, servicio) y los de benchmarks/ (referencia congelada,
+# generador sintético) se importan desde la raíz del repositorio.
+import os
+import sys
+
+RAIZ = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path[:0] = [RAIZ, os.path.join(RAIZ, "benchmarks")]
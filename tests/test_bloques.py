@@ -0,0 +1,67 @@
+# tests/test_bloques.py
+# Reparto de los lotes pendientes en bloques independientes y planificación en paralelo.
+import pandas as pd
+import pytest
+
+import planificador as P
+from sintetico import lotes_sinteticos
+
+
+def test_bloques_independientes_agrupa_intervalos_que_se_tocan():
+    # 0 y 2 comparten el día 2; 1 y 4 el día 6; 3 queda solo
+    intervalos = [(0, 2), (5, 6), (2, 3), (7, 9), (6, 6)]
+    assert P.bloques_independientes(intervalos) == [[0, 2], [1, 4], [3]]
+
+
+def test_bloques_independientes_sin_intervalos():
+    assert P.bloques_independientes([]) == []
+
+
+def test_repartir_bloques_no_parte_ningun_bloque():
+    bloques = [[0, 3], [1], [2, 4, 5], [6]]
+    trozos = P._repartir_bloques(bloques, 2)
+    assert len(trozos) <= 2
+    assert sorted(i for t in trozos for i in t) == list(range(7))
+    for b in bloques:
+        assert sum(set(b) <= set(t) for t in trozos) == 1
+
+
+def test_huella_cubre_entradas_y_salidas_posibles():
+    festivos = set(P.DIAS_FESTIVOS_DEFAULT)
+    dia = pd.Timestamp("2025-03-07")   # viernes: la primera entrada hábil es el lunes
+    ini, fin = P._huella_lote(dia, 3, 10, festivos)
+    assert ini <= dia
+    assert fin >= pd.Timestamp("2025-03-10") + pd.Timedelta(days=10)
+
+
+def test_huella_con_dias_max_vacio():
+    ini, fin = P._huella_lote(pd.Timestamp("2025-03-05"), float("nan"), 10, set())
+    assert fin < ini   # sin días candidatos: no ocupa ninguna fecha
+
+
+def _dos_temporadas():
+    """Dos tandas de recepciones separadas dos meses: al menos dos bloques independientes."""
+    a = lotes_sinteticos(60, semilla=3, inicio="2025-03-03", lotes_por_dia=4)
+    b = lotes_sinteticos(60, semilla=4, inicio="2025-05-05", lotes_por_dia=4)
+    b["LOTE"] = "M" + b["LOTE"]
+    return P.normalizar_lotes(pd.concat([a, b], ignore_index=True))
+
+
+@pytest.mark.parametrize("orden", [P.ORDEN_CRONOLOGICO, P.ORDEN_HOLGURA])
+def test_paralelo_igual_que_secuencial(monkeypatch, orden):
+    args = (_dos_temporadas(), 5, {}, P.ESTAB_CAP_DEFAULT, {}, {}, {})
+    plan_1, sug_1 = P.planificar_filas_na(*args, procesos=1, orden=orden)
+
+    repartos = []
+    repartir = P._repartir_bloques
+    def _espia(bloques, n_trozos):
+        trozos = repartir(bloques, n_trozos)
+        repartos.append(len(trozos))
+        return trozos
+    monkeypatch.setattr(P, "_repartir_bloques", _espia)
+    monkeypatch.setattr(P, "UMBRAL_PARALELO", 0)
+    plan_2, sug_2 = P.planificar_filas_na(*args, procesos=2, orden=orden)
+
+    assert repartos == [2]
+    pd.testing.assert_frame_equal(plan_1, plan_2)
+    pd.testing.assert_frame_equal(sug_1, sug_2)
@@ -0,0 +1,54 @@
+# tests/test_comparar.py
+# Diferencias entre dos versiones del plan (comparar_planes).
+import pandas as pd
+
+import planificador as P
+
+DIA = pd.Timestamp("2025-03-03")
+
+
+def _plan(lotes, productos, entradas):
+    entradas = [pd.Timestamp(e) if e else pd.NaT for e in entradas]
+    return P.compactar_plan(pd.DataFrame({
+        "LOTE": lotes,
+        "PRODUCTO": productos,
+        "DIA": [DIA] * len(lotes),
+        "UNDS": [100] * len(lotes),
+        "ENTRADA_SAL": entradas,
+        "SALIDA_SAL": [e + pd.Timedelta(days=10) for e in entradas],
+    }))
+
+
+def test_productos_distintos_en_cada_version():
+    # PRODUCTO es categórico y cada versión tiene sus propias categorías
+    antes = _plan(["A", "B"], ["X", "Y"], ["2025-03-03", "2025-03-03"])
+    despues = _plan(["B", "C"], ["Y", "Z"], ["2025-03-03", "2025-03-04"])
+    r = P.comparar_planes(antes, despues)
+
+    lotes = r["lotes"].set_index("LOTE")
+    assert lotes.loc["A", "CAMBIO"] == "Eliminado"
+    assert lotes.loc["A", "PRODUCTO"] == "X"
+    assert lotes.loc["C", "CAMBIO"] == "Nuevo"
+    assert lotes.loc["C", "PRODUCTO"] == "Z"
+    assert "B" not in lotes.index
+    assert r["resumen"]["Nuevo"] == 1 and r["resumen"]["Eliminado"] == 1
+
+    cargas = r["cargas"].set_index("FECHA")
+    assert cargas.loc[pd.Timestamp("2025-03-03"), "ENTRADA_DELTA"] == -100
+    assert cargas.loc[pd.Timestamp("2025-03-04"), "ENTRADA_DELTA"] == 100
+    assert cargas.loc[pd.Timestamp("2025-03-03"), "ESTAB_DELTA"] == 100   # C espera un día en cámara
+
+
+def test_movido_y_ya_no_encaja():
+    antes = _plan(["A", "B"], ["X", "X"], ["2025-03-03", "2025-03-03"])
+    despues = _plan(["A", "B"], ["X", "X"], ["2025-03-05", None])
+    lotes = P.comparar_planes(antes, despues)["lotes"].set_index("LOTE")
+    assert lotes.loc["A", "CAMBIO"] == "Movido"
+    assert lotes.loc["A", "DELTA_ENTRADA_DIAS"] == 2
+    assert lotes.loc["B", "CAMBIO"] == "Ya no encaja"
+
+
+def test_sin_cambios():
+    plan = _plan(["A"], ["X"], ["2025-03-03"])
+    r = P.comparar_planes(plan, plan.copy())
+    assert r["lotes"].empty and r["cargas"].empty
@@ -0,0 +1,65 @@
+# tests/test_escritura.py
+# Volcado de las asignaciones en arrays tipados (_escribir_asignaciones) y esquema del plan.
+import numpy as np
+import pandas as pd
+
+import planificador as P
+from sintetico import lotes_sinteticos
+
+
+def _plan(n=4):
+    return pd.DataFrame({
+        "LOTE": [f"L{i}" for i in range(n)],
+        "DIA": pd.Timestamp("2025-03-03") + pd.to_timedelta(np.arange(n), unit="D"),
+        "UNDS": [100] * n,
+        "DIAS_SAL_OPTIMOS": [10] * n,
+        "ENTRADA_SAL": np.array(["2025-03-03"] + ["NaT"] * (n - 1), dtype="datetime64[ns]"),
+        "SALIDA_SAL": np.array(["2025-03-13"] + ["NaT"] * (n - 1), dtype="datetime64[ns]"),
+        "DIAS_SAL": pd.array([10] + [pd.NA] * (n - 1), dtype="Int32"),
+        "DIAS_ALMACENADOS": pd.array([0] + [pd.NA] * (n - 1), dtype="Int32"),
+        "LOTE_NO_ENCAJA": pd.array([False] + [pd.NA] * (n - 1), dtype="boolean"),
+    }, index=[7, 7, 3, 3])   # etiquetas repetidas: el volcado es por posición
+
+
+def _volcar(df, asignadas, no_encaja):
+    n = len(df)
+    asignada = np.zeros(n, dtype=bool)
+    asignada[asignadas] = True
+    entrada = np.full(n, np.datetime64("NaT"), dtype="datetime64[ns]")
+    salida = entrada.copy()
+    entrada[asignadas] = df["DIA"].to_numpy(dtype="datetime64[ns]")[asignadas] + np.timedelta64(2, "D")
+    salida[asignadas] = entrada[asignadas] + np.timedelta64(11, "D")
+    P._escribir_asignaciones(df, asignada, entrada, salida, np.asarray(no_encaja, dtype=np.int8))
+
+
+def test_volcado_por_posicion_y_con_tipos():
+    df = _plan()
+    _volcar(df, [1], [-1, 0, 1, -1])
+
+    assert df["ENTRADA_SAL"].dtype == "datetime64[ns]"
+    assert df["ENTRADA_SAL"].iloc[:2].tolist() == [pd.Timestamp("2025-03-03"), pd.Timestamp("2025-03-06")]
+    assert df["ENTRADA_SAL"].iloc[2:].isna().all()
+    assert df["DIAS_SAL"].dtype == "Int32"
+    assert df["DIAS_SAL"].iloc[:2].tolist() == [10, 11]
+    assert df["DIAS_ALMACENADOS"].iloc[1] == 2
+    assert df["DIFERENCIA_DIAS_SAL"].iloc[1] == 1
+    assert df["LOTE_NO_ENCAJA"].dtype == "boolean"
+    assert df["LOTE_NO_ENCAJA"].tolist()[:3] == [False, False, True]
+    assert df["LOTE_NO_ENCAJA"].isna().iloc[3]
+
+
+def test_columna_entera_sin_huecos_es_int32():
+    df = _plan()
+    _volcar(df, [1, 2, 3], [-1, 0, 0, 0])
+    assert df["DIAS_SAL"].dtype == "int32"
+    assert df["DIAS_ALMACENADOS"].tolist() == [0, 2, 2, 2]
+
+
+def test_planificar_con_etiquetas_repetidas():
+    lotes = P.normalizar_lotes(lotes_sinteticos(40, semilla=2))
+    args = (5, {}, P.ESTAB_CAP_DEFAULT, {}, {}, {})
+    plan, _ = P.planificar_filas_na(lotes, *args)
+    repetidas, _ = P.planificar_filas_na(lotes.set_axis([0, 1] * 20), *args)
+    pd.testing.assert_frame_equal(plan.reset_index(drop=True), repetidas.reset_index(drop=True))
+    assert plan["ENTRADA_SAL"].dtype == "datetime64[ns]"
+    assert plan["LOTE_NO_ENCAJA"].dtype == "boolean"
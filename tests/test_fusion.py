@@ -0,0 +1,71 @@
+# tests/test_fusion.py
+# Fusión por LOTE de varios ficheros de recepciones y reglas de conflicto.
+import pandas as pd
+import pytest
+
+import planificador as P
+
+
+def _fichero(lotes, unds, entrada=None):
+    n = len(lotes)
+    return pd.DataFrame({
+        "LOTE": lotes,
+        "PRODUCTO": ["JAMON-BLANCO"] * n,
+        "UNDS": unds,
+        "DIA": [pd.Timestamp("2025-03-04")] * n,
+        "DIAS_SAL_OPTIMOS": [12] * n,
+        "ENTRADA_SAL": entrada if entrada is not None else [pd.NaT] * n,
+        "SALIDA_SAL": [pd.NaT] * n,
+    })
+
+
+def _unds(df, lote):
+    return df.loc[df["LOTE"].astype(str).str.strip() == lote, "UNDS"].tolist()
+
+
+def test_gana_el_mas_reciente():
+    a = _fichero(["L1", "L2", "L1"], [100, 200, 150])
+    b = _fichero([" L1", "L3"], [300, 400])
+    fusionado, dup = P.fusionar_lotes([a, b], ["a.xlsx", "b.xlsx"])
+
+    assert len(fusionado) == 3
+    assert _unds(fusionado, "L1") == [300]
+    assert dup["LOTE"].tolist() == ["L1"] * 3
+    assert dup["ARCHIVO"].tolist() == ["a.xlsx", "a.xlsx", "b.xlsx"]
+    assert dup["FILA"].tolist() == [2, 4, 2]
+    assert dup["ACCION"].tolist() == ["Descartada", "Descartada", "Conservada"]
+    assert dup["DIFERENTE"].tolist() == [True, True, False]
+
+
+def test_conservar_la_fila_planificada():
+    a = _fichero(["L1", "L2"], [100, 200], entrada=[pd.Timestamp("2025-03-05"), pd.NaT])
+    b = _fichero(["L1", "L2"], [300, 400])
+    fusionado, dup = P.fusionar_lotes([a, b], regla=P.CONFLICTO_PLANIFICADA)
+
+    assert _unds(fusionado, "L1") == [100]   # la planificada, aunque sea más antigua
+    assert _unds(fusionado, "L2") == [400]   # ninguna planificada: la más reciente
+    conservadas = dup[dup["ACCION"] == "Conservada"]
+    assert conservadas["ARCHIVO"].tolist() == ["Fichero 1", "Fichero 2"]
+
+
+def test_filas_sin_lote_no_se_fusionan():
+    a = _fichero(["L1", None, ""], [100, 200, 300])
+    b = _fichero([None, "L1"], [400, 100])
+    fusionado, dup = P.fusionar_lotes([a, b])
+    assert len(fusionado) == 4
+    assert set(dup["LOTE"]) == {"L1"}
+    assert not dup["DIFERENTE"].any()   # misma fila en los dos ficheros
+
+
+def test_fila_de_excel_tras_validar():
+    a = _fichero(["L1", "L2", "L3"], [100, -5, 200])   # L2 se aparta en la validación
+    validos, rechazados = P.validar_lotes(a, rechazar_duplicados=False)
+    assert rechazados["FILA"].tolist() == [3]
+    b = _fichero(["L3"], [250])
+    _, dup = P.fusionar_lotes([validos, b])
+    assert dup["FILA"].tolist() == [4, 2]
+
+
+def test_regla_desconocida():
+    with pytest.raises(ValueError):
+        P.fusionar_lotes([_fichero(["L1"], [1])], regla="otra")
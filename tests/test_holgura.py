@@ -0,0 +1,70 @@
+# tests/test_holgura.py
+# Árbol de segmentos de la línea de holgura y su mantenimiento incremental.
+import numpy as np
+import pandas as pd
+
+import planificador as P
+from sintetico import lotes_sinteticos
+
+
+def test_arbol_minimos_igual_que_lista():
+    rng = np.random.default_rng(0)
+    valores = rng.integers(-50, 50, 37).tolist()
+    arbol = P._ArbolMinimos(valores)
+    for _ in range(500):
+        i, j = sorted(rng.integers(0, len(valores), 2).tolist())
+        if rng.random() < 0.5:
+            v = int(rng.integers(-20, 20))
+            arbol.sumar(i, j, v)
+            valores[i:j + 1] = [x + v for x in valores[i:j + 1]]
+        else:
+            assert arbol.minimo_en(i, j) == min(valores[i:j + 1])
+    assert [arbol.minimo_en(k, k) for k in range(len(valores))] == valores
+
+
+def test_arbol_minimos_rangos_vacios():
+    assert P._ArbolMinimos([]).minimo_en(0, 0) == float("inf")
+    arbol = P._ArbolMinimos([3, 1, 2])
+    assert arbol.minimo_en(2, 1) == float("inf")
+    arbol.sumar(2, 1, 10)   # rango vacío: no cambia nada
+    assert arbol.minimo_en(0, 2) == 1
+
+
+def _holguras(linea, fechas):
+    return [linea.holgura(f) for f in fechas]
+
+
+def test_sincronizar_igual_que_reconstruir():
+    lotes = P.normalizar_lotes(lotes_sinteticos(60, semilla=1))
+    plan, _ = P.planificar_filas_na(lotes, 5, {}, P.ESTAB_CAP_DEFAULT, {}, {}, {})
+    libro = P.LibroCargas()
+    linea = P.LineaHolgura(libro, plan)
+
+    # Se mueve un lote planificado, se quita otro y se añade uno nuevo fuera del horizonte
+    nuevo = plan.copy()
+    movido = int(np.flatnonzero(nuevo["ENTRADA_SAL"].notna().to_numpy())[0])
+    nuevo.iloc[movido, nuevo.columns.get_loc("ENTRADA_SAL")] += pd.Timedelta(days=1)
+    nuevo.iloc[movido, nuevo.columns.get_loc("SALIDA_SAL")] += pd.Timedelta(days=1)
+    nuevo = nuevo.drop(index=nuevo.index[-1])
+    lejano = nuevo.iloc[[0]].assign(
+        LOTE="LEJANO", DIA=pd.Timestamp("2026-01-07"),
+        ENTRADA_SAL=pd.Timestamp("2026-01-09"), SALIDA_SAL=pd.Timestamp("2026-01-21"),
+    )
+    nuevo = pd.concat([nuevo, lejano], ignore_index=True)
+
+    entran = linea.sincronizar(nuevo)
+    assert set(entran["LOTE"]) == {nuevo.iloc[movido]["LOTE"], "LEJANO"}
+
+    fechas = pd.date_range("2025-02-20", "2026-01-31", freq="D")
+    assert _holguras(linea, fechas) == _holguras(P.LineaHolgura(libro, nuevo), fechas)
+
+
+def test_max_unidades_limitado_por_estabilizacion():
+    libro = P.LibroCargas(estab_cap=1000)
+    plan = pd.DataFrame({
+        "LOTE": ["A"], "DIA": [pd.Timestamp("2025-03-03")], "UNDS": [800],
+        "ENTRADA_SAL": [pd.Timestamp("2025-03-06")], "SALIDA_SAL": [pd.Timestamp("2025-03-18")],
+    })
+    linea = P.LineaHolgura(libro, plan)
+    unidades, recurso = linea.max_unidades(pd.Timestamp("2025-03-04"), pd.Timestamp("2025-03-07"))
+    assert (unidades, recurso) == (200, "ESTABILIZACIÓN")
@@ -0,0 +1,46 @@
+# tests/test_mejora.py
+# Búsqueda local sobre un plan ya calculado (mejorar_plan).
+import pandas as pd
+import pytest
+
+import planificador as P
+from sintetico import lotes_sinteticos
+
+ARGS = (5, {}, P.ESTAB_CAP_DEFAULT, {}, {}, {})
+
+
+@pytest.fixture(scope="module")
+def plan():
+    lotes = P.normalizar_lotes(lotes_sinteticos(150, semilla=8))
+    return P.planificar_filas_na(lotes, *ARGS, procesos=1)[0]
+
+
+def _fechas(df, filas):
+    return df.loc[filas, ["ENTRADA_SAL", "SALIDA_SAL"]].astype(str)
+
+
+def test_no_empeora_y_respeta_capacidades(plan):
+    mejorado, resumen = P.mejorar_plan(plan, *ARGS, presupuesto_s=2)
+    assert resumen["objetivo_final"] <= resumen["objetivo_inicial"]
+
+    libro = P.LibroCargas().cargar_plan(mejorado)
+    o = libro.ocupacion(mejorado["DIA"].min(), mejorado["SALIDA_SAL"].max())
+    assert (o["ENTRADA_UNDS"] <= o["ENTRADA_CAP2"]).all()
+    assert (o["SALIDA_UNDS"] <= o["SALIDA_CAP2"]).all()
+    antes = P.LibroCargas().cargar_plan(plan).ocupacion(o["FECHA"].min(), o["FECHA"].max())
+    # Solo se permite exceso de estabilización donde ya lo había
+    assert ((o["ESTAB_UNDS"] <= o["ESTAB_CAP"]) | (o["ESTAB_UNDS"] <= antes["ESTAB_UNDS"])).all()
+
+
+def test_no_separa_los_grupos_de_entrada_comun(plan):
+    grupo = plan["PRODUCTO"].astype(str).isin(P.CODIGOS_ENTRADA_COMUN)
+    assert plan.loc[grupo, "ENTRADA_SAL"].isna().any()   # hay lotes de grupo sin asignar
+    mejorado, _ = P.mejorar_plan(plan, *ARGS, presupuesto_s=2)
+    pd.testing.assert_frame_equal(_fechas(mejorado, grupo), _fechas(plan, grupo))
+
+
+def test_solo_toca_los_modificables(plan):
+    fijos, modificables = plan.index[:75], plan.index[75:]
+    mejorado, resumen = P.mejorar_plan(plan, *ARGS, modificables=modificables, presupuesto_s=2)
+    pd.testing.assert_frame_equal(_fechas(mejorado, fijos), _fechas(plan, fijos))
+    assert resumen["objetivo_final"] <= resumen["objetivo_inicial"]
@@ -0,0 +1,58 @@
+# tests/test_nucleo.py
+# Núcleo de asignación por días enteros frente al planificador de referencia (congelado) y al
+# motor por lotes, con los casos aleatorios de benchmarks/diferencial.py.
+import numpy as np
+import pandas as pd
+import pytest
+
+import planificador as P
+from diferencial import caso_aleatorio, diferencia
+from planificador_referencia import planificar_referencia
+
+
+@pytest.mark.parametrize("motor", [P.MOTOR_NUCLEO, P.MOTOR_PYTHON])
+@pytest.mark.parametrize("semilla", range(0, 40, 3))
+def test_coincide_con_la_referencia(motor, semilla):
+    opciones = dict(motor=motor, orden=P.ORDEN_CRONOLOGICO, procesos=1)
+    assert diferencia(caso_aleatorio(semilla, max_lotes=40), opciones) is None
+
+
+def _lotes(productos):
+    n = len(productos)
+    return pd.DataFrame({
+        "LOTE": [f"L{i}" for i in range(n)],
+        "PRODUCTO": productos,
+        "UNDS": [300] * n,
+        "DIA": pd.Timestamp("2025-03-04") + pd.to_timedelta(np.arange(n) % 3, unit="D"),
+        "DIAS_SAL_OPTIMOS": [12] * n,
+        "ENTRADA_SAL": pd.NaT,
+        "SALIDA_SAL": pd.NaT,
+    })
+
+
+@pytest.mark.parametrize("motor", [P.MOTOR_NUCLEO, P.MOTOR_PYTHON])
+def test_dias_max_vacio_no_encaja(motor):
+    lotes = _lotes(["JAMON-BLANCO", "JAMON-IBERICO", "JAMON-BLANCO", "PALETA-BLANCO"])
+    args = (5, {"JAMON-BLANCO": np.nan}, P.ESTAB_CAP_DEFAULT, {}, {}, {})
+    plan, _ = P.planificar_filas_na(P.normalizar_lotes(lotes.copy()), *args, motor=motor, procesos=1)
+    ref, _ = planificar_referencia(lotes.copy(), *args)
+
+    blanco = (plan["PRODUCTO"] == "JAMON-BLANCO").to_numpy()
+    assert plan.loc[blanco, "LOTE_NO_ENCAJA"].all()
+    assert plan.loc[blanco, "ENTRADA_SAL"].isna().all()
+    assert plan.loc[~blanco, "ENTRADA_SAL"].notna().all()
+    assert P.no_encaja_a_texto(plan["LOTE_NO_ENCAJA"]).tolist() == \
+        P.no_encaja_a_texto(ref["LOTE_NO_ENCAJA"]).tolist()
+
+
+def test_nucleo_igual_que_motor_por_lotes():
+    caso = caso_aleatorio(7, max_lotes=80)
+    args = [caso[p] for p in ("dias_max_almacen_global", "dias_max_por_producto", "estab_cap",
+                              "cap_overrides_ent", "cap_overrides_sal", "estab_cap_overrides")]
+    kwargs = {p: caso[p] for p in ("cap_ent", "cap_sal", "dias_festivos", "ajuste_finde", "ajuste_festivos")}
+    planes = [
+        P.planificar_filas_na(P.normalizar_lotes(caso["lotes"].copy()), *args, **kwargs, motor=m, procesos=1)
+        for m in (P.MOTOR_NUCLEO, P.MOTOR_PYTHON)
+    ]
+    pd.testing.assert_frame_equal(planes[0][0], planes[1][0])
+    pd.testing.assert_frame_equal(planes[0][1], planes[1][1])
@@ -0,0 +1,54 @@
+# tests/test_orden_holgura.py
+# Orden de asignación por holgura (ORDEN_HOLGURA): primero los lotes menos flexibles.
+import pandas as pd
+import pytest
+
+import planificador as P
+
+LUNES = pd.Timestamp("2025-03-03")
+
+
+def _lote(pos, unds, dso, dmax, dia=LUNES):
+    return (pos, pos, dia, unds, dso, "JAMON-BLANCO", f"L{pos}", dmax, "BLANCO", 1)
+
+
+@pytest.mark.parametrize("motor", [P.MOTOR_NUCLEO, P.MOTOR_PYTHON])
+def test_el_orden_por_holgura_cambia_el_resultado(motor):
+    # Cabe un lote por día de entrada. L0 puede esperar dos días; L1 solo puede entrar el lunes.
+    lotes = pd.DataFrame({
+        "LOTE": ["L0", "L1"],
+        "PRODUCTO": ["A-FLEXIBLE", "B-URGENTE"],
+        "UNDS": [1000, 1000],
+        "DIA": [LUNES, LUNES],
+        "DIAS_SAL_OPTIMOS": [10, 10],
+        "ENTRADA_SAL": pd.NaT,
+        "SALIDA_SAL": pd.NaT,
+    })
+    args = (P.normalizar_lotes(lotes), 2, {"B-URGENTE": 0}, P.ESTAB_CAP_DEFAULT, {}, {}, {})
+    kw = dict(cap_ent=(1000, 1000), motor=motor, procesos=1)
+
+    cronologico, _ = P.planificar_filas_na(*args, orden=P.ORDEN_CRONOLOGICO, **kw)
+    assert cronologico["LOTE_NO_ENCAJA"].tolist() == [False, True]
+
+    holgura, _ = P.planificar_filas_na(*args, orden=P.ORDEN_HOLGURA, **kw)
+    assert holgura["LOTE_NO_ENCAJA"].tolist() == [False, False]
+    assert holgura["ENTRADA_SAL"].tolist() == [LUNES + pd.Timedelta(days=1), LUNES]
+
+
+def test_la_flexibilidad_puede_subir_con_el_desempate_por_festivo():
+    # Miércoles festivo: la SALIDA de L1 (DIA + 9) va al martes o al jueves, al que tenga menos carga.
+    # El martes solo admite 100 unds: al principio L1 no cabe (flexibilidad 0); cuando L0 carga
+    # el martes, su salida pasa al jueves y cabe (flexibilidad 1), así que L2 (1, menos unds) va antes.
+    libro = P.LibroCargas(
+        cap_overrides_sal={pd.Timestamp("2025-03-11"): {"CAP1": 100, "CAP2": 100}},
+        dias_festivos=list(P.DIAS_FESTIVOS_DEFAULT) + ["2025-03-12"],
+    )
+    lotes = [_lote(0, 200, 8, 0), _lote(1, 500, 9, 0), _lote(2, 300, 14, 0)]
+    resultados, orden = [], []
+    for l in P._orden_por_holgura(lotes, libro, resultados):
+        entrada = l[2]
+        salida = libro.salida_ajustada(entrada, l[4])
+        libro.registrar(l[2], entrada, salida, l[3])
+        resultados.append((l[0], l[1], entrada, salida))
+        orden.append(l[6])
+    assert orden == ["L0", "L2", "L1"]
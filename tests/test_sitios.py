@@ -0,0 +1,80 @@
+# tests/test_sitios.py
+# Planificación multisitio: capacidades propias por sitio y planificación por separado.
+import numpy as np
+import pandas as pd
+import pytest
+
+import planificador as P
+from sintetico import lotes_sinteticos
+
+ARGS = (5, {}, P.ESTAB_CAP_DEFAULT, {}, {}, {})
+
+
+def _dos_sitios(n=60):
+    """Las mismas recepciones en dos sitios, intercaladas fila a fila."""
+    a = lotes_sinteticos(n, semilla=5).assign(SITIO="NORTE")
+    b = lotes_sinteticos(n, semilla=5).assign(SITIO="SUR")
+    b["LOTE"] = "S" + b["LOTE"]
+    df = pd.concat([a, b]).sort_index(kind="stable").reset_index(drop=True)
+    return P.normalizar_lotes(df)
+
+
+def test_capacidades_aisladas_por_sitio():
+    df = _dos_sitios()
+    parametros_sitio = {"SUR": {"cap_ent": (100, 100)}}   # SUR casi no tiene capacidad de entrada
+    plan, sug = P.planificar_por_sitio(df, *ARGS, parametros_sitio=parametros_sitio, procesos=1)
+
+    assert plan["LOTE"].tolist() == df["LOTE"].tolist()
+    norte = (plan["SITIO"] == "NORTE").to_numpy()
+    # NORTE se planifica igual que si estuviera solo, con los parámetros comunes
+    solo, _ = P.planificar_filas_na(df[norte], *ARGS, procesos=1)
+    pd.testing.assert_frame_equal(plan[norte], solo)
+    # En SUR solo entran lotes que caben en su capacidad
+    entradas_sur = plan[~norte].groupby("ENTRADA_SAL")["UNDS"].sum()
+    assert (entradas_sur <= 100).all()
+    assert plan.loc[~norte, "LOTE_NO_ENCAJA"].sum() > plan.loc[norte, "LOTE_NO_ENCAJA"].sum()
+    assert set(sug["SITIO"]) <= {"NORTE", "SUR"}
+    assert sug.columns[0] == "SITIO"
+
+
+def test_paralelo_igual_que_sitio_a_sitio(monkeypatch):
+    df = _dos_sitios(40)
+    parametros_sitio = {"SUR": {"estab_cap": 1500}}
+    plan_1, sug_1 = P.planificar_por_sitio(df, *ARGS, parametros_sitio=parametros_sitio, procesos=1)
+    monkeypatch.setattr(P, "UMBRAL_PARALELO", 0)
+    plan_2, sug_2 = P.planificar_por_sitio(df, *ARGS, parametros_sitio=parametros_sitio, procesos=2)
+    pd.testing.assert_frame_equal(plan_1, plan_2)
+    pd.testing.assert_frame_equal(sug_1, sug_2)
+
+
+def test_un_solo_sitio_equivale_a_planificar_filas_na():
+    df = P.normalizar_lotes(lotes_sinteticos(30, semilla=6))
+    plan, sug = P.planificar_por_sitio(df, *ARGS, procesos=1)
+    plan_0, sug_0 = P.planificar_filas_na(df, *ARGS, procesos=1)
+    pd.testing.assert_frame_equal(plan, plan_0)
+    pd.testing.assert_frame_equal(sug, sug_0)
+
+
+def test_parametros_de_sitio_combina_overrides():
+    comunes = dict(estab_cap=4700, estab_cap_overrides={"2025-03-04": 1000, "2025-03-05": 2000})
+    p = P.parametros_de_sitio("SUR", {"SUR": {"estab_cap_overrides": {"2025-03-05": 3000}}}, **comunes)
+    assert p["estab_cap"] == 4700
+    assert p["estab_cap_overrides"] == {"2025-03-04": 1000, "2025-03-05": 3000}
+    assert P.parametros_de_sitio("NORTE", {"SUR": {"estab_cap": 1}}, **comunes) == comunes
+    with pytest.raises(ValueError):
+        P.parametros_de_sitio("SUR", {"SUR": {"dias_festivos": []}}, **comunes)
+
+
+def test_sitio_vacio_es_el_sitio_por_defecto():
+    df = pd.DataFrame({"SITIO": ["NORTE", None, " ", np.nan]})
+    assert P.sitio_de_filas(df).tolist() == ["NORTE"] + [P.SITIO_DEFECTO] * 3
+
+
+@pytest.mark.parametrize("con_sitio", [True, False])
+def test_plan_vacio(con_sitio):
+    df = P.normalizar_lotes(lotes_sinteticos(5, semilla=7).iloc[:0])
+    if con_sitio:
+        df["SITIO"] = pd.Series(dtype=object)
+    plan, sug = P.planificar_por_sitio(df, *ARGS, procesos=1)
+    assert plan.empty and sug.empty
+    assert (sug.columns[0] == "SITIO") == con_sitio
@@ -0,0 +1,70 @@
+# tests/test_validacion.py
+# Validación vectorizada de lotes recibidos e informe de filas rechazadas.
+import numpy as np
+import pandas as pd
+import pytest
+
+import planificador as P
+
+
+def _recepcion():
+    return pd.DataFrame({
+        "LOTE": ["L1", "L2", "L3", "L4", "L5", "L6", "L1", "L7"],
+        "PRODUCTO": ["JAMON-BLANCO"] * 8,
+        "UNDS": [100, 0, "abc", 12.5, 200, 300, 400, None],
+        "DIA": ["2025-03-04", "2025-03-04", "2025-03-04", "2025-03-04", "no", "2025-03-04", "2025-03-05", " "],
+        "DIAS_SAL_OPTIMOS": [12, 12, 12, 12, 12, 400, 12, 12],
+        "ENTRADA_SAL": [None, None, None, None, None, None, "2025-03-03", None],
+        "SALIDA_SAL": [None] * 8,
+    })
+
+
+def test_motivos_por_fila():
+    validos, rechazados = P.validar_lotes(_recepcion())
+    motivos = dict(zip(rechazados["LOTE"], rechazados["MOTIVO"]))
+    assert motivos == {
+        "L2": "UNDS debe ser ≥ 1",
+        "L3": "UNDS no es numérico",
+        "L4": "UNDS no es entero",
+        "L5": "DIA no es una fecha",
+        "L6": "DIAS_SAL_OPTIMOS debe ser entre 0 y 365",
+        "L1": "ENTRADA_SAL anterior a DIA",
+        "L7": "DIA vacío; UNDS vacío",
+    }
+    # FILA de Excel: cabecera + base 1
+    assert rechazados["FILA"].tolist() == [3, 4, 5, 6, 7, 8, 9]
+    assert validos["LOTE"].tolist() == ["L1"]
+    assert validos.index.tolist() == [0]
+
+
+def test_lote_repetido_se_queda_la_primera_valida():
+    df = pd.DataFrame({
+        "LOTE": ["A", "A", "A", " A "],
+        "UNDS": [0, 100, 200, 300],   # la primera aparición no es válida: no cuenta
+        "DIA": ["2025-03-04"] * 4,
+        "DIAS_SAL_OPTIMOS": [10] * 4,
+    })
+    validos, rechazados = P.validar_lotes(df)
+    assert validos["UNDS"].tolist() == [100]
+    assert rechazados["MOTIVO"].tolist() == ["UNDS debe ser ≥ 1", "LOTE repetido", "LOTE repetido"]
+
+    validos, rechazados = P.validar_lotes(df, rechazar_duplicados=False)
+    assert validos["UNDS"].tolist() == [100, 200, 300]
+    assert len(rechazados) == 1
+
+
+def test_validos_normalizados():
+    validos, _ = P.validar_lotes(_recepcion().iloc[[0]])
+    assert pd.api.types.is_datetime64_any_dtype(validos["DIA"])
+    assert np.issubdtype(validos["UNDS"].dtype, np.integer)
+
+
+def test_falta_columna_obligatoria():
+    with pytest.raises(ValueError, match="DIAS_SAL_OPTIMOS"):
+        P.validar_lotes(pd.DataFrame({"LOTE": ["L1"], "UNDS": [1], "DIA": ["2025-03-04"]}))
+
+
+def test_sin_filas():
+    validos, rechazados = P.validar_lotes(_recepcion().iloc[:0])
+    assert validos.empty and rechazados.empty
+    assert list(rechazados.columns[:2]) == P.COLUMNAS_RECHAZO